@@ -40,4 +40,34 @@ resource "aws_dynamodb_table" "ecomonitor_sensor_data" {
     Environment = "production"
     Project     = "EcoMonitor"
   }
-}
\ No newline at end of file
+}
+
+# Shared error-notification windows of the processor (ecomonitor.alerts). On demand, so an
+# error storm never competes with reading writes for the provisioned capacity above
+resource "aws_dynamodb_table" "ecomonitor_alert_state" {
+  name         = "ecomonitor_alert_state"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "fingerprint"
+  range_key    = "window_start"
+
+  attribute {
+    name = "fingerprint"
+    type = "S"
+  }
+
+  attribute {
+    name = "window_start"
+    type = "N"
+  }
+
+  ttl {
+    attribute_name = "expiry_time"
+    enabled        = true
+  }
+
+  tags = {
+    Name        = "ecomonitor-alert-state"
+    Environment = "production"
+    Project     = "EcoMonitor"
+  }
+}
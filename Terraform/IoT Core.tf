@@ -115,7 +115,7 @@ resource "aws_iot_topic_rule" "temperature_rule" {
   name        = "temperature_data_rule"
   description = "Rule for processing temperature sensor data"
   enabled     = true
-  sql         = "SELECT *, timestamp() as timestamp FROM 'eco/sensors/temperature'"
+  sql         = "SELECT *, timestamp() as received_at FROM 'eco/sensors/temperature'"
   sql_version = "2016-03-23"
 
   cloudwatch_logs {
@@ -125,7 +125,7 @@ resource "aws_iot_topic_rule" "temperature_rule" {
   
   s3 {
     bucket_name = aws_s3_bucket.ecomonitor_raw_data.bucket
-    key         = "sensors/temperature/${timestamp()}.json"
+    key         = "sensors/temperature/$${timestamp()}.json"
     role_arn    = aws_iam_role.iot_role.arn
   }
 }
@@ -135,7 +135,7 @@ resource "aws_iot_topic_rule" "humidity_rule" {
   name        = "humidity_data_rule"
   description = "Rule for processing humidity sensor data"
   enabled     = true
-  sql         = "SELECT *, timestamp() as timestamp FROM 'eco/sensors/humidity'"
+  sql         = "SELECT *, timestamp() as received_at FROM 'eco/sensors/humidity'"
   sql_version = "2016-03-23"
 
   cloudwatch_logs {
@@ -145,7 +145,7 @@ resource "aws_iot_topic_rule" "humidity_rule" {
   
   s3 {
     bucket_name = aws_s3_bucket.ecomonitor_raw_data.bucket
-    key         = "sensors/humidity/${timestamp()}.json"
+    key         = "sensors/humidity/$${timestamp()}.json"
     role_arn    = aws_iam_role.iot_role.arn
   }
 }
@@ -154,7 +154,7 @@ resource "aws_iot_topic_rule" "aqi_rule" {
   name        = "aqi_data_rule"
   description = "Rule for processing air quality sensor data"
   enabled     = true
-  sql         = "SELECT *, timestamp() as timestamp FROM 'eco/sensors/aqi'"
+  sql         = "SELECT *, timestamp() as received_at FROM 'eco/sensors/aqi'"
   sql_version = "2016-03-23"
 
   cloudwatch_logs {
@@ -164,7 +164,7 @@ resource "aws_iot_topic_rule" "aqi_rule" {
   
   s3 {
     bucket_name = aws_s3_bucket.ecomonitor_raw_data.bucket
-    key         = "sensors/aqi/${timestamp()}.json"
+    key         = "sensors/aqi/$${timestamp()}.json"
     role_arn    = aws_iam_role.iot_role.arn
   }
 }
@@ -173,7 +173,7 @@ resource "aws_iot_topic_rule" "co2_rule" {
   name        = "co2_data_rule"
   description = "Rule for processing CO2 sensor data"
   enabled     = true
-  sql         = "SELECT *, timestamp() as timestamp FROM 'eco/sensors/co2'"
+  sql         = "SELECT *, timestamp() as received_at FROM 'eco/sensors/co2'"
   sql_version = "2016-03-23"
 
   cloudwatch_logs {
@@ -183,7 +183,23 @@ resource "aws_iot_topic_rule" "co2_rule" {
   
   s3 {
     bucket_name = aws_s3_bucket.ecomonitor_raw_data.bucket
-    key         = "sensors/co2/${timestamp()}.json"
+    key         = "sensors/co2/$${timestamp()}.json"
+    role_arn    = aws_iam_role.iot_role.arn
+  }
+}
+
+# Multi-reading envelopes (binary, see ecomonitor.envelope) are stored as-is: a binary
+# payload can only be selected whole, and the processor derives every other field
+resource "aws_iot_topic_rule" "envelope_rule" {
+  name        = "envelope_data_rule"
+  description = "Rule for storing multi-reading sensor envelopes"
+  enabled     = true
+  sql         = "SELECT * FROM 'eco/sensors/envelope'"
+  sql_version = "2016-03-23"
+
+  s3 {
+    bucket_name = aws_s3_bucket.ecomonitor_raw_data.bucket
+    key         = "sensors/envelope/$${timestamp()}-$${newuuid()}.emv"
     role_arn    = aws_iam_role.iot_role.arn
   }
 }
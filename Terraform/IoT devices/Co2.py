@@ -1,66 +1,52 @@
+from ecomonitor import initprofile
+initprofile.start()
+
 import json
 import random
-import boto3
-import logging
 import os
 import datetime
+from ecomonitor.metrics import MetricsBuffer
+from ecomonitor.log import configure
+from ecomonitor.profiles import get_profile
+from ecomonitor.runtime import get_client, record_client_metrics
+from ecomonitor.sortkeys import datetime_key
+from ecomonitor.timing import StageTimer
+
+initprofile.finish()
+
+# Set up logging: readings are only logged in full with LOG_DEBUG_PAYLOADS=true
+log = configure()
 
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# Metrics are buffered and sent in one call when the handler finishes
+metrics = MetricsBuffer('EcoMonitor/SensorData', default_dimensions=[
+    {'Name': 'SensorType', 'Value': 'CO2'},
+    {'Name': 'DeviceId', 'Value': 'co2_sensor_01'}
+])
+# Classify/publish/flush latency percentiles go to EcoMonitor/DataPipeline
+timer = StageTimer(metrics)
 
 def put_sensor_metric(metric_name, value, unit='None'):
-    """Put custom metric to CloudWatch for sensor data"""
-    try:
-        cloudwatch = boto3.client('cloudwatch')
-        cloudwatch.put_metric_data(
-            Namespace='EcoMonitor/SensorData',
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': unit,
-                    'Timestamp': datetime.datetime.utcnow(),
-                    'Dimensions': [
-                        {
-                            'Name': 'SensorType',
-                            'Value': 'CO2'
-                        },
-                        {
-                            'Name': 'DeviceId',
-                            'Value': 'co2_sensor_01'
-                        }
-                    ]
-                },
-            ]
-        )
-    except Exception as e:
-        logger.error(f"Failed to put metric {metric_name}: {str(e)}")
+    """Buffer a custom metric for CloudWatch sensor data"""
+    metrics.put(metric_name, value, unit)
 
+@metrics.flush_after
+@timer.instrument
 def lambda_handler(event, context):
     # Get the IoT endpoint from environment variables
     iot_endpoint = os.environ.get('IOT_ENDPOINT')
+    log.bind(request_id=context.aws_request_id)
     
     # Generate random CO2 data (in ppm)
     co2_level = round(random.uniform(300.0, 1500.0), 1)
     
     # Determine CO2 level category with more detailed breakdown
-    if co2_level < 400:
-        category = "Excellent"
-        health_impact = "Fresh outdoor air level"
-    elif co2_level < 600:
-        category = "Good"
-        health_impact = "Acceptable indoor air quality"
-    elif co2_level < 1000:
-        category = "Acceptable"
-        health_impact = "Drowsiness may occur"
-    elif co2_level < 1500:
-        category = "High"
-        health_impact = "Stuffy air, poor concentration"
-    else:
-        category = "Very High"
-        health_impact = "Immediate ventilation required"
+    with timer.stage('classify'):
+        classification = get_profile('co2').classify(co2_level)
+    category = classification['category']
+    health_impact = classification['health_impact']
     
+    # The sort key is the reading's own time, so a device's items are ordered by it
+    reading_time = datetime.datetime.utcnow()
     # Create the payload
     payload = {
         'device_id': 'co2_sensor_01',
@@ -68,12 +54,12 @@ def lambda_handler(event, context):
         'unit': 'ppm',
         'category': category,
         'health_impact': health_impact,
-        'timestamp': context.aws_request_id,
-        'reading_time': datetime.datetime.utcnow().isoformat()
+        'timestamp': datetime_key(reading_time, context.aws_request_id),
+        'reading_time': reading_time.isoformat()
     }
     
-    # Log the sensor data with enhanced formatting
-    logger.info(f"🫁 [CO2 SENSOR] CO2 sensor data: {json.dumps(payload)}")
+    # The reading itself is a debug payload; the publish line below carries its key fields
+    log.payload('sensor.reading', "🫁 [CO2 SENSOR] CO2 sensor data", payload)
     
     # Put custom metrics to CloudWatch
     put_sensor_metric('CO2Reading', co2_level, 'None')
@@ -85,17 +71,22 @@ def lambda_handler(event, context):
     elif category == "Excellent":
         put_sensor_metric('ExcellentAirQuality', 1, 'Count')
     
-    # Publish to IoT Core topic
-    client = boto3.client('iot-data', endpoint_url=f'https://{iot_endpoint}')
+    # Publish to IoT Core topic (client is reused across warm invocations)
+    client = get_client('iot-data', endpoint_url=f'https://{iot_endpoint}')
+    
+    with timer.stage('iot_publish'):
+        response = client.publish(
+            topic='eco/sensors/co2',
+            qos=1,
+            payload=json.dumps(payload)
+        )
     
-    response = client.publish(
-        topic='eco/sensors/co2',
-        qos=1,
-        payload=json.dumps(payload)
-    )
+    log.info('iot.publish', "✅ [IOT PUBLISH] Published reading", topic='eco/sensors/co2', device_id=payload['device_id'],
+             category=category, status=response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
     
-    # Log the response
-    logger.info(f"✅ [IOT PUBLISH] IoT publish response: {response}")
+    # Report client init time vs reuse alongside the sensor metrics
+    record_client_metrics(metrics)
+    initprofile.report(metrics)
     
     return {
         'statusCode': 200,
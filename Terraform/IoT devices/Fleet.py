@@ -0,0 +1,228 @@
+from ecomonitor import initprofile
+initprofile.start()
+
+import json
+import random
+import os
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from ecomonitor import envelope
+from ecomonitor.log import configure
+from ecomonitor.metrics import MetricsBuffer
+from ecomonitor.profiles import get_profile
+from ecomonitor.ratelimit import TokenBucket
+from ecomonitor.runtime import get_client, record_client_metrics
+from ecomonitor.sortkeys import datetime_key
+from ecomonitor.timing import StageTimer
+
+initprofile.finish()
+
+# Set up logging
+log = configure()
+
+# Fleet configuration (all of it can be overridden per invocation through the event)
+DEVICE_CATALOG = os.environ.get('DEVICE_CATALOG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_catalog.json'))
+FLEET_CONCURRENCY = int(os.environ.get('FLEET_CONCURRENCY', '32'))
+FLEET_RATE_LIMIT = float(os.environ.get('FLEET_RATE_LIMIT', '0'))  # messages/second, 0 = unlimited
+# 'envelope' packs many readings per message (binary, see ecomonitor.envelope), 'envelope-json'
+# uses the envelope's JSON fallback, 'json' publishes one document per reading on the sensor topics
+FLEET_PAYLOAD_FORMAT = os.environ.get('FLEET_PAYLOAD_FORMAT', 'envelope').lower()
+FLEET_ENVELOPE_SIZE = int(os.environ.get('FLEET_ENVELOPE_SIZE', '500'))  # readings per envelope
+
+# Metrics are merged per sensor type and sent once per invocation
+metrics = MetricsBuffer('EcoMonitor/SensorData', default_dimensions=[
+    {'Name': 'SensorType', 'Value': 'Fleet'}
+])
+# Classify/publish/flush latency percentiles go to EcoMonitor/DataPipeline
+timer = StageTimer(metrics)
+
+_catalog_cache = {}
+
+def read_catalog_document(source):
+    """Read a catalog from a local path or an s3://bucket/key URI"""
+    if source.startswith('s3://'):
+        bucket, _, key = source[len('s3://'):].partition('/')
+        response = get_client('s3').get_object(Bucket=bucket, Key=key)
+        return json.loads(response['Body'].read())
+    with open(source) as catalog_file:
+        return json.load(catalog_file)
+
+def expand_catalog(document):
+    """
+    Flatten a catalog into a list of devices.
+    Explicit entries under 'devices' are kept as-is; each entry under 'groups'
+    expands into `count` devices named `<id_prefix><n>` with rotating locations.
+    """
+    devices = []
+    for device in document.get('devices', []):
+        get_profile(device['sensor_type'])
+        devices.append(device)
+
+    for group in document.get('groups', []):
+        get_profile(group['sensor_type'])
+        locations = group.get('locations') or [group.get('location')]
+        prefix = group.get('id_prefix', f"{group['sensor_type']}_sensor_")
+        width = len(str(group['count']))
+        for n in range(group['count']):
+            devices.append({
+                'device_id': f"{prefix}{n + 1:0{width}d}",
+                'sensor_type': group['sensor_type'],
+                'location': locations[n % len(locations)],
+                'distribution': group.get('distribution')
+            })
+    return devices
+
+def load_catalog(source):
+    """Expanded device list for a catalog source, cached for the container lifetime"""
+    devices = _catalog_cache.get(source)
+    if devices is None:
+        devices = expand_catalog(read_catalog_document(source))
+        _catalog_cache[source] = devices
+        log.info('fleet.catalog', "📒 [FLEET] Loaded device catalog", devices=len(devices), source=source)
+    return devices
+
+def generate_readings(devices, readings_per_device, request_id, rng=random):
+    """Build (profile, payload) pairs for every device"""
+    readings = []
+    sequence = 0
+    previous = None
+    for _ in range(readings_per_device):
+        # Rounds are at least 1 ms apart: envelopes key a reading by device and millisecond
+        moment = datetime.datetime.utcnow()
+        if previous is not None and moment < previous + datetime.timedelta(milliseconds=1):
+            moment = previous + datetime.timedelta(milliseconds=1)
+        previous = moment
+        reading_time = moment.isoformat()
+        for device in devices:
+            profile = get_profile(device['sensor_type'])
+            value = profile.sample(device.get('distribution'), rng)
+            payload = profile.build_payload(
+                device['device_id'],
+                value,
+                datetime_key(moment, f"{request_id}-{sequence}"),
+                reading_time,
+                device.get('location')
+            )
+            readings.append((profile, payload))
+            sequence += 1
+    return readings
+
+def build_messages(readings, payload_format, envelope_size, batch_id):
+    """
+    (topic, payload, readings) of every IoT message: one per reading for 'json',
+    otherwise envelopes of up to `envelope_size` readings on the envelope topic.
+    Envelopes leave out the category fields; the processor derives them again.
+    """
+    if payload_format == 'json':
+        return [(profile.topic, json.dumps(payload), [(profile, payload)]) for profile, payload in readings]
+    if payload_format not in ('envelope', 'envelope-json'):
+        raise ValueError(f"Unknown payload format: {payload_format}")
+
+    entries = [
+        (payload['device_id'], profile.sensor_type, payload[profile.value_field],
+         datetime.datetime.fromisoformat(payload['reading_time']), payload.get('location'), payload.get('unit'))
+        for profile, payload in readings
+    ]
+    encoding = 'json' if payload_format == 'envelope-json' else 'binary'
+    messages = []
+    position = 0
+    for payload, group in envelope.pack(entries, batch_id, envelope_size, encoding):
+        messages.append((envelope.ENVELOPE_TOPIC, payload, readings[position:position + len(group)]))
+        position += len(group)
+    return messages
+
+def publish_messages(client, messages, concurrency, rate_limit):
+    """Publish messages on a thread pool, throttled by a shared token bucket. Returns (readings, error) per message."""
+    bucket = TokenBucket(rate_limit)
+
+    def publish(message):
+        topic, payload, readings = message
+        bucket.acquire()
+        try:
+            with timer.stage('iot_publish'):
+                client.publish(topic=topic, qos=1, payload=payload)
+            return readings, None
+        except Exception as e:
+            return readings, e
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        return list(executor.map(publish, messages))
+
+@metrics.flush_after
+@timer.instrument
+def lambda_handler(event, context):
+    event = event or {}
+    iot_endpoint = os.environ.get('IOT_ENDPOINT')
+    log.bind(request_id=context.aws_request_id)
+
+    devices = load_catalog(event.get('catalog', DEVICE_CATALOG))
+    device_count = event.get('device_count')
+    if device_count is not None:
+        devices = devices[:int(device_count)]
+    readings_per_device = int(event.get('readings_per_device', 1))
+    concurrency = int(event.get('concurrency', FLEET_CONCURRENCY))
+    rate_limit = float(event.get('rate_limit', FLEET_RATE_LIMIT))
+    payload_format = str(event.get('payload_format', FLEET_PAYLOAD_FORMAT)).lower()
+    envelope_size = int(event.get('envelope_size', FLEET_ENVELOPE_SIZE))
+
+    with timer.stage('generate'):
+        readings = generate_readings(devices, readings_per_device, context.aws_request_id)
+    with timer.stage('encode'):
+        messages = build_messages(readings, payload_format, envelope_size, context.aws_request_id)
+    payload_bytes = sum(len(payload) for _, payload, _ in messages)
+    log.info('fleet.start', "🚀 [FLEET] Publishing readings", readings=len(readings), devices=len(devices),
+             messages=len(messages), payload_format=payload_format, payload_bytes=payload_bytes,
+             concurrency=concurrency, rate_limit=rate_limit or 'unlimited')
+
+    # Publish to IoT Core (client is reused across warm invocations)
+    client = get_client('iot-data', endpoint_url=f'https://{iot_endpoint}')
+
+    started = time.perf_counter()
+    outcomes = publish_messages(client, messages, concurrency, rate_limit)
+    elapsed = time.perf_counter() - started
+
+    published = 0
+    messages_published = 0
+    failed_messages = 0
+    errors = 0
+    for message_readings, error in outcomes:
+        if error is None:
+            messages_published += 1
+            published += len(message_readings)
+            for profile, payload in message_readings:
+                dimensions = [{'Name': 'SensorType', 'Value': profile.metric_dimension}]
+                metrics.put(profile.metric_name, payload[profile.value_field], profile.metric_unit, dimensions)
+        else:
+            errors += len(message_readings)
+            failed_messages += 1
+            if failed_messages <= 5:
+                log.failure('iot.publish_failed', "❌ [ERROR] Failed to publish to IoT Core", record=message_readings[0][1],
+                            error=error, readings=len(message_readings))
+
+    rate = messages_published / elapsed if elapsed > 0 else 0.0
+    log.info('fleet.done', "✅ [FLEET] Published readings", published=published, readings=len(readings),
+             messages=messages_published, elapsed_seconds=round(elapsed, 2), messages_per_second=round(rate))
+
+    metrics.put('FleetMessagesPublished', messages_published, 'Count')
+    metrics.put('FleetReadingsPublished', published, 'Count')
+    metrics.put('FleetPublishErrors', errors, 'Count')
+    metrics.put('FleetPublishRate', rate, 'Count/Second')
+    if readings:
+        metrics.put('FleetBytesPerReading', payload_bytes / len(readings), 'Bytes')
+    record_client_metrics(metrics)
+    initprofile.report(metrics)
+
+    return {
+        'statusCode': 200 if errors == 0 else 207,
+        'body': json.dumps({
+            'message': 'Fleet readings published',
+            'devices': len(devices),
+            'published': published,
+            'messages': messages_published,
+            'payload_bytes': payload_bytes,
+            'errors': errors,
+            'elapsed_seconds': round(elapsed, 3),
+            'messages_per_second': round(rate, 1)
+        })
+    }
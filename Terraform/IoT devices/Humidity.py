@@ -1,71 +1,62 @@
+from ecomonitor import initprofile
+initprofile.start()
+
 import json
 import random
-import boto3
-import logging
 import os
 import datetime
+from ecomonitor.metrics import MetricsBuffer
+from ecomonitor.log import configure
+from ecomonitor.profiles import get_profile
+from ecomonitor.runtime import get_client, record_client_metrics
+from ecomonitor.sortkeys import datetime_key
+from ecomonitor.timing import StageTimer
+
+initprofile.finish()
+
+# Set up logging: readings are only logged in full with LOG_DEBUG_PAYLOADS=true
+log = configure()
 
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# Metrics are buffered and sent in one call when the handler finishes
+metrics = MetricsBuffer('EcoMonitor/SensorData', default_dimensions=[
+    {'Name': 'SensorType', 'Value': 'Humidity'},
+    {'Name': 'DeviceId', 'Value': 'humidity_sensor_01'}
+])
+# Classify/publish/flush latency percentiles go to EcoMonitor/DataPipeline
+timer = StageTimer(metrics)
 
 def put_sensor_metric(metric_name, value, unit='None'):
-    """Put custom metric to CloudWatch for sensor data"""
-    try:
-        cloudwatch = boto3.client('cloudwatch')
-        cloudwatch.put_metric_data(
-            Namespace='EcoMonitor/SensorData',
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': unit,
-                    'Timestamp': datetime.datetime.utcnow(),
-                    'Dimensions': [
-                        {
-                            'Name': 'SensorType',
-                            'Value': 'Humidity'
-                        },
-                        {
-                            'Name': 'DeviceId',
-                            'Value': 'humidity_sensor_01'
-                        }
-                    ]
-                },
-            ]
-        )
-    except Exception as e:
-        logger.error(f"Failed to put metric {metric_name}: {str(e)}")
+    """Buffer a custom metric for CloudWatch sensor data"""
+    metrics.put(metric_name, value, unit)
 
+@metrics.flush_after
+@timer.instrument
 def lambda_handler(event, context):
     # Get the IoT endpoint from environment variables
     iot_endpoint = os.environ.get('IOT_ENDPOINT')
+    log.bind(request_id=context.aws_request_id)
     
     # Generate random humidity data (in percentage)
     humidity = round(random.uniform(30.0, 90.0), 1)
     
     # Determine humidity category
-    if humidity < 40:
-        category = "Low"
-    elif humidity < 60:
-        category = "Optimal"
-    elif humidity < 75:
-        category = "High"
-    else:
-        category = "Very High"
+    with timer.stage('classify'):
+        category = get_profile('humidity').classify(humidity)['category']
     
+    # The sort key is the reading's own time, so a device's items are ordered by it
+    reading_time = datetime.datetime.utcnow()
     # Create the payload
     payload = {
         'device_id': 'humidity_sensor_01',
         'humidity': humidity,
         'unit': 'percentage',
         'category': category,
-        'timestamp': context.aws_request_id,
-        'reading_time': datetime.datetime.utcnow().isoformat()
+        'timestamp': datetime_key(reading_time, context.aws_request_id),
+        'reading_time': reading_time.isoformat()
     }
     
-    # Log the sensor data with enhanced formatting
-    logger.info(f"💧 [HUMIDITY SENSOR] Humidity sensor data: {json.dumps(payload)}")
+    # The reading itself is a debug payload; the publish line below carries its key fields
+    log.payload('sensor.reading', "💧 [HUMIDITY SENSOR] Humidity sensor data", payload)
     
     # Put custom metrics to CloudWatch
     put_sensor_metric('HumidityReading', humidity, 'Percent')
@@ -77,17 +68,22 @@ def lambda_handler(event, context):
     elif category == "Low":
         put_sensor_metric('LowHumidityAlert', 1, 'Count')
     
-    # Publish to IoT Core topic
-    client = boto3.client('iot-data', endpoint_url=f'https://{iot_endpoint}')
+    # Publish to IoT Core topic (client is reused across warm invocations)
+    client = get_client('iot-data', endpoint_url=f'https://{iot_endpoint}')
+    
+    with timer.stage('iot_publish'):
+        response = client.publish(
+            topic='eco/sensors/humidity',
+            qos=1,
+            payload=json.dumps(payload)
+        )
     
-    response = client.publish(
-        topic='eco/sensors/humidity',
-        qos=1,
-        payload=json.dumps(payload)
-    )
+    log.info('iot.publish', "✅ [IOT PUBLISH] Published reading", topic='eco/sensors/humidity', device_id=payload['device_id'],
+             category=category, status=response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
     
-    # Log the response
-    logger.info(f"✅ [IOT PUBLISH] IoT publish response: {response}")
+    # Report client init time vs reuse alongside the sensor metrics
+    record_client_metrics(metrics)
+    initprofile.report(metrics)
     
     return {
         'statusCode': 200,
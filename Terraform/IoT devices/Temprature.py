@@ -1,83 +1,55 @@
+from ecomonitor import initprofile
+initprofile.start()
+
 import json
 import random
-import boto3
-import logging
 import os
 import datetime
+from ecomonitor.metrics import MetricsBuffer
+from ecomonitor.log import configure
+from ecomonitor.profiles import get_profile
+from ecomonitor.runtime import get_client, record_client_metrics
+from ecomonitor.sortkeys import datetime_key
+from ecomonitor.timing import StageTimer
+
+initprofile.finish()
 
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# Set up logging: readings are only logged in full with LOG_DEBUG_PAYLOADS=true
+log = configure()
 
-# Initialize CloudWatch client
-cloudwatch = boto3.client('cloudwatch')
+# Metrics are buffered and sent in one call when the handler finishes
+metrics = MetricsBuffer('EcoMonitor/SensorData', default_dimensions=[
+    {'Name': 'SensorType', 'Value': 'Temperature'},
+    {'Name': 'DeviceId', 'Value': 'temp_sensor_01'}
+])
+# Classify/publish/flush latency percentiles go to EcoMonitor/DataPipeline
+timer = StageTimer(metrics)
 
 def put_sensor_metric(metric_name, value, unit='None', dimensions=None):
-    """Publish custom metrics to CloudWatch for enhanced dashboard visuals"""
-    try:
-        cloudwatch.put_metric_data(
-            Namespace='EcoMonitor/SensorData',
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': unit,
-                    'Timestamp': datetime.datetime.utcnow(),
-                    'Dimensions': dimensions or [
-                        {
-                            'Name': 'SensorType',
-                            'Value': 'Temperature'
-                        },
-                        {
-                            'Name': 'DeviceId',
-                            'Value': 'temp_sensor_01'
-                        }
-                    ]
-                },
-            ]
-        )
-    except Exception as e:
-        logger.error(f"Failed to put metric {metric_name}: {str(e)}")
+    """Buffer custom metrics for CloudWatch enhanced dashboard visuals"""
+    metrics.put(metric_name, value, unit, dimensions)
 
+@metrics.flush_after
+@timer.instrument
 def lambda_handler(event, context):
     # Get the IoT endpoint from environment variables
     iot_endpoint = os.environ.get('IOT_ENDPOINT')
+    log.bind(request_id=context.aws_request_id)
     
     # Generate random temperature data (in Celsius)
     temperature = round(random.uniform(18.0, 35.0), 1)
     
     # Determine temperature category and health status
-    if temperature < 18:
-        category = "Very Cold"
-        health_status = "Alert"
-        alert_count = 1
-        good_conditions = 0
-        unhealthy_conditions = 1
-    elif temperature < 20:
-        category = "Cold"
-        health_status = "Moderate"
-        alert_count = 0
-        good_conditions = 0
-        unhealthy_conditions = 0
-    elif temperature <= 28:
-        category = "Optimal"
-        health_status = "Good"
-        alert_count = 0
-        good_conditions = 1
-        unhealthy_conditions = 0
-    elif temperature <= 35:
-        category = "Warm"
-        health_status = "Moderate"
-        alert_count = 0
-        good_conditions = 0
-        unhealthy_conditions = 0
-    else:
-        category = "Very Hot"
-        health_status = "Alert"
-        alert_count = 1
-        good_conditions = 0
-        unhealthy_conditions = 1
+    with timer.stage('classify'):
+        classification = get_profile('temperature').classify(temperature)
+    category = classification['category']
+    health_status = classification['health_status']
+    alert_count = 1 if health_status == "Alert" else 0
+    good_conditions = 1 if health_status == "Good" else 0
+    unhealthy_conditions = 1 if health_status == "Alert" else 0
     
+    # The sort key is the reading's own time, so a device's items are ordered by it
+    reading_time = datetime.datetime.utcnow()
     # Create the enhanced payload
     payload = {
         'device_id': 'temp_sensor_01',
@@ -85,14 +57,13 @@ def lambda_handler(event, context):
         'unit': 'Celsius',
         'category': category,
         'health_status': health_status,
-        'timestamp': context.aws_request_id,
-        'reading_time': datetime.datetime.utcnow().isoformat(),
+        'timestamp': datetime_key(reading_time, context.aws_request_id),
+        'reading_time': reading_time.isoformat(),
         'location': 'EcoMonitor_Zone_A'
     }
     
-    # Enhanced logging with visual indicators
-    logger.info(f"🌡️ [TEMPERATURE SENSOR] Temperature sensor data: {json.dumps(payload)}")
-    logger.info(f"📊 [METRICS] Temp: {temperature}°C | Category: {category} | Health: {health_status}")
+    # The reading itself is a debug payload; the publish line below carries its key fields
+    log.payload('sensor.reading', "🌡️ [TEMPERATURE SENSOR] Temperature sensor data", payload)
     
     # Put comprehensive metrics to CloudWatch for enhanced visuals
     put_sensor_metric('TemperatureReading', temperature, 'None')
@@ -122,20 +93,26 @@ def lambda_handler(event, context):
     if temperature < 18 or temperature > 35:
         put_sensor_metric('CriticalTemperature', 1, 'Count')
     
-    # Publish to IoT Core topic
+    # Publish to IoT Core topic (client is reused across warm invocations)
     try:
-        client = boto3.client('iot-data', endpoint_url=f'https://{iot_endpoint}')
+        client = get_client('iot-data', endpoint_url=f'https://{iot_endpoint}')
         
-        response = client.publish(
-            topic='sensor/temperature',
-            qos=1,
-            payload=json.dumps(payload)
-        )
+        with timer.stage('iot_publish'):
+            response = client.publish(
+                topic='sensor/temperature',
+                qos=1,
+                payload=json.dumps(payload)
+            )
         
-        logger.info(f"✅ [SUCCESS] Published temperature data to IoT Core: {response}")
+        log.info('iot.publish', "✅ [SUCCESS] Published temperature data to IoT Core", topic='sensor/temperature', device_id=payload['device_id'],
+                 temperature=temperature, category=category, health_status=health_status, status=response.get('ResponseMetadata', {}).get('HTTPStatusCode'))
         
     except Exception as e:
-        logger.error(f"❌ [ERROR] Failed to publish to IoT Core: {str(e)}")
+        log.failure('iot.publish_failed', "❌ [ERROR] Failed to publish to IoT Core", record=payload, error=e)
+    
+    # Report client init time vs reuse alongside the sensor metrics
+    record_client_metrics(metrics)
+    initprofile.report(metrics)
     
     return {
         'statusCode': 200,
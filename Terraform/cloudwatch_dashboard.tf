@@ -271,6 +271,25 @@ resource "aws_cloudwatch_metric_alarm" "dynamo_throttles" {
   }
 }
 
+# Aggregated anomaly alert: devices deviating from their own history (outliers, flatlines)
+resource "aws_cloudwatch_metric_alarm" "anomalous_devices" {
+  alarm_name          = "ecomonitor-anomalous-devices"
+  comparison_operator = "GreaterThanThreshold"
+  evaluation_periods  = "1"
+  metric_name         = "AnomalousDevices"
+  namespace           = "EcoMonitor/DataPipeline"
+  period              = "300"
+  statistic           = "Sum"
+  threshold           = "0"
+  treat_missing_data  = "notBreaching"
+  alarm_description   = "Devices flagged by the processor's per-device outlier/flatline detector"
+  alarm_actions       = [aws_sns_topic.ecomonitor_errors.arn]
+
+  tags = {
+    Name = "EcoMonitor-Anomalous-Devices"
+  }
+}
+
 # Custom CloudWatch Metrics for data pipeline monitoring
 resource "aws_cloudwatch_log_metric_filter" "successful_transfers" {
   name           = "SuccessfulDataTransfers"
@@ -0,0 +1,146 @@
+"""
+Archive of readings before their retention ends.
+
+Readings expire through the table's TTL (`expiry_time`, set at ingest from
+RETENTION_POLICY, see ecomonitor.retention). This job exports every reading of
+a date to compressed ECOL parts under archive/readings/dt=YYYY-MM-DD/ in the raw
+bucket, ARCHIVE_LEAD_DAYS before the first of them can expire. The Lambda entry
+point runs hourly: it archives the due dates that have no complete archive yet
+and stops before its time runs out, so a large date is finished by the next
+runs. It then adds the readings that arrived for already archived dates
+(marked by the processor, see retention.archive_late_dates) to their archives.
+From the command line it exports a range of dates or reads one back.
+
+Usage (from Terraform/, with the shared layer on the path):
+    PYTHONPATH=layers/common/python python "data cleaner/archive_readings.py" --start 2024-05-01 --end 2024-05-08
+    PYTHONPATH=layers/common/python python "data cleaner/archive_readings.py" --read 2024-05-01 --columns device_id,timestamp,temperature
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import time
+
+from ecomonitor import retention
+from ecomonitor.runtime import get_client, get_resource
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+BUCKET_NAME = os.environ.get('RAW_BUCKET_NAME')
+TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME', 'ecomonitor_processed_data')
+# Stop starting new units when less than this is left of the invocation
+TIME_MARGIN_MS = int(os.environ.get('ARCHIVE_TIME_MARGIN_MS', '120000'))
+
+def archive_dates(table, s3, bucket, dates, include_packed=retention.ARCHIVE_PACKED, should_stop=None, force=False):
+    """Archive each date in turn; returns (manifests, pending dates)"""
+    manifests, pending = [], []
+    for reading_date in dates:
+        manifest = None
+        if not pending:
+            manifest = retention.archive_date(table, s3, bucket, reading_date, include_packed=include_packed,
+                                              should_stop=should_stop, force=force)
+        if manifest is None:
+            pending.append(reading_date.isoformat())
+        else:
+            manifests.append(manifest)
+    return manifests, pending
+
+def archive_late(table, s3, bucket, include_packed=retention.ARCHIVE_PACKED, should_stop=None):
+    """Add the late readings of archived dates; returns {date: rows added}"""
+    due = retention.due_dates()
+    return retention.archive_late_dates(table, s3, bucket, due[0] if due else datetime.date.min,
+                                        include_packed=include_packed, should_stop=should_stop)
+
+def lambda_handler(event, context):
+    """Scheduled entry point: archives the due dates (or event['dates'])"""
+    event = event or {}
+    if 'dates' in event:
+        dates = [datetime.date.fromisoformat(value) for value in event['dates']]
+    else:
+        dates = retention.due_dates()
+
+    table = get_resource('dynamodb').Table(event.get('table', TABLE_NAME))
+    s3 = get_client('s3')
+    bucket = event.get('bucket', BUCKET_NAME)
+    include_packed = event.get('packed', retention.ARCHIVE_PACKED)
+    should_stop = lambda: context.get_remaining_time_in_millis() < TIME_MARGIN_MS
+    manifests, pending = archive_dates(table, s3, bucket, dates, include_packed, should_stop=should_stop)
+    late = {} if pending else archive_late(table, s3, bucket, include_packed, should_stop)
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': f"Archived {len(manifests)} of {len(dates)} due dates",
+            'readings': sum(manifest['rows'] for manifest in manifests),
+            'archived': [manifest['date'] for manifest in manifests],
+            'pending': pending,
+            'late': late
+        })
+    }
+
+def date_range(start, end):
+    """Dates in [start, end)"""
+    current = start
+    while current < end:
+        yield current
+        current += datetime.timedelta(days=1)
+
+def read(s3, bucket, reading_date, columns, output):
+    """Write an archived date as NDJSON to `output`; returns the number of rows"""
+    count = 0
+    for row in retention.iter_archive(s3, bucket, reading_date, columns):
+        output.write(json.dumps(row, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive readings to compressed columnar files, or read an archive back")
+    parser.add_argument('--bucket', default=BUCKET_NAME, required=BUCKET_NAME is None)
+    parser.add_argument('--table', default=TABLE_NAME)
+    parser.add_argument('--start', help='first date to archive, e.g. 2024-05-01 (default: the due dates)')
+    parser.add_argument('--end', help='end date (exclusive, default: the day after --start)')
+    parser.add_argument('--packed', action='store_true', default=retention.ARCHIVE_PACKED, help='also archive hourly packed items')
+    parser.add_argument('--force', action='store_true', help='rewrite dates that are already archived (e.g. after a backfill)')
+    parser.add_argument('--read', metavar='DATE', help='print an archived date as NDJSON instead of archiving')
+    parser.add_argument('--columns', help='comma-separated columns to read (default: all)')
+    parser.add_argument('--output', help='NDJSON file for --read (default: stdout)')
+    args = parser.parse_args(argv)
+
+    s3 = get_client('s3')
+    started = time.perf_counter()
+    if args.read:
+        columns = [column.strip() for column in args.columns.split(',') if column.strip()] if args.columns else None
+        output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            count = read(s3, args.bucket, datetime.date.fromisoformat(args.read), columns, output)
+        except LookupError as e:
+            print(str(e), file=sys.stderr)
+            return 1
+        finally:
+            if args.output:
+                output.close()
+        print(f"Read {count} archived readings of {args.read} in {time.perf_counter() - started:.1f}s", file=sys.stderr)
+        return 0
+
+    if args.start:
+        start = datetime.date.fromisoformat(args.start)
+        end = datetime.date.fromisoformat(args.end) if args.end else start + datetime.timedelta(days=1)
+        dates = list(date_range(start, end))
+    else:
+        dates = retention.due_dates()
+    table = get_resource('dynamodb').Table(args.table)
+    manifests, _ = archive_dates(table, s3, args.bucket, dates, args.packed, force=args.force)
+    readings = sum(manifest['rows'] for manifest in manifests)
+    size = sum(manifest['bytes'] for manifest in manifests)
+    print(f"Archived {readings} readings of {len(manifests)} dates into {size} bytes in {time.perf_counter() - started:.1f}s")
+    if not args.start:
+        late = archive_late(table, s3, args.bucket, args.packed)
+        if late:
+            print(f"Added {sum(late.values())} late readings to {len(late)} archived dates")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
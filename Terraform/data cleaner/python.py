@@ -0,0 +1,283 @@
+"""
+Hourly compaction of per-reading S3 objects.
+
+The IoT topic rules write one small object per message to
+sensors/<type>/<epoch_ms>.json, and multi-reading envelopes to
+sensors/envelope/<epoch_ms>-<uuid>.emv. This job lists one hour of those keys
+per source, merges them into a single compressed columnar file (Parquet when
+pyarrow is available, otherwise the ECOL format from ecomonitor.columnar) and
+writes a manifest next to it. Envelopes are decoded (ecomonitor.envelope), so
+every reading they carry becomes a row with its own sensor_type:
+
+    compacted/<type>/dt=YYYY-MM-DD/hour=HH/part-0000.parquet|.ecol.gz
+    compacted/<type>/dt=YYYY-MM-DD/hour=HH/manifest.json
+
+Windows are compacted in parallel with a process pool when run from the command
+line; the Lambda entry point compacts the previous hour in-process.
+
+Usage (from Terraform/, with the shared layer on the path):
+    PYTHONPATH=layers/common/python python "data cleaner/python.py" --bucket ecomonitor-raw-b01006432 --start 2024-05-01T00 --end 2024-05-02T00 --workers 8
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from decimal import Decimal
+
+from ecomonitor import columnar, envelope
+from ecomonitor.runtime import get_client
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+    parquet = None
+
+# Set up logging
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+BUCKET_NAME = os.environ.get('RAW_BUCKET_NAME')
+SOURCE_PREFIX = os.environ.get('COMPACTION_SOURCE_PREFIX', 'sensors/')
+OUTPUT_PREFIX = os.environ.get('COMPACTION_OUTPUT_PREFIX', 'compacted/')
+COMPACTION_FORMAT = os.environ.get('COMPACTION_FORMAT', 'auto')
+FETCH_CONCURRENCY = int(os.environ.get('COMPACTION_FETCH_CONCURRENCY', '32'))
+# Source prefixes under sensors/; 'envelope' holds multi-reading envelopes of every type
+SENSOR_TYPES = ('temperature', 'humidity', 'aqi', 'co2', 'envelope')
+
+HOUR_MS = 3600 * 1000
+DELETE_BATCH_SIZE = 1000  # DeleteObjects limit
+
+def resolve_format(requested):
+    """Pick the output format; 'auto' prefers Parquet when pyarrow is installed"""
+    if requested == 'auto':
+        return 'parquet' if pyarrow is not None else 'ecol'
+    if requested == 'parquet' and pyarrow is None:
+        raise ValueError("Parquet output requires pyarrow")
+    return requested
+
+def hour_floor(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+def to_epoch_ms(moment):
+    return int(moment.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+def window_prefix(sensor_type, hour_start):
+    return f"{OUTPUT_PREFIX}{sensor_type}/dt={hour_start:%Y-%m-%d}/hour={hour_start:%H}/"
+
+def key_epoch_ms(key):
+    """Epoch millis encoded in sensors/<type>/<epoch_ms>.json or sensors/envelope/<epoch_ms>-<uuid>.emv, or None"""
+    stem = key.rsplit('/', 1)[-1].split('.', 1)[0].split('-', 1)[0]
+    return int(stem) if stem.isdigit() else None
+
+def list_window_keys(s3, bucket, sensor_type, start_ms, end_ms):
+    """
+    Keys of one sensor type whose epoch-ms name falls in [start_ms, end_ms).
+    The names are fixed-width epoch millis, so listing starts right at the
+    window and stops at the first key past it instead of scanning the prefix.
+    """
+    prefix = f"{SOURCE_PREFIX}{sensor_type}/"
+    keys = []
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'StartAfter': f"{prefix}{start_ms}"}
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        for entry in response.get('Contents', []):
+            epoch_ms = key_epoch_ms(entry['Key'])
+            if epoch_ms is None:
+                continue
+            if epoch_ms >= end_ms:
+                return keys
+            if epoch_ms >= start_ms:
+                keys.append(entry['Key'])
+        if not response.get('IsTruncated'):
+            return keys
+        kwargs.pop('StartAfter', None)
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+def object_rows(body):
+    """Rows of one object: its document, or every reading of an envelope (None if neither)"""
+    if envelope.is_binary_envelope(body):
+        documents = envelope.decode(body)
+    else:
+        document = json.loads(body)
+        if envelope.is_json_envelope(document):
+            documents = envelope.decode_json(document)
+        elif isinstance(document, dict):
+            documents = [document]
+        else:
+            return None
+    # Decoded envelope values are Decimals; rows carry plain numbers like parsed JSON
+    return [{name: float(value) if isinstance(value, Decimal) else value for name, value in document.items()}
+            for document in documents]
+
+def fetch_rows(s3, bucket, keys):
+    """
+    Download and parse the window's objects concurrently. Returns (rows, skipped
+    objects); unreadable objects are skipped.
+    """
+    def fetch(key):
+        try:
+            rows = object_rows(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+            if rows is None:
+                return key, None
+            for row in rows:
+                row.setdefault('s3_key', key)
+            return key, rows
+        except Exception as e:
+            logger.error(f"❌ [COMPACTION] Skipping {key}: {str(e)}")
+            return key, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(FETCH_CONCURRENCY, len(keys)))) as executor:
+        fetched = dict(executor.map(fetch, keys))
+    # Keep the rows in key (arrival) order
+    rows = [row for key in keys if fetched[key] is not None for row in fetched[key]]
+    return rows, sum(1 for key in keys if fetched[key] is None)
+
+def encode(rows, output_format):
+    if output_format == 'parquet':
+        table = pyarrow.Table.from_pylist([{k: (v if not isinstance(v, (dict, list)) else json.dumps(v)) for k, v in row.items()} for row in rows])
+        buffer = io.BytesIO()
+        parquet.write_table(table, buffer, compression='zstd')
+        return buffer.getvalue(), '.parquet'
+    return columnar.encode_rows(rows, ['device_id', 'timestamp']), columnar.FILE_EXTENSION
+
+def delete_keys(s3, bucket, keys):
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start + DELETE_BATCH_SIZE]
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in batch], 'Quiet': True})
+
+def compact_window(bucket, sensor_type, hour_start_iso, output_format='auto', delete_sources=False, s3=None):
+    """Compact one sensor type × hour window. Returns the manifest (or a skip summary)."""
+    started = time.perf_counter()
+    s3 = s3 or get_client('s3')
+    hour_start = datetime.datetime.fromisoformat(hour_start_iso)
+    start_ms = to_epoch_ms(hour_start)
+    end_ms = start_ms + HOUR_MS
+
+    keys = list_window_keys(s3, bucket, sensor_type, start_ms, end_ms)
+    if not keys:
+        return {'sensor_type': sensor_type, 'hour': hour_start_iso, 'source_objects': 0, 'skipped': True}
+
+    rows, skipped = fetch_rows(s3, bucket, keys)
+    output_format = resolve_format(output_format)
+    body, extension = encode(rows, output_format)
+
+    prefix = window_prefix(sensor_type, hour_start)
+    output_key = f"{prefix}part-0000{extension}"
+    s3.put_object(Bucket=bucket, Key=output_key, Body=body)
+
+    manifest = {
+        'sensor_type': sensor_type,
+        'hour': hour_start_iso,
+        'format': output_format,
+        'output_key': output_key,
+        'output_bytes': len(body),
+        'rows': len(rows),
+        'source_objects': len(keys),
+        'skipped_objects': skipped,
+        'first_key': keys[0],
+        'last_key': keys[-1],
+        'columns': sorted({name for row in rows for name in row}),
+        'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
+    s3.put_object(Bucket=bucket, Key=f"{prefix}manifest.json", Body=json.dumps(manifest, indent=2).encode('utf-8'))
+
+    # Sources go only after the compacted file and its manifest are safely written
+    if delete_sources:
+        delete_keys(s3, bucket, keys)
+
+    logger.info(f"🗜️ [COMPACTION] {sensor_type} {hour_start_iso}: {len(keys)} objects → {output_key} ({len(body)} bytes)")
+    return manifest
+
+def hour_windows(start, end):
+    """Hour starts in [start, end)"""
+    current = hour_floor(start)
+    while current < end:
+        yield current
+        current += datetime.timedelta(hours=1)
+
+def run(bucket, start, end, sensor_types=SENSOR_TYPES, workers=os.cpu_count() or 1, output_format='auto', delete_sources=False):
+    """Compact every sensor type × hour window in [start, end), in parallel when workers > 1"""
+    resolve_format(output_format)
+    jobs = [(bucket, sensor_type, window.isoformat(), output_format, delete_sources)
+            for window in hour_windows(start, end) for sensor_type in sensor_types]
+    manifests = []
+    if workers <= 1:
+        for job in jobs:
+            manifests.append(compact_window(*job))
+        return manifests
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(compact_window, *job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                manifests.append(future.result())
+            except Exception as e:
+                _, sensor_type, hour, _, _ = futures[future]
+                logger.error(f"❌ [COMPACTION] {sensor_type} {hour} failed: {str(e)}")
+                manifests.append({'sensor_type': sensor_type, 'hour': hour, 'error': str(e)})
+    return manifests
+
+def lambda_handler(event, context):
+    """Scheduled entry point: compacts the previous full hour (or event['hour'])"""
+    event = event or {}
+    if 'hour' in event:
+        hour_start = hour_floor(datetime.datetime.fromisoformat(event['hour']))
+    else:
+        hour_start = hour_floor(datetime.datetime.utcnow()) - datetime.timedelta(hours=1)
+
+    # Lambda has no /dev/shm for process pools, so windows run sequentially here
+    manifests = run(
+        event.get('bucket', BUCKET_NAME),
+        hour_start,
+        hour_start + datetime.timedelta(hours=1),
+        event.get('sensor_types', SENSOR_TYPES),
+        workers=1,
+        output_format=event.get('format', COMPACTION_FORMAT)
+    )
+    compacted = [manifest for manifest in manifests if not manifest.get('skipped')]
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': f"Compacted {len(compacted)} windows for {hour_start.isoformat()}",
+            'source_objects': sum(manifest['source_objects'] for manifest in compacted),
+            'manifests': [manifest['output_key'] for manifest in compacted]
+        })
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compact per-reading sensor objects into hourly columnar files")
+    parser.add_argument('--bucket', default=BUCKET_NAME, required=BUCKET_NAME is None)
+    parser.add_argument('--start', required=True, help='first hour, e.g. 2024-05-01T00')
+    parser.add_argument('--end', required=True, help='end hour (exclusive)')
+    parser.add_argument('--sensor-types', default=','.join(SENSOR_TYPES))
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--format', choices=['auto', 'parquet', 'ecol'], default=COMPACTION_FORMAT)
+    parser.add_argument('--delete-sources', action='store_true', help='delete source objects after a window is compacted')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    manifests = run(
+        args.bucket,
+        datetime.datetime.fromisoformat(args.start),
+        datetime.datetime.fromisoformat(args.end),
+        [sensor_type.strip() for sensor_type in args.sensor_types.split(',') if sensor_type.strip()],
+        args.workers,
+        args.format,
+        args.delete_sources
+    )
+    compacted = [manifest for manifest in manifests if 'output_key' in manifest]
+    failed = [manifest for manifest in manifests if 'error' in manifest]
+    source_objects = sum(manifest['source_objects'] for manifest in compacted)
+    print(f"Compacted {source_objects} objects into {len(compacted)} files in {time.perf_counter() - started:.1f}s ({len(failed)} windows failed)")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
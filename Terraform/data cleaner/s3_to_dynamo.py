@@ -1,205 +1,993 @@
+from ecomonitor import initprofile
+initprofile.start()
+
 import json
-import boto3
+import gzip
+import io
 import os
-import uuid
+import time
+import random
 import datetime
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-import logging
+from ecomonitor.alerts import ErrorAggregator
+from ecomonitor.cache import LRUCache
+from ecomonitor import anomaly
+from ecomonitor import capacity
+from ecomonitor.deadletter import DeadLetters
+from ecomonitor import envelope
+from ecomonitor.log import configure
+from ecomonitor import idempotency
+from ecomonitor import packed
+from ecomonitor import retention
+from ecomonitor import schemas
+from ecomonitor import sortkeys
+from ecomonitor.metrics import MetricsBuffer
+from ecomonitor.profiles import PROFILES
+from ecomonitor.queries import epoch_ms, update_latest
+from ecomonitor.rollups import apply_rollups, merge_readings, merge_rollups, reading_datetime
+from ecomonitor.runtime import lazy_client, lazy_resource, record_client_metrics
+from ecomonitor.sharding import sharded_date
+from ecomonitor.timing import StageTimer
+
+initprofile.finish()
+
+# Set up logging: LOG_LEVEL (default INFO) gates the per-record lines, LOG_SAMPLE_RATES samples them
+log = configure()
+logger = log.logger
 
-# Set up logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+# AWS clients are built on first use; SNS is only needed on the error path
+dynamodb = lazy_resource('dynamodb')
+s3_client = lazy_client('s3')
+sns_client = lazy_client('sns')
 
-# Initialize AWS clients
-dynamodb = boto3.resource('dynamodb')
-s3_client = boto3.client('s3')
-sns_client = boto3.client('sns')
-cloudwatch = boto3.client('cloudwatch')
+# Pipeline metrics are merged in memory and sent in batches
+metrics = MetricsBuffer('EcoMonitor/DataPipeline')
+# Per-stage latency percentiles of every invocation (StageLatencyP50/P95/Max)
+timer = StageTimer(metrics)
 
 # Get environment variables
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+# Bucket of the readings archive; readings for dates that may already be archived are marked there
+ARCHIVE_BUCKET_NAME = os.environ.get('RAW_BUCKET_NAME')
+# On-demand table of the shared error-notification windows (see ecomonitor.alerts)
+ALERTS_TABLE_NAME = os.environ.get('ALERTS_TABLE_NAME')
 ERROR_TOPIC_ARN = os.environ.get('SNS_ERROR_TOPIC_ARN')
 
+# Ingestion tuning
+S3_FETCH_CONCURRENCY = int(os.environ.get('S3_FETCH_CONCURRENCY', '8'))
+BATCH_WRITE_SIZE = 25  # DynamoDB BatchWriteItem hard limit
+BATCH_WRITE_MAX_RETRIES = int(os.environ.get('BATCH_WRITE_MAX_RETRIES', '5'))
+BATCH_WRITE_BASE_DELAY = 0.05  # seconds
+BATCH_WRITE_MAX_DELAY = 2.0  # seconds
+
+# Streaming ingestion of gateway batch files (newline-delimited JSON, optionally gzipped)
+STREAM_SUFFIXES = ('.ndjson', '.ndjson.gz', '.jsonl', '.jsonl.gz')
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', '500'))
+STREAM_READ_BUFFER = 64 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Per-device rollups (ROLLUP_GRANULARITIES, hour and day by default) maintained on ingest
+ROLLUPS_ENABLED = os.environ.get('ROLLUPS_ENABLED', 'true').lower() == 'true'
+# Per-device "latest reading" items for cheap fleet-state reads
+LATEST_ENABLED = os.environ.get('LATEST_ENABLED', 'true').lower() == 'true'
+
+# Storage layout: 'items' (one item per reading), 'packed' (one item per device-hour,
+# see ecomonitor.packed) or 'both' (reading items plus packed hours, e.g. while migrating)
+STORAGE_LAYOUT = os.environ.get('STORAGE_LAYOUT', 'items').lower()
+
+# Streaming per-device outlier/flatline detection on written readings (see ecomonitor.anomaly)
+ANOMALY_DETECTION_ENABLED = anomaly.ANOMALY_DETECTION_ENABLED
+ANOMALY_LOG_LIMIT = 10  # anomalies listed in the per-invocation summary line
+
+# Redelivered S3 events must not create or count readings twice
+IDEMPOTENCY_ENABLED = os.environ.get('IDEMPOTENCY_ENABLED', 'true').lower() == 'true'
+
+# Reading keys and batch-file identities written by this container, kept across warm invocations
+recent_keys = LRUCache(idempotency.IDEMPOTENCY_CACHE_SIZE, idempotency.IDEMPOTENCY_WINDOW_SECONDS)
+# Detector states of the devices this container has seen
+detector_states = LRUCache(anomaly.ANOMALY_STATE_CACHE_SIZE)
+# Derived writes still throttled past the write scheduler's defer limit. The readings behind
+# them are stored, so a redelivery would not bring them back: they are retried with the next
+# batch and when the invocation ends, and are lost only if the container is recycled first
+owed_rollups = capacity.Backlog(lambda owed, new: owed.merge(new))
+owed_latest = capacity.Backlog(lambda owed, new: max(owed, new, key=lambda item: item['observed_at']))
+owed_states = capacity.Backlog(lambda owed, new: max(owed, new, key=lambda pair: pair[0].observed_at))
+# Anomalies of the current invocation, summarized once when it ends
+anomalies = anomaly.DetectionResult()
+
 def put_custom_metric(metric_name, value, unit='Count', namespace='EcoMonitor/DataPipeline'):
-    """Put custom metric to CloudWatch"""
-    try:
-        cloudwatch.put_metric_data(
-            Namespace=namespace,
-            MetricData=[
-                {
-                    'MetricName': metric_name,
-                    'Value': value,
-                    'Unit': unit,
-                    'Timestamp': datetime.datetime.utcnow()
-                },
-            ]
+    """Buffer a custom metric; the buffer is flushed once per invocation"""
+    metrics.put(metric_name, value, unit, namespace=namespace)
+
+def send_notification(subject, message):
+    """Send one notification to SNS if a topic is configured"""
+    if ERROR_TOPIC_ARN:
+        sns_client.publish(
+            TopicArn=ERROR_TOPIC_ARN,
+            Subject=subject,
+            Message=message
         )
+
+# Errors are fingerprinted and counted in memory, and sent at most once per fingerprint and
+# ALERT_WINDOW_SECONDS window (shared through the alert state table); the rest goes into the digest
+error_alerts = ErrorAggregator(send_notification, lambda: dynamodb.Table(ALERTS_TABLE_NAME) if ALERTS_TABLE_NAME else None, metrics)
+
+def publish_error(subject, message, key=None):
+    """Report an error notification; it is coalesced and sent when the invocation ends"""
+    error_alerts.report(subject, message, key)
+
+def detect_sensor_type(key):
+    """Determine sensor type from the file path/name (precomputed sensors/<type>/ prefix map first)"""
+    return schemas.resolve_sensor_type(key)
+
+@timer.timed('transform')
+def transform_sensor_data(sensor_data, key, sensor_type, fallback_timestamp, received_at=None):
+    """
+    Turn a parsed sensor document into a DynamoDB item. `received_at` (the S3
+    event time) stands in for the reading time of readings that carry none.
+    """
+    # Ensure we have a device_id
+    if 'device_id' not in sensor_data:
+        # Extract device_id from the path if possible, or use a default
+        path_parts = key.split('/')
+        if len(path_parts) >= 2:
+            sensor_data['device_id'] = f"{sensor_type}_sensor_{path_parts[-2]}"
+        else:
+            sensor_data['device_id'] = f"{sensor_type}_sensor_default"
+
+    # Generate a timestamp if not present
+    if 'timestamp' not in sensor_data:
+        sensor_data['timestamp'] = fallback_timestamp
+
+    # Add sensor_type if not already included
+    if 'sensor_type' not in sensor_data:
+        sensor_data['sensor_type'] = sensor_type
+
+    # Check and coerce types and ranges with the sensor type's compiled schema; raises
+    # schemas.RecordRejected for a reading DynamoDB would refuse or that is out of range
+    schemas.validate(sensor_data, str(sensor_data['sensor_type']))
+
+    # Key the reading by the time it was taken, so a device's items sort by time (see ecomonitor.sortkeys).
+    # Readings without a usable time fall back to when the IoT rule (received_at) or S3 received them
+    observed = reading_datetime(sensor_data)
+    if observed is None or not sortkeys.in_range(epoch_ms(observed)):
+        received = sortkeys.key_epoch_ms(sensor_data.get('received_at', ''))
+        observed = datetime.datetime.utcfromtimestamp(received / 1000.0) if received is not None else received_at or datetime.datetime.utcnow()
+    sensor_data['timestamp'] = sortkeys.sort_key(epoch_ms(observed), sensor_data['timestamp'])
+
+    # Add reading_date for the GSI from the same time.
+    # The date is suffixed with a per-device shard so a day's writes spread over DateIndex partitions
+    sensor_data['reading_date'] = sharded_date(observed.strftime('%Y-%m-%d'), sensor_data['device_id'])
+
+    # Set the TTL attribute from the sensor type's retention (see ecomonitor.retention)
+    retention.assign_expiry(sensor_data)
+
+    # Fill in category fields the device did not send, from the same bands the simulators use
+    profile = PROFILES.get(sensor_data['sensor_type'])
+    if profile is not None:
+        profile.categorize(sensor_data)
+    return sensor_data
+
+def parse_s3_record(record):
+    """Extract the bucket and URL-decoded key from an S3 event record"""
+    bucket = record['s3']['bucket']['name']
+    # URL decode the key (S3 keys can be URL encoded in events)
+    key = urllib.parse.unquote_plus(record['s3']['object']['key'])
+    return bucket, key
+
+def record_time(record):
+    """UTC time of an S3 event record (its eventTime), or now"""
+    try:
+        return datetime.datetime.strptime(record['eventTime'][:19], '%Y-%m-%dT%H:%M:%S')
+    except (KeyError, TypeError, ValueError):
+        return datetime.datetime.utcnow()
+
+def record_result(bucket, key, status_code, message):
+    """Build the per-record result entry returned by the handler"""
+    return {
+        'bucket': bucket,
+        'key': key,
+        'statusCode': status_code,
+        'message': message
+    }
+
+def fetch_object(bucket, key):
+    """Read an S3 object's raw bytes"""
+    with timer.stage('s3_get'):
+        return s3_client.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+@timer.timed('json_parse')
+def parse_sensor_document(file_content):
+    """Parse a sensor JSON document, keeping numbers as Decimal for DynamoDB"""
+    try:
+        sensor_data = json.loads(file_content, parse_float=Decimal)
+        log.payload('record.parsed', "✅ [JSON PARSE] Parsed sensor data", sensor_data)
+        return sensor_data
+    except json.JSONDecodeError as je:
+        log.failure('record.json_error', "❌ [JSON ERROR] Error parsing JSON", record=file_content, error=je)
+        put_custom_metric('JsonParseErrors', 1)
+        raise
+
+# Dead-letter reason of valid JSON that is not an object (an array, a string, a number...)
+NOT_OBJECT = 'not_object'
+
+def parse_documents(body):
+    """
+    (documents, enveloped) of an S3 object, detected from its content: every
+    reading of a binary or JSON envelope (see ecomonitor.envelope), or the
+    single reading of a plain JSON document. Raises schemas.RecordRejected
+    (NOT_OBJECT) for JSON that is not an object.
+    """
+    if envelope.is_binary_envelope(body):
+        with timer.stage('decode'):
+            return envelope.decode(body), True
+    with timer.stage('decode'):
+        file_content = body.decode('utf-8')
+    sensor_data = parse_sensor_document(file_content)
+    if envelope.is_json_envelope(sensor_data):
+        with timer.stage('decode'):
+            return envelope.decode_json(sensor_data), True
+    if not isinstance(sensor_data, dict):
+        raise schemas.RecordRejected([NOT_OBJECT])
+    return [sensor_data], False
+
+def transform_documents(documents, key, default_sensor_type, fallback_timestamp, received_at=None):
+    """
+    (items, rejected) of the documents of one object, rejected = [(document, RecordRejected)].
+    The n-th reading without a timestamp falls back to `<fallback_timestamp>-<n>`.
+    """
+    items, rejected = [], []
+    for position, sensor_data in enumerate(documents):
+        sensor_type = str(sensor_data.get('sensor_type') or default_sensor_type)
+        try:
+            items.append(transform_sensor_data(sensor_data, key, sensor_type, fallback_timestamp if position == 0 else f"{fallback_timestamp}-{position}", received_at))
+        except schemas.RecordRejected as e:
+            rejected.append((sensor_data, e))
+    return items, rejected
+
+def dead_letter(dead_letters, key):
+    """Write the queued rejects of one object; a failed write is logged with every record instead"""
+    try:
+        dead_letters.flush()
     except Exception as e:
-        logger.error(f"Failed to put custom metric {metric_name}: {str(e)}")
-
-def ensure_string_types(data):
-    """Make sure all required fields are the correct type for DynamoDB"""
-    if 'timestamp' in data:
-        # Ensure timestamp is always a string
-        data['timestamp'] = str(data['timestamp'])
-    
-    if 'device_id' in data:
-        # Ensure device_id is always a string
-        data['device_id'] = str(data['device_id'])
-    
-    if 'reading_date' in data:
-        # Ensure reading_date is always a string
-        data['reading_date'] = str(data['reading_date'])
-    
-    return data
+        for line in dead_letters.pending:
+            log.failure('deadletter.write_failed', "❌ [DEAD LETTER] Could not store rejected reading", record=line, error=e, key=key)
+        return
+    put_custom_metric('RecordsRejected', dead_letters.count)
+    log.warning('record.rejected', "🚫 [SCHEMA] Rejected readings sent to the dead-letter prefix", key=key,
+                rejected=dead_letters.count, dead_letter_keys=dead_letters.keys)
 
-def lambda_handler(event, context):
-    start_time = datetime.datetime.utcnow()
-    
+def read_record(index, record, context):
+    """Fetch, parse and transform one S3 record. Returns (result, items)."""
+    bucket, key = None, None
     try:
-        # Log the entire event for debugging
-        logger.info(f"📊 [DATA PIPELINE] Processing S3 event: {json.dumps(event)}")
-        
-        # Track processing start
-        put_custom_metric('DataProcessingStarted', 1)
-        
-        # Get bucket name and file key from the event
-        bucket = event['Records'][0]['s3']['bucket']['name']
-        key = event['Records'][0]['s3']['object']['key']
-        
-        # URL decode the key (S3 keys can be URL encoded in events)
-        key = urllib.parse.unquote_plus(key)
-        
-        logger.info(f"🔄 [S3 → DynamoDB] Processing file: {key} from bucket: {bucket}")
-        
+        bucket, key = parse_s3_record(record)
+
+        # Get the file content from S3
+        body = fetch_object(bucket, key)
+        file_size = len(body)
+
+        # Track S3 read success
+        put_custom_metric('S3ReadsSuccessful', 1)
+        put_custom_metric('S3FileSizeBytes', file_size, 'Bytes')
+
+        # Parse the JSON document or unpack the envelope; invalid JSON can never succeed
         try:
-            # Get the file content from S3
-            response = s3_client.get_object(Bucket=bucket, Key=key)
-            file_content = response['Body'].read().decode('utf-8')
-            file_size = len(file_content)
-            
-            logger.info(f"📁 [S3 READ] Successfully read file content: {file_content[:200]}... (Size: {file_size} bytes)")
-            
-            # Track S3 read success
-            put_custom_metric('S3ReadsSuccessful', 1)
-            put_custom_metric('S3FileSizeBytes', file_size, 'Bytes')
-            
-            # Parse JSON content
-            try:
-                sensor_data = json.loads(file_content, parse_float=Decimal)
-                logger.info(f"✅ [JSON PARSE] Successfully parsed sensor data: {sensor_data}")
-            except json.JSONDecodeError as je:
-                logger.error(f"❌ [JSON ERROR] Error parsing JSON: {str(je)}. Raw content: {file_content}")
-                put_custom_metric('JsonParseErrors', 1)
-                raise
-                
-            # Determine sensor type from the file path/name
-            sensor_type = None
-            if 'temperature' in key.lower():
-                sensor_type = 'temperature'
-            elif 'humidity' in key.lower():
-                sensor_type = 'humidity'
-            elif 'aqi' in key.lower():
-                sensor_type = 'aqi'
-            elif 'co2' in key.lower():
-                sensor_type = 'co2'
-            else:
-                sensor_type = 'unknown'
-            
-            logger.info(f"🌡️ [SENSOR TYPE] Detected sensor type: {sensor_type}")
-            
-            # Track sensor type metrics
-            put_custom_metric(f'{sensor_type.title()}SensorDataProcessed', 1)
-            
-            # Ensure we have a device_id
-            if 'device_id' not in sensor_data:
-                # Extract device_id from the path if possible, or use a default
-                path_parts = key.split('/')
-                if len(path_parts) >= 2:
-                    sensor_data['device_id'] = f"{sensor_type}_sensor_{path_parts[-2]}"
-                else:
-                    sensor_data['device_id'] = f"{sensor_type}_sensor_default"
-            
-            # Get existing data or create new item structure
-            table = dynamodb.Table(TABLE_NAME)
-            
-            # Generate a timestamp if not present
-            if 'timestamp' not in sensor_data:
-                sensor_data['timestamp'] = context.aws_request_id
-            
-            # Add reading_date for the GSI - extract date from timestamp or use current date
-            current_date = datetime.datetime.now().strftime('%Y-%m-%d')
-            sensor_data['reading_date'] = current_date
-            
-            # Add sensor_type if not already included
-            if 'sensor_type' not in sensor_data:
-                sensor_data['sensor_type'] = sensor_type
-            
-            # Ensure key attributes are of the correct type for DynamoDB
-            sensor_data = ensure_string_types(sensor_data)
-            
-            # Log the data before putting into DynamoDB
-            logger.info(f"Attempting to save data to DynamoDB: {json.dumps(sensor_data, default=str)}")
-            
-            # Put item in DynamoDB
-            response = table.put_item(Item=sensor_data)
-            
-            logger.info(f"Data successfully saved to DynamoDB: {json.dumps(sensor_data, default=str)}")
-            put_custom_metric('DataProcessedSuccessfully', 1)
-            return {
-                'statusCode': 200,
-                'body': json.dumps(f"Successfully processed {key}")
-            }
-            
-        except s3_client.exceptions.NoSuchKey:
-            error_message = f"The object key {key} does not exist in bucket {bucket}. It may have been deleted."
-            logger.error(error_message)
-            put_custom_metric('S3FileNotFoundErrors', 1)
-            if ERROR_TOPIC_ARN:
-                sns_client.publish(
-                    TopicArn=ERROR_TOPIC_ARN,
-                    Subject=f"EcoMonitor S3 Missing Key Error",
-                    Message=error_message
-                )
-            return {
-                'statusCode': 404,
-                'body': json.dumps(f"Error: File not found - {key}")
-            }
-        
-        except dynamodb.meta.client.exceptions.ValidationException as ve:
-            error_message = f"DynamoDB validation error for file {key}: {str(ve)}"
-            logger.error(error_message)
-            logger.error(f"Item that caused the error: {json.dumps(sensor_data, default=str)}")
-            put_custom_metric('DynamoDBValidationErrors', 1)
-            if ERROR_TOPIC_ARN:
-                sns_client.publish(
-                    TopicArn=ERROR_TOPIC_ARN,
-                    Subject=f"EcoMonitor DynamoDB Validation Error",
-                    Message=error_message
-                )
-            return {
-                'statusCode': 400,
-                'body': json.dumps(f"Error: DynamoDB validation failed - {str(ve)}")
-            }
-    
+            documents, enveloped = parse_documents(body)
+        except json.JSONDecodeError as je:
+            rejects = DeadLetters(s3_client, bucket, key)
+            rejects.add(body.decode('utf-8', errors='replace'), je)
+            dead_letter(rejects, key)
+            return record_result(bucket, key, 422, f"Rejected: invalid JSON - {str(je)}"), []
+        except schemas.RecordRejected as rr:
+            rejects = DeadLetters(s3_client, bucket, key)
+            rejects.add(body.decode('utf-8', errors='replace'), rr)
+            dead_letter(rejects, key)
+            return record_result(bucket, key, 422, "Rejected: document is not a JSON object"), []
+
+        sensor_type = detect_sensor_type(key)
+        log.debug('s3.read', "📁 [S3 READ] Read sensor file", bucket=bucket, key=key, size_bytes=file_size,
+                  sensor_type=sensor_type, readings=len(documents))
+
+        # Readings without a timestamp get a key derived from the object and its payload,
+        # so a redelivery maps to the same item instead of a new per-request one
+        fallback_timestamp = idempotency.stable_reading_key(idempotency.source_identity(record), body)
+        items, rejected = transform_documents(documents, key, sensor_type, fallback_timestamp, record_time(record))
+        if rejected:
+            rejects = DeadLetters(s3_client, bucket, key)
+            for sensor_data, error in rejected:
+                rejects.add(sensor_data, error, str(sensor_data.get('sensor_type') or sensor_type))
+            dead_letter(rejects, key)
+
+        # Track sensor type metrics
+        processed = {}
+        for item in items:
+            processed[item['sensor_type']] = processed.get(item['sensor_type'], 0) + 1
+        for item_sensor_type, count in processed.items():
+            put_custom_metric(f'{item_sensor_type.title()}SensorDataProcessed', count)
+        if enveloped:
+            put_custom_metric('EnvelopeReadings', len(items))
+            put_custom_metric('EnvelopeBytesPerReading', file_size / max(1, len(documents)), 'Bytes')
+        if rejected and not items:
+            return record_result(bucket, key, 422, f"Rejected: {rejected[0][1]}"), []
+        if rejected:
+            return record_result(bucket, key, 200, f"Processed {key}, {len(rejected)} of {len(documents)} readings rejected"), items
+        return record_result(bucket, key, 200, f"Successfully processed {key}"), items
+
+    except s3_client.exceptions.NoSuchKey:
+        error_message = f"The object key {key} does not exist in bucket {bucket}. It may have been deleted."
+        log.failure('s3.missing_key', error_message, record=record)
+        put_custom_metric('S3FileNotFoundErrors', 1)
+        publish_error("EcoMonitor S3 Missing Key Error", error_message, key)
+        return record_result(bucket, key, 404, f"Error: File not found - {key}"), []
+
     except Exception as e:
         error_message = f"Error processing S3 file {bucket}/{key}: {str(e)}"
-        logger.error(error_message)
-        
-        # Send error notification to SNS
+        log.failure('record.failed', error_message, record=record, error=e)
+        publish_error("EcoMonitor S3 Processing Error", error_message, key)
+        put_custom_metric('DataProcessingErrors', 1)
+        return record_result(bucket, key, 500, f"Error processing file: {str(e)}"), []
+
+def item_key(item):
+    """Primary key tuple of a table item"""
+    return item.get('device_id'), item.get('timestamp')
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(BATCH_WRITE_MAX_DELAY, BATCH_WRITE_BASE_DELAY * (2 ** attempt)))
+
+def write_scheduler():
+    """Capacity-aware pacing of this container's writes, or None when disabled"""
+    return capacity.scheduler_for(dynamodb.meta.client, TABLE_NAME)
+
+def write_batch(batch):
+    """
+    Write up to 25 items with BatchWriteItem, retrying UnprocessedItems with backoff.
+    With the write scheduler, every attempt first waits for write capacity and
+    retries continue until the scheduler's defer limit instead of a fixed count.
+    Returns the items that could not be written.
+    """
+    scheduler = write_scheduler()
+    deadline = time.monotonic() + (scheduler.max_defer if scheduler else 0)
+    request_items = {TABLE_NAME: [{'PutRequest': {'Item': item}} for item in batch]}
+    attempt = 0
+    while True:
+        requests = request_items[TABLE_NAME]
+        estimate = None
+        if scheduler:
+            pools = sorted({pool for request in requests for pool in scheduler.pools_for(request['PutRequest']['Item'])})
+            estimate = scheduler.acquire(len(requests), pools)
         try:
-            if ERROR_TOPIC_ARN:
-                sns_client.publish(
-                    TopicArn=ERROR_TOPIC_ARN,
-                    Subject=f"EcoMonitor S3 Processing Error",
-                    Message=error_message
-                )
-        except Exception as sns_error:
-            logger.error(f"Failed to publish error to SNS: {str(sns_error)}")
-        
+            response = dynamodb.batch_write_item(RequestItems=request_items, ReturnConsumedCapacity='INDEXES')
+            unprocessed = response.get('UnprocessedItems') or {}
+        except dynamodb.meta.client.exceptions.ProvisionedThroughputExceededException:
+            # Raised when none of the items could be written
+            response, unprocessed = {}, request_items
+        remaining = unprocessed.get(TABLE_NAME) or []
+        if scheduler:
+            scheduler.observe(response.get('ConsumedCapacity'), len(requests) - len(remaining), estimate)
+            if remaining:
+                scheduler.throttled()
+        if not remaining:
+            return []
+        request_items = unprocessed
+        if (scheduler and time.monotonic() >= deadline) or (not scheduler and attempt >= BATCH_WRITE_MAX_RETRIES):
+            return [request['PutRequest']['Item'] for request in remaining]
+        log.warning('dynamodb.batch_retry', "⏳ [BATCH WRITE] Unprocessed items, retrying", unprocessed=len(remaining), attempt=attempt + 1)
+        time.sleep(backoff_delay(attempt))
+        attempt += 1
+
+def write_items_individually(batch):
+    """Fallback for a batch rejected by validation: isolate the offending items"""
+    table = dynamodb.Table(TABLE_NAME)
+    scheduler = write_scheduler()
+    failures = []
+    for item in batch:
+        try:
+            capacity.scheduled(scheduler, table.put_item, item, Item=item)
+        except dynamodb.meta.client.exceptions.ValidationException as ve:
+            failures.append((item, ve))
+    return failures
+
+def batch_write_items(items):
+    """
+    Write items in BatchWriteItem calls of up to 25 items.
+    Returns (unprocessed_items, invalid_items) where invalid_items are (item, error) pairs.
+    With the write scheduler, unprocessed items are the ones DynamoDB kept
+    throttling past the defer limit (see deferred_items()).
+    """
+    unprocessed, invalid = [], []
+    scheduler = write_scheduler()
+    position = 0
+    while position < len(items):
+        # Under the scheduler, batches shrink with the current rate so one request never overshoots it
+        size = scheduler.batch_size(BATCH_WRITE_SIZE) if scheduler else BATCH_WRITE_SIZE
+        batch = items[position:position + size]
+        position += size
+        try:
+            unprocessed.extend(write_batch(batch))
+        except dynamodb.meta.client.exceptions.ValidationException:
+            log.warning('dynamodb.batch_invalid', "⚠️ [BATCH WRITE] Batch rejected by validation, retrying items individually", items=len(batch))
+            invalid.extend(write_items_individually(batch))
+    return unprocessed, invalid
+
+@timer.timed('rollups')
+def maintain_rollups(items):
+    """Fold written readings (and owed rollups) into their rollup windows; rollup failures never fail ingestion"""
+    if not ROLLUPS_ENABLED or not (items or len(owed_rollups)):
+        return
+    try:
+        rollups = merge_rollups(merge_readings(items) + owed_rollups.take())
+        writes, failures, deferred = apply_rollups(dynamodb.meta.client, TABLE_NAME, rollups, scheduler=write_scheduler())
+        put_custom_metric('RollupWrites', writes)
+        if failures:
+            put_custom_metric('RollupUpdateErrors', failures)
+        for rollup in deferred:
+            owed_rollups.add(rollup.window_key, rollup)
+    except Exception as e:
+        log.error('rollups.failed', "Failed to update rollups", error=str(e))
+        put_custom_metric('RollupUpdateErrors', 1)
+
+@timer.timed('latest')
+def maintain_latest(items):
+    """Advance each device's latest-reading item; stale (older) readings are skipped by a conditional write"""
+    if not LATEST_ENABLED or not (items or len(owed_latest)):
+        return
+    try:
+        written, stale, failed, deferred = update_latest(dynamodb.Table(TABLE_NAME), owed_latest.take() + list(items),
+                                                         scheduler=write_scheduler())
+        for reading in deferred:
+            owed_latest.add(reading['device_id'], reading)
+        put_custom_metric('LatestReadingUpdates', written)
+        if stale:
+            put_custom_metric('LatestReadingStaleSkips', stale)
+        if failed:
+            put_custom_metric('LatestReadingUpdateErrors', failed)
+    except Exception as e:
+        log.error('latest.failed', "Failed to update latest readings", error=str(e))
+        put_custom_metric('LatestReadingUpdateErrors', 1)
+
+@timer.timed('anomaly')
+def detect_anomalies(items):
+    """Fold written readings into their devices' detector states; detection failures never fail ingestion"""
+    if not ANOMALY_DETECTION_ENABLED or not (items or len(owed_states)):
+        return
+    try:
+        detector = anomaly.AnomalyDetector(dynamodb.Table(TABLE_NAME), detector_states)
+        result = detector.save(owed_states.take(), scheduler=write_scheduler())
+        if items:
+            result.merge(detector.detect(items, scheduler=write_scheduler()))
+        anomalies.merge(result)
+        for state, previous_observed_at in result.deferred:
+            owed_states.add(state.device_id, (state, previous_observed_at))
+    except Exception as e:
+        log.error('anomaly.failed', "Failed to run anomaly detection", error=str(e))
+        put_custom_metric('AnomalyStateErrors', 1)
+
+def report_anomalies():
+    """One aggregated alert per invocation instead of a metric per reading"""
+    global anomalies
+    result, anomalies = anomalies, anomaly.DetectionResult()
+    if not result.devices:
+        return
+    anomaly.record_metrics(metrics, result)
+    if result.failed:
+        put_custom_metric('AnomalyStateErrors', result.failed)
+    if result.anomalies:
+        log.warning('anomaly.detected', "🚨 [ANOMALY] Devices deviating from their own history",
+                    anomalies=len(result.anomalies), devices=result.anomalous_devices(),
+                    counts=lambda: {f"{sensor_type}.{kind}": count for (sensor_type, kind), count in result.counts().items()},
+                    sample=lambda: [dict(detail, device_id=device_id, kind=kind) for device_id, _, kind, detail in result.anomalies[:ANOMALY_LOG_LIMIT]])
+
+def settle_owed_writes():
+    """Retry the owed derived writes once more; what is still owed is reported and kept for the next invocation"""
+    if len(owed_rollups) or len(owed_latest) or len(owed_states):
+        maintain_rollups([])
+        maintain_latest([])
+        detect_anomalies([])
+    owed = {'rollups': len(owed_rollups), 'latest': len(owed_latest), 'detector': len(owed_states)}
+    if any(owed.values()):
+        log.warning('derived.owed', "⏳ [CAPACITY] Derived writes deferred to the next invocation", **owed)
+        put_custom_metric('DerivedWritesOwed', sum(owed.values()))
+
+def append_packed(items):
+    """Append readings to their hourly packed items. Returns (failed, deferred) items."""
+    failed, deferred, stats = packed.append_readings(dynamodb.Table(TABLE_NAME), items, scheduler=write_scheduler())
+    put_custom_metric('PackedHourAppends', stats['hours'])
+    if stats['compacted']:
+        put_custom_metric('PackedHourCompactions', stats['compacted'])
+    return failed, deferred
+
+@timer.timed('packed')
+def mirror_packed(items):
+    """With STORAGE_LAYOUT=both, keep the packed hours next to the reading items; failures never fail ingestion"""
+    if STORAGE_LAYOUT != 'both' or not items:
+        return
+    try:
+        failed, deferred = append_packed(items)
+        if failed or deferred:
+            put_custom_metric('PackedAppendErrors', len(failed) + len(deferred))
+    except Exception as e:
+        log.error('packed.failed', "Failed to append packed readings", error=str(e))
+        put_custom_metric('PackedAppendErrors', len(items))
+
+def write_readings(items):
+    """
+    Write a batch of reading items in the configured layout with BatchWriteItem.
+    Returns (unprocessed, invalid, deferred) like batch_write_items + deferred_items.
+    """
+    if STORAGE_LAYOUT == 'packed':
+        unprocessed, deferred = append_packed(items)
+        return unprocessed, [], deferred
+    unprocessed, invalid = batch_write_items(items)
+    deferred, unprocessed = deferred_items(unprocessed)
+    return unprocessed, invalid, deferred
+
+def mark_late_readings(items):
+    """Mark dates that may already be archived, so the archive job adds these readings before they expire"""
+    if not ARCHIVE_BUCKET_NAME or not items:
+        return
+    try:
+        dates = retention.late_dates(items)
+        if dates:
+            retention.mark_late(s3_client, ARCHIVE_BUCKET_NAME, dates)
+            put_custom_metric('LateArchiveDates', len(dates))
+    except Exception as e:
+        log.error('archive.mark_failed', "Failed to mark late readings for the archive", error=str(e))
+        put_custom_metric('LateArchiveMarkErrors', 1)
+
+def record_written(items):
+    """Derived state kept alongside the raw readings that were just written"""
+    mirror_packed(items)
+    maintain_rollups(items)
+    maintain_latest(items)
+    detect_anomalies(items)
+    mark_late_readings(items)
+
+def deferred_items(unprocessed):
+    """Split batch leftovers into (deferred, failed): with the scheduler they are throttle leftovers"""
+    if write_scheduler() is not None:
+        return unprocessed, []
+    return [], unprocessed
+
+def put_new_items(items):
+    """
+    Write items with one conditional PutItem each (in parallel), so a reading
+    that is already stored is neither overwritten nor counted again downstream.
+    Only used for objects that could not be claimed (see write_new_readings).
+    Returns (duplicate_items, unprocessed_items, invalid_items, deferred_items);
+    deferred items stayed throttled past the write scheduler's defer limit.
+    """
+    table = dynamodb.Table(TABLE_NAME)
+    scheduler = write_scheduler()
+
+    def put(item):
+        try:
+            return ('written' if idempotency.put_if_absent(table, item, scheduler) else 'duplicate'), None
+        except dynamodb.meta.client.exceptions.ValidationException as ve:
+            return 'invalid', ve
+        except capacity.WritesDeferred as e:
+            return 'deferred', e
+        except Exception as e:
+            log.failure('dynamodb.write_failed', "Failed to write item", record=item, error=e)
+            return 'unprocessed', e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(S3_FETCH_CONCURRENCY, len(items)))) as executor:
+        outcomes = list(executor.map(put, items))
+    duplicates = [item for item, (outcome, _) in zip(items, outcomes) if outcome == 'duplicate']
+    unprocessed = [item for item, (outcome, _) in zip(items, outcomes) if outcome == 'unprocessed']
+    invalid = [(item, error) for item, (outcome, error) in zip(items, outcomes) if outcome == 'invalid']
+    deferred = [item for item, (outcome, _) in zip(items, outcomes) if outcome == 'deferred']
+    return duplicates, unprocessed, invalid, deferred
+
+def write_path():
+    """How single-document readings are written: 'claim+batch' (claimed objects, then BatchWriteItem) or 'batch'"""
+    return 'claim+batch' if claims_documents() else 'batch'
+
+def claims_documents():
+    """
+    True when single-document records are claimed per object like batch files, so
+    a redelivered object is suppressed before it is read and its readings go
+    through BatchWriteItem without being counted twice downstream
+    """
+    return IDEMPOTENCY_ENABLED
+
+def claim_document(record):
+    """Claim one single-document record. Returns (identity, owned); identity is None for an unusable record."""
+    try:
+        identity = idempotency.source_identity(record)
+    except (KeyError, TypeError):
+        return None, True
+    if identity in recent_keys:
+        return identity, False
+    try:
+        return identity, idempotency.claim(dynamodb.Table(TABLE_NAME), identity) is not None
+    except Exception as e:
+        # Ingest unclaimed rather than drop the object; only its redelivery could count twice
+        log.error('record.claim_failed', "Failed to claim source object", identity=identity, error=str(e))
+        return None, True
+
+def settle_claim(identity, done, key=None):
+    """Complete a claim (a redelivery is suppressed) or release it (a retry may claim it again)"""
+    try:
+        table = dynamodb.Table(TABLE_NAME)
+        if done:
+            idempotency.complete(table, identity)
+            recent_keys.put(identity, True)
+        else:
+            idempotency.release(table, identity)
+    except Exception as e:
+        log.error('record.claim_failed', "Failed to settle ingestion claim", key=key, error=str(e))
+
+def write_new_readings(items, unclaimed_keys=frozenset()):
+    """
+    Write the readings of single-document records with BatchWriteItem. Items in
+    `unclaimed_keys` come from objects whose claim could not be taken: with the
+    item layout they get a conditional PutItem each, the only remaining guard
+    against counting a redelivery twice. Returns (duplicates, unprocessed, invalid,
+    deferred); only the conditional writes report duplicates.
+    """
+    conditional = [item for item in items if item_key(item) in unclaimed_keys] if STORAGE_LAYOUT != 'packed' else []
+    batched = [item for item in items if item_key(item) not in unclaimed_keys] if conditional else items
+    duplicates, unprocessed, invalid, deferred = [], [], [], []
+    if conditional:
+        log.debug('dynamodb.write', "Saving items of unclaimed objects with conditional writes", items=len(conditional))
+        duplicates, unprocessed, invalid, deferred = put_new_items(conditional)
+    if batched:
+        log.debug('dynamodb.write', "Saving items in batches", items=len(batched), layout=STORAGE_LAYOUT)
+        batch_unprocessed, batch_invalid, batch_deferred = write_readings(batched)
+        unprocessed += batch_unprocessed
+        invalid += batch_invalid
+        deferred += batch_deferred
+    return duplicates, unprocessed, invalid, deferred
+
+def is_stream_key(key):
+    """True for newline-delimited batch files that should be streamed"""
+    return key.lower().endswith(STREAM_SUFFIXES)
+
+def is_stream_record(record):
+    try:
+        return is_stream_key(parse_s3_record(record)[1])
+    except (KeyError, TypeError):
+        return False
+
+class _BodyReader(io.RawIOBase):
+    """Adapts an S3 StreamingBody (or any object with read(n)) to the io stack"""
+
+    def __init__(self, body):
+        self._body = body
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._body.read(len(buffer))
+        size = len(data)
+        buffer[:size] = data
+        return size
+
+def open_line_stream(body):
+    """
+    Text line iterator over an S3 body, decompressing on the fly when the
+    stream starts with the gzip magic number. Only one read buffer is held in
+    memory regardless of the object size.
+    """
+    stream = io.BufferedReader(_BodyReader(body), buffer_size=STREAM_READ_BUFFER)
+    if stream.peek(2)[:2] == GZIP_MAGIC:
+        stream = io.BufferedReader(gzip.GzipFile(fileobj=stream, mode='rb'), buffer_size=STREAM_READ_BUFFER)
+    return io.TextIOWrapper(stream, encoding='utf-8')
+
+def iter_stream_items(lines, key, default_sensor_type, fallback_prefix, counters, rejects=None, received_at=None, start_line=0):
+    """
+    Parse and transform NDJSON lines lazily, skipping (and counting) malformed
+    and schema-rejected ones; those are also queued on `rejects` (DeadLetters) when given.
+    Readings up to `start_line` (written by an earlier attempt) are checked but not
+    yielded, so their rejects still reach the dead letters. counters['line'] is the
+    last line consumed.
+    """
+    for line_number, line in enumerate(lines, 1):
+        counters['line'] = line_number
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            sensor_data = json.loads(line, parse_float=Decimal)
+            if not isinstance(sensor_data, dict):
+                raise schemas.RecordRejected([NOT_OBJECT])
+        except ValueError as e:
+            counters['malformed'] += 1
+            if counters['malformed'] <= 5:
+                log.failure('stream.malformed_line', "❌ [JSON ERROR] Skipping malformed line", record=line, error=e, key=key, line=line_number)
+            if rejects is not None:
+                rejects.add(line, e)
+            continue
+        counters['readings'] += 1
+        sensor_type = str(sensor_data.get('sensor_type') or default_sensor_type)
+        try:
+            item = transform_sensor_data(sensor_data, key, sensor_type, f"{fallback_prefix}-{line_number}", received_at)
+        except schemas.RecordRejected as e:
+            counters['rejected'] += 1
+            if rejects is not None:
+                rejects.add(sensor_data, e, str(sensor_data.get('sensor_type') or sensor_type))
+            continue
+        if line_number <= start_line:
+            counters['resumed'] += 1
+            continue
+        yield item
+
+def iter_chunks(items, size):
+    """Group an iterator into lists of at most `size` items, deduplicating primary keys per chunk"""
+    chunk_items = {}
+    for item in items:
+        chunk_items[item_key(item)] = item
+        if len(chunk_items) >= size:
+            yield list(chunk_items.values())
+            chunk_items = {}
+    if chunk_items:
+        yield list(chunk_items.values())
+
+def ingest_stream(index, record, context):
+    """Stream a (gzipped) NDJSON batch file into DynamoDB chunk by chunk"""
+    bucket, key = None, None
+    counters = {'readings': 0, 'malformed': 0, 'rejected': 0, 'written': 0, 'failed': 0, 'deferred': 0, 'resumed': 0, 'line': 0}
+    identity, claimed, start_line = None, False, 0
+    try:
+        bucket, key = parse_s3_record(record)
+        if IDEMPOTENCY_ENABLED:
+            identity = idempotency.source_identity(record)
+
+            # A batch file is claimed as a whole before any of its readings are written; a
+            # retry of a failed attempt resumes after the lines that attempt checkpointed
+            start_line = None if identity in recent_keys else idempotency.claim(dynamodb.Table(TABLE_NAME), identity)
+            if start_line is None:
+                log.info('stream.duplicate', "⏭️ [S3 STREAM] Duplicate delivery suppressed", key=key)
+                put_custom_metric('DuplicateFilesSuppressed', 1)
+                result = record_result(bucket, key, 200, f"Duplicate delivery of {key} suppressed")
+                result.update(counters)
+                return result
+            claimed = True
+            if start_line:
+                log.info('stream.resume', "⏩ [S3 STREAM] Resuming batch file after an earlier attempt", key=key, line=start_line)
+                put_custom_metric('StreamResumes', 1)
+
+        log.debug('stream.start', "🔄 [S3 STREAM] Streaming batch file", bucket=bucket, key=key)
+
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        put_custom_metric('S3ReadsSuccessful', 1)
+        put_custom_metric('S3FileSizeBytes', response.get('ContentLength', 0), 'Bytes')
+
+        lines = open_line_stream(response['Body'])
+        fallback_prefix = idempotency.stable_reading_key(identity or idempotency.source_identity(record), b'')
+        rejects = DeadLetters(s3_client, bucket, key)
+        items = iter_stream_items(lines, key, detect_sensor_type(key), fallback_prefix, counters, rejects, record_time(record), start_line)
+        for chunk_items in iter_chunks(items, STREAM_CHUNK_SIZE):
+            with timer.stage('dynamodb_write'):
+                unprocessed, invalid, deferred = write_readings(chunk_items)
+            failed = len(unprocessed) + len(invalid)
+            counters['failed'] += failed
+            if deferred:
+                # Stop at this chunk without its derived state: the redelivered event resumes at
+                # the last checkpoint, writes the chunk again (overwriting) and derives it once
+                counters['deferred'] += len(deferred)
+                counters['written'] += len(chunk_items) - failed - len(deferred)
+                break
+            counters['written'] += len(chunk_items) - failed
+            failed_keys = {item_key(item) for item in unprocessed} | {item_key(item) for item, _ in invalid}
+            record_written([item for item in chunk_items if item_key(item) not in failed_keys])
+            if claimed:
+                idempotency.checkpoint(dynamodb.Table(TABLE_NAME), identity, counters['line'])
+            for item, ve in invalid[:5]:
+                log.failure('dynamodb.validation_error', "DynamoDB validation error", record=item, error=ve, key=key)
+
+        if rejects.count:
+            dead_letter(rejects, key)
+        log.info('stream.done', "✅ [S3 STREAM] Batch file streamed", key=key, **counters)
+        put_custom_metric('StreamedReadings', counters['readings'])
+        put_custom_metric('DataProcessedSuccessfully', counters['written'])
+        if counters['malformed']:
+            put_custom_metric('JsonParseErrors', counters['malformed'])
+        if counters['failed']:
+            put_custom_metric('DataProcessingErrors', counters['failed'])
+            publish_error("EcoMonitor S3 Processing Error", f"{counters['failed']} readings from {bucket}/{key} could not be written to DynamoDB", key)
+
+        status_code = 200 if not counters['failed'] and not counters['malformed'] and not counters['rejected'] else 207
+        message = f"Streamed {counters['written']} of {counters['readings']} readings from {key}"
+        if counters['resumed']:
+            message += f" ({counters['resumed']} written by an earlier attempt)"
+        result = record_result(bucket, key, status_code, message)
+        if counters['deferred']:
+            # The claim is released below, so the redelivered event resumes the file
+            put_custom_metric('WritesDeferred', counters['deferred'])
+            result = record_result(bucket, key, 503, f"Deferred {counters['deferred']} readings from {key}: write capacity exhausted")
+
+    except s3_client.exceptions.NoSuchKey:
+        error_message = f"The object key {key} does not exist in bucket {bucket}. It may have been deleted."
+        log.failure('s3.missing_key', error_message, record=record)
+        put_custom_metric('S3FileNotFoundErrors', 1)
+        publish_error("EcoMonitor S3 Missing Key Error", error_message, key)
+        result = record_result(bucket, key, 404, f"Error: File not found - {key}")
+
+    except Exception as e:
+        error_message = f"Error streaming S3 file {bucket}/{key} after {counters['written']} readings: {str(e)}"
+        log.failure('stream.failed', error_message, record=record, error=e)
+        publish_error("EcoMonitor S3 Processing Error", error_message, key)
         put_custom_metric('DataProcessingErrors', 1)
-        return {
-            'statusCode': 500,
-            'body': json.dumps(f"Error processing file: {str(e)}")
-        }
+        result = record_result(bucket, key, 500, f"Error processing file: {str(e)}")
+
+    if claimed:
+        settle_claim(identity, result['statusCode'] in (200, 207), key)
+
+    result.update(counters)
+    return result
+
+def summarize(results):
+    """Overall status code: 200 when all records succeeded, 207 when mixed"""
+    codes = {result['statusCode'] for result in results}
+    if codes == {200}:
+        return 200
+    if 200 in codes:
+        return 207
+    return max(codes)
+
+def send_error_digest():
+    """Scheduled run: one summary of the errors coalesced in the closed alert windows"""
+    summarized = error_alerts.digest()
+    log.info('alerts.digest', "🔕 [ALERTS] Error digest", fingerprints=summarized)
+    return {'statusCode': 200, 'body': json.dumps({'message': f"Digest of {summarized} error fingerprints"})}
+
+@metrics.flush_after
+@error_alerts.flush_after
+@timer.instrument
+def lambda_handler(event, context):
+    global anomalies
+    start_time = time.perf_counter()
+    log.bind(request_id=getattr(context, 'aws_request_id', None))
+
+    # EventBridge schedule (see lambda.tf), not an S3 event
+    if event.get('action') == 'error_digest':
+        return send_error_digest()
+    anomalies = anomaly.DetectionResult()
+
+    # The entire event is only serialized with LOG_DEBUG_PAYLOADS=true
+    log.payload('invocation.event', "📊 [DATA PIPELINE] Processing S3 event", event)
+
+    # Track processing start
+    put_custom_metric('DataProcessingStarted', 1)
+
+    records = event.get('Records', [])
+    results = [None] * len(records)
+
+    # Gateway batch files are streamed one at a time; single documents go through the pool
+    stream_positions = [position for position, record in enumerate(records) if is_stream_record(record)]
+    streamed = set(stream_positions)
+    document_positions = [position for position in range(len(records)) if position not in streamed]
+
+    # Single documents are claimed per object before they are read, so a redelivered
+    # object is suppressed here and the rest can be written with BatchWriteItem
+    claims, unclaimed = {}, set()
+    if claims_documents() and document_positions:
+        with ThreadPoolExecutor(max_workers=max(1, min(S3_FETCH_CONCURRENCY, len(document_positions)))) as executor:
+            claimed = list(executor.map(lambda position: claim_document(records[position]), document_positions))
+        for position, (identity, owned) in zip(document_positions, claimed):
+            if owned:
+                if identity is not None:
+                    claims[position] = identity
+                else:
+                    unclaimed.add(position)
+                continue
+            bucket, key = parse_s3_record(records[position])
+            log.info('record.duplicate', "⏭️ [S3 READ] Duplicate delivery suppressed", key=key)
+            put_custom_metric('DuplicateFilesSuppressed', 1)
+            results[position] = record_result(bucket, key, 200, f"Duplicate delivery of {key} suppressed")
+        document_positions = [position for position in document_positions if results[position] is None]
+
+    # Fetch and transform every record with bounded concurrency
+    with ThreadPoolExecutor(max_workers=max(1, min(S3_FETCH_CONCURRENCY, len(document_positions) or 1))) as executor:
+        outcomes = list(executor.map(lambda position: read_record(position, records[position], context), document_positions))
+
+    for position, (result, _) in zip(document_positions, outcomes):
+        results[position] = result
+
+    # Collapse duplicate primary keys (BatchWriteItem rejects them); the last record wins
+    pending = {}
+    for position, (result, items) in zip(document_positions, outcomes):
+        for item in items:
+            pending[item_key(item)] = (position, item)
+
+    # Readings this container already wrote never reach DynamoDB again
+    if IDEMPOTENCY_ENABLED:
+        for key in [key for key in pending if key in recent_keys]:
+            position, _ = pending.pop(key)
+            results[position]['message'] = f"Duplicate reading suppressed for {results[position]['key']}"
+            put_custom_metric('DuplicateReadingsSuppressed', 1)
+
+    if pending:
+        positions_by_key = {key: position for key, (position, _) in pending.items()}
+        items = [item for _, item in pending.values()]
+        duplicates, deferred = [], []
+
+        try:
+            with timer.stage('dynamodb_write'):
+                duplicates, unprocessed, invalid, deferred = write_new_readings(
+                    items, {key for key, position in positions_by_key.items() if position in unclaimed})
+        except Exception as e:
+            error_message = f"Error writing batch to DynamoDB: {str(e)}"
+            log.failure('dynamodb.batch_failed', error_message, record=items, error=e)
+            publish_error("EcoMonitor S3 Processing Error", error_message)
+            put_custom_metric('DataProcessingErrors', len(items))
+            for position, _ in pending.values():
+                results[position] = record_result(results[position]['bucket'], results[position]['key'], 500, f"Error processing file: {str(e)}")
+            items, duplicates, unprocessed, invalid, deferred = [], [], [], [], []
+
+        for item in duplicates:
+            result = results[positions_by_key[item_key(item)]]
+            result['message'] = f"Duplicate reading suppressed for {result['key']}"
+            put_custom_metric('DuplicateReadingsSuppressed', 1)
+            recent_keys.put(item_key(item), True)
+
+        for item, ve in invalid:
+            result = results[positions_by_key[item_key(item)]]
+            error_message = f"DynamoDB validation error for file {result['key']}: {str(ve)}"
+            log.failure('dynamodb.validation_error', error_message, record=item, error=ve)
+            put_custom_metric('DynamoDBValidationErrors', 1)
+            publish_error("EcoMonitor DynamoDB Validation Error", error_message, result['key'])
+            result.update(statusCode=400, message=f"Error: DynamoDB validation failed - {str(ve)}")
+
+        for item in unprocessed:
+            result = results[positions_by_key[item_key(item)]]
+            error_message = f"DynamoDB did not accept item from file {result['key']} after {BATCH_WRITE_MAX_RETRIES} retries"
+            log.failure('dynamodb.unprocessed', error_message, record=item)
+            put_custom_metric('DataProcessingErrors', 1)
+            publish_error("EcoMonitor S3 Processing Error", error_message, result['key'])
+            result.update(statusCode=500, message="Error processing file: unprocessed after retries")
+
+        # Throttled past the defer limit: no alert, the event is redelivered (see below)
+        for item in deferred:
+            result = results[positions_by_key[item_key(item)]]
+            put_custom_metric('WritesDeferred', 1)
+            result.update(statusCode=503, message="Deferred: DynamoDB write capacity exhausted")
+
+        skipped_keys = {item_key(item) for item in duplicates + unprocessed + deferred} | {item_key(item) for item, _ in invalid}
+        written_items = [item for item in items if item_key(item) not in skipped_keys]
+        if written_items:
+            log.debug('dynamodb.written', "Data saved to DynamoDB", items=len(written_items))
+            put_custom_metric('DataProcessedSuccessfully', len(written_items))
+            record_written(written_items)
+            for item in written_items:
+                recent_keys.put(item_key(item), True)
+
+    # Retryable failures (500, 503) release their claim; everything else is settled for good
+    for position, identity in claims.items():
+        settle_claim(identity, results[position]['statusCode'] < 500, results[position]['key'])
+
+    for position in stream_positions:
+        with timer.stage('stream_file'):
+            results[position] = ingest_stream(position, records[position], context)
+
+    duration_ms = (time.perf_counter() - start_time) * 1000
+    succeeded = sum(1 for result in results if result['statusCode'] == 200)
+    settle_owed_writes()
+    report_anomalies()
+    log.info('invocation.done', "📊 [DATA PIPELINE] Processed S3 event", records=len(results), succeeded=succeeded, duration_ms=round(duration_ms, 1))
+    log.debug('invocation.stages', "⏱️ [DATA PIPELINE] Stage timings", stages=timer.summary)
+
+    record_client_metrics(metrics)
+    capacity.record_metrics(metrics)
+    initprofile.report(metrics)
+
+    # Failing the invocation makes Lambda redeliver the S3 event later (async retries);
+    # idempotent writes turn the already-written records of the event into no-ops
+    deferred_count = sum(1 for result in results if result['statusCode'] == 503)
+    if deferred_count:
+        raise capacity.WritesDeferred(f"{deferred_count} of {len(results)} records deferred: DynamoDB write capacity exhausted")
+
+    status_code = summarize(results) if results else 200
+    return {
+        'statusCode': status_code,
+        'body': json.dumps({
+            'message': f"Processed {succeeded} of {len(results)} records",
+            'results': results
+        })
+    }
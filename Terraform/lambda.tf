@@ -55,6 +55,21 @@ resource "aws_iam_role_policy_attachment" "lambda_iot_policy_attach" {
   policy_arn = aws_iam_policy.lambda_iot_policy.arn
 }
 
+# Shared Python helpers (ecomonitor package) published as a Lambda layer
+data "archive_file" "common_layer_zip" {
+  type        = "zip"
+  source_dir  = "${path.module}/layers/common"
+  output_path = "${path.module}/lambda_packages/common_layer.zip"
+  excludes    = ["python/ecomonitor/__pycache__"]
+}
+
+resource "aws_lambda_layer_version" "common_layer" {
+  layer_name          = "ecomonitor_common"
+  filename            = data.archive_file.common_layer_zip.output_path
+  source_code_hash    = data.archive_file.common_layer_zip.output_base64sha256
+  compatible_runtimes = ["python3.9"]
+}
+
 # Create ZIP archives for Lambda deployment packages
 data "archive_file" "temperature_lambda_zip" {
   type        = "zip"
@@ -80,6 +95,21 @@ data "archive_file" "co2_lambda_zip" {
   output_path = "${path.module}/lambda_packages/co2_function.zip"
 }
 
+data "archive_file" "fleet_lambda_zip" {
+  type        = "zip"
+  output_path = "${path.module}/lambda_packages/fleet_function.zip"
+
+  source {
+    content  = file("${path.module}/IoT devices/Fleet.py")
+    filename = "Fleet.py"
+  }
+
+  source {
+    content  = file("${path.module}/IoT devices/device_catalog.json")
+    filename = "device_catalog.json"
+  }
+}
+
 # Lambda function for temperature sensor simulation
 resource "aws_lambda_function" "temperature_function" {
   function_name    = "temperature_sensor_simulator"
@@ -89,10 +119,12 @@ resource "aws_lambda_function" "temperature_function" {
   handler          = "Temprature.lambda_handler"
   runtime          = "python3.9"
   timeout          = 10
+  layers           = [aws_lambda_layer_version.common_layer.arn]
 
   environment {
     variables = {
       IOT_ENDPOINT = data.aws_iot_endpoint.endpoint.endpoint_address
+      METRICS_MODE = "api"
     }
   }
 
@@ -110,10 +142,12 @@ resource "aws_lambda_function" "humidity_function" {
   handler          = "Humidity.lambda_handler"
   runtime          = "python3.9"
   timeout          = 10
+  layers           = [aws_lambda_layer_version.common_layer.arn]
 
   environment {
     variables = {
       IOT_ENDPOINT = data.aws_iot_endpoint.endpoint.endpoint_address
+      METRICS_MODE = "api"
     }
   }
 
@@ -131,10 +165,12 @@ resource "aws_lambda_function" "aqi_function" {
   handler          = "AQI.lambda_handler"
   runtime          = "python3.9"
   timeout          = 10
+  layers           = [aws_lambda_layer_version.common_layer.arn]
 
   environment {
     variables = {
       IOT_ENDPOINT = data.aws_iot_endpoint.endpoint.endpoint_address
+      METRICS_MODE = "api"
     }
   }
 
@@ -152,10 +188,40 @@ resource "aws_lambda_function" "co2_function" {
   handler          = "Co2.lambda_handler"
   runtime          = "python3.9"
   timeout          = 10
+  layers           = [aws_lambda_layer_version.common_layer.arn]
 
   environment {
     variables = {
       IOT_ENDPOINT = data.aws_iot_endpoint.endpoint.endpoint_address
+      METRICS_MODE = "api"
+    }
+  }
+
+  depends_on = [
+    aws_iam_role_policy_attachment.lambda_iot_policy_attach
+  ]
+}
+
+# Lambda function for multi-device fleet simulation (invoked on demand for load tests)
+resource "aws_lambda_function" "fleet_function" {
+  function_name    = "fleet_sensor_simulator"
+  filename         = data.archive_file.fleet_lambda_zip.output_path
+  source_code_hash = data.archive_file.fleet_lambda_zip.output_base64sha256
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "Fleet.lambda_handler"
+  runtime          = "python3.9"
+  timeout          = 300
+  memory_size      = 1024
+  layers           = [aws_lambda_layer_version.common_layer.arn]
+
+  environment {
+    variables = {
+      IOT_ENDPOINT         = data.aws_iot_endpoint.endpoint.endpoint_address
+      METRICS_MODE         = "api"
+      FLEET_CONCURRENCY    = "32"
+      FLEET_RATE_LIMIT     = "0"
+      FLEET_PAYLOAD_FORMAT = "envelope"
+      FLEET_ENVELOPE_SIZE  = "500"
     }
   }
 
@@ -183,16 +249,38 @@ resource "aws_iam_policy" "s3_dynamo_sns_policy" {
           "${aws_s3_bucket.ecomonitor_raw_data.arn}/*"
         ]
       },
+      {
+        # Readings rejected by the schemas are written to the dead-letter prefix
+        Action = [
+          "s3:PutObject"
+        ]
+        Effect   = "Allow"
+        Resource = "${aws_s3_bucket.ecomonitor_raw_data.arn}/dead-letter/*"
+      },
       {
         Action = [
           "dynamodb:PutItem",
+          "dynamodb:BatchWriteItem",
           "dynamodb:GetItem",
           "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem",
           "dynamodb:Query",
+          "dynamodb:Scan",
+          "dynamodb:DescribeTable"
+        ]
+        Effect = "Allow"
+        Resource = [
+          aws_dynamodb_table.ecomonitor_sensor_data.arn,
+          "${aws_dynamodb_table.ecomonitor_sensor_data.arn}/index/*"
+        ]
+      },
+      {
+        Action = [
+          "dynamodb:UpdateItem",
           "dynamodb:Scan"
         ]
         Effect   = "Allow"
-        Resource = "${aws_dynamodb_table.ecomonitor_sensor_data.arn}"
+        Resource = aws_dynamodb_table.ecomonitor_alert_state.arn
       },
       {
         Action = [
@@ -244,6 +332,7 @@ resource "aws_lambda_function" "s3_to_dynamo_function" {
   runtime          = "python3.9"
   timeout          = 60
   memory_size      = 512
+  layers           = [aws_lambda_layer_version.common_layer.arn]
 
   # VPC configuration for private subnet deployment
   vpc_config {
@@ -253,8 +342,21 @@ resource "aws_lambda_function" "s3_to_dynamo_function" {
 
   environment {
     variables = {
-      DYNAMODB_TABLE_NAME = aws_dynamodb_table.ecomonitor_sensor_data.name
-      SNS_ERROR_TOPIC_ARN = aws_sns_topic.ecomonitor_errors.arn
+      DYNAMODB_TABLE_NAME    = aws_dynamodb_table.ecomonitor_sensor_data.name
+      ALERTS_TABLE_NAME      = aws_dynamodb_table.ecomonitor_alert_state.name
+      RAW_BUCKET_NAME        = aws_s3_bucket.ecomonitor_raw_data.bucket
+      SNS_ERROR_TOPIC_ARN    = aws_sns_topic.ecomonitor_errors.arn
+      METRICS_MODE           = "api"
+      STREAM_CHUNK_SIZE      = "500"
+      DATE_INDEX_SHARDS      = "8"
+      LOG_LEVEL              = "INFO"
+      LOG_SAMPLE_RATES       = ""
+      STORAGE_LAYOUT         = "items"
+      DEAD_LETTER_PREFIX     = "dead-letter/"
+      SCHEMA_RANGES          = ""
+      ALERT_WINDOW_SECONDS   = "300"
+      RETENTION_POLICY       = "temperature=90,humidity=90,co2=180,aqi=365"
+      RETENTION_DEFAULT_DAYS = "365"
     }
   }
 
@@ -264,6 +366,62 @@ resource "aws_lambda_function" "s3_to_dynamo_function" {
   ]
 }
 
+# IAM policy for the compaction job to write compacted files next to the raw data
+resource "aws_iam_policy" "compaction_policy" {
+  name        = "lambda_s3_compaction_policy"
+  description = "Allows the compaction Lambda to write compacted hourly files and manifests"
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = [
+          "s3:PutObject"
+        ]
+        Effect   = "Allow"
+        Resource = "${aws_s3_bucket.ecomonitor_raw_data.arn}/compacted/*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "compaction_policy_attach" {
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = aws_iam_policy.compaction_policy.arn
+}
+
+# Create ZIP archive for the hourly compaction job
+data "archive_file" "compaction_lambda_zip" {
+  type        = "zip"
+  source_file = "${path.module}/data cleaner/python.py"
+  output_path = "${path.module}/lambda_packages/compaction_function.zip"
+}
+
+# Lambda function that rolls the previous hour of per-reading objects into columnar files
+resource "aws_lambda_function" "compaction_function" {
+  function_name    = "s3_hourly_compaction"
+  filename         = data.archive_file.compaction_lambda_zip.output_path
+  source_code_hash = data.archive_file.compaction_lambda_zip.output_base64sha256
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "python.lambda_handler"
+  runtime          = "python3.9"
+  timeout          = 900
+  memory_size      = 1024
+  layers           = [aws_lambda_layer_version.common_layer.arn]
+
+  environment {
+    variables = {
+      RAW_BUCKET_NAME   = aws_s3_bucket.ecomonitor_raw_data.bucket
+      COMPACTION_FORMAT = "auto"
+    }
+  }
+
+  depends_on = [
+    aws_iam_role_policy_attachment.s3_dynamo_sns_policy_attach,
+    aws_iam_role_policy_attachment.compaction_policy_attach
+  ]
+}
+
 # Permission for S3 to invoke Lambda
 resource "aws_lambda_permission" "allow_s3" {
   statement_id  = "AllowExecutionFromS3Bucket"
@@ -273,6 +431,140 @@ resource "aws_lambda_permission" "allow_s3" {
   source_arn    = aws_s3_bucket.ecomonitor_raw_data.arn
 }
 
+# EventBridge rule to compact the previous hour of raw sensor objects
+resource "aws_cloudwatch_event_rule" "compaction_event_rule" {
+  name                = "s3_hourly_compaction_trigger"
+  description         = "Triggers the S3 compaction job at ten past every hour"
+  schedule_expression = "cron(10 * * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "compaction_lambda_target" {
+  rule      = aws_cloudwatch_event_rule.compaction_event_rule.name
+  target_id = "compaction_lambda"
+  arn       = aws_lambda_function.compaction_function.arn
+}
+
+resource "aws_lambda_permission" "compaction_cloudwatch_permission" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.compaction_function.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.compaction_event_rule.arn
+}
+
+# IAM policy for the archive job to write archived readings next to the raw data
+resource "aws_iam_policy" "archive_policy" {
+  name        = "lambda_s3_archive_policy"
+  description = "Allows the archive Lambda to write archived readings and manifests"
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = [
+          "s3:PutObject"
+        ]
+        Effect   = "Allow"
+        Resource = "${aws_s3_bucket.ecomonitor_raw_data.arn}/archive/*"
+      },
+      {
+        # Late-reading markers (archive/late/) are deleted once their readings are archived
+        Action = [
+          "s3:DeleteObject"
+        ]
+        Effect   = "Allow"
+        Resource = "${aws_s3_bucket.ecomonitor_raw_data.arn}/archive/late/*"
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy_attachment" "archive_policy_attach" {
+  role       = aws_iam_role.lambda_role.name
+  policy_arn = aws_iam_policy.archive_policy.arn
+}
+
+# Create ZIP archive for the readings archive job
+data "archive_file" "archive_readings_lambda_zip" {
+  type        = "zip"
+  source_file = "${path.module}/data cleaner/archive_readings.py"
+  output_path = "${path.module}/lambda_packages/archive_readings_function.zip"
+}
+
+# Lambda function that archives readings to columnar files before their TTL expires.
+# The retention settings must match the processor's, which sets expiry_time from them
+resource "aws_lambda_function" "archive_readings_function" {
+  function_name    = "dynamo_readings_archive"
+  filename         = data.archive_file.archive_readings_lambda_zip.output_path
+  source_code_hash = data.archive_file.archive_readings_lambda_zip.output_base64sha256
+  role             = aws_iam_role.lambda_role.arn
+  handler          = "archive_readings.lambda_handler"
+  runtime          = "python3.9"
+  timeout          = 900
+  memory_size      = 1024
+  layers           = [aws_lambda_layer_version.common_layer.arn]
+
+  environment {
+    variables = {
+      RAW_BUCKET_NAME        = aws_s3_bucket.ecomonitor_raw_data.bucket
+      DYNAMODB_TABLE_NAME    = aws_dynamodb_table.ecomonitor_sensor_data.name
+      DATE_INDEX_SHARDS      = "8"
+      STORAGE_LAYOUT         = "items"
+      RETENTION_POLICY       = "temperature=90,humidity=90,co2=180,aqi=365"
+      RETENTION_DEFAULT_DAYS = "365"
+      ARCHIVE_LEAD_DAYS      = "3"
+    }
+  }
+
+  depends_on = [
+    aws_iam_role_policy_attachment.s3_dynamo_sns_policy_attach,
+    aws_iam_role_policy_attachment.archive_policy_attach
+  ]
+}
+
+# EventBridge rule to archive the dates whose readings are about to expire
+resource "aws_cloudwatch_event_rule" "archive_readings_event_rule" {
+  name                = "dynamo_readings_archive_trigger"
+  description         = "Triggers the readings archive job at twenty past every hour"
+  schedule_expression = "cron(20 * * * ? *)"
+}
+
+resource "aws_cloudwatch_event_target" "archive_readings_lambda_target" {
+  rule      = aws_cloudwatch_event_rule.archive_readings_event_rule.name
+  target_id = "archive_readings_lambda"
+  arn       = aws_lambda_function.archive_readings_function.arn
+}
+
+resource "aws_lambda_permission" "archive_readings_cloudwatch_permission" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.archive_readings_function.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.archive_readings_event_rule.arn
+}
+
+# EventBridge rule for the processor's digest of coalesced error notifications
+resource "aws_cloudwatch_event_rule" "error_digest_event_rule" {
+  name                = "error_digest_trigger"
+  description         = "Sends the digest of coalesced pipeline errors every 5 minutes"
+  schedule_expression = "rate(5 minutes)"
+}
+
+resource "aws_cloudwatch_event_target" "error_digest_lambda_target" {
+  rule      = aws_cloudwatch_event_rule.error_digest_event_rule.name
+  target_id = "error_digest_lambda"
+  arn       = aws_lambda_function.s3_to_dynamo_function.arn
+  input     = jsonencode({ action = "error_digest" })
+}
+
+resource "aws_lambda_permission" "error_digest_cloudwatch_permission" {
+  statement_id  = "AllowExecutionFromCloudWatch"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.s3_to_dynamo_function.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.error_digest_event_rule.arn
+}
+
 # CloudWatch Events / EventBridge rule to trigger the temperature lambda function every 5 minutes
 resource "aws_cloudwatch_event_rule" "temperature_event_rule" {
   name                = "temperature_sensor_trigger"
@@ -423,4 +715,9 @@ output "aqi_lambda_arn" {
 output "co2_lambda_arn" {
   value       = aws_lambda_function.co2_function.arn
   description = "ARN of the CO2 sensor simulator Lambda function"
+}
+
+output "fleet_lambda_arn" {
+  value       = aws_lambda_function.fleet_function.arn
+  description = "ARN of the fleet sensor simulator Lambda function"
 }
\ No newline at end of file
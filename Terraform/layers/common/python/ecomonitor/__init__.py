@@ -0,0 +1 @@
+"""Shared helpers for the EcoMonitor Lambda functions (deployed as a Lambda layer)."""
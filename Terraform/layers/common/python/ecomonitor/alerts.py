@@ -0,0 +1,276 @@
+"""
+Coalesced, rate-limited error notifications.
+
+Failure paths call ErrorAggregator.report(), which only counts the error in
+memory; nothing leaves the container on the error path itself. Errors are
+fingerprinted by subject plus message with the variable parts (numbers, uuids,
+hex ids) masked, so "Error processing S3 file b/sensors/co2/171...json:
+throttled" collapses across objects.
+
+flush() runs once per invocation. Per fingerprint and ALERT_WINDOW_SECONDS
+window it adds the invocation's count to a shared item in the alert state table
+(on-demand, so error storms never compete with reading writes for provisioned
+capacity, and keyed by fingerprint so no single key takes every update):
+
+    fingerprint = '<fingerprint>'   window_start = <window start (epoch seconds)>
+    subject, message, occurrences, sample_keys, notified_at, notified_occurrences
+
+The first container to see a fingerprint in a window wins a conditional update
+and publishes one immediate notification; every other occurrence of that window
+is only counted. A scheduled digest run (digest()) later sends a single summary
+of closed windows whose fingerprints kept occurring after their notification,
+with counts and sample keys. So each fingerprint gets at most one notification
+per window, plus one digest message per run for everything, however many
+invocations fail.
+
+Without the table (not configured, or DynamoDB itself failing) the aggregator
+falls back to a per-container limit: one notification per fingerprint and window.
+"""
+import functools
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger()
+
+ALERT_WINDOW_SECONDS = int(os.environ.get('ALERT_WINDOW_SECONDS', '300'))
+ALERT_SAMPLE_KEYS = int(os.environ.get('ALERT_SAMPLE_KEYS', '5'))
+# Fingerprints listed in full in one digest; the rest are summarized in one line
+ALERT_DIGEST_MAX_FINGERPRINTS = int(os.environ.get('ALERT_DIGEST_MAX_FINGERPRINTS', '20'))
+# How many closed windows a digest run looks back at
+ALERT_DIGEST_LOOKBACK_WINDOWS = int(os.environ.get('ALERT_DIGEST_LOOKBACK_WINDOWS', '3'))
+ALERT_RETENTION_SECONDS = 7 * 24 * 3600
+SUBJECT_LIMIT = 100  # SNS subject length limit
+
+_VARIABLE_PARTS = [
+    (re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'), '<uuid>'),
+    (re.compile(r'\b[0-9a-fA-F]{16,}\b'), '<hex>'),
+    (re.compile(r'\d+'), '<n>'),
+]
+
+def normalize(message):
+    """Message with its variable parts masked"""
+    for pattern, placeholder in _VARIABLE_PARTS:
+        message = pattern.sub(placeholder, message)
+    return message
+
+def fingerprint(subject, message):
+    return hashlib.sha1(f"{subject}\n{normalize(message)}".encode('utf-8')).hexdigest()[:16]
+
+class _Occurrences:
+    """Errors of one fingerprint since the last flush"""
+    __slots__ = ('subject', 'message', 'count', 'keys')
+
+    def __init__(self, subject, message):
+        self.subject = subject
+        self.message = message
+        self.count = 0
+        self.keys = []
+
+class ErrorAggregator:
+    """Per-container error counter with shared, windowed notification state"""
+
+    def __init__(self, publish, table=None, metrics=None, window=ALERT_WINDOW_SECONDS, sample_keys=ALERT_SAMPLE_KEYS,
+                 clock=time.time):
+        """
+        `publish(subject, message)` sends one notification; `table` is a
+        DynamoDB Table or a zero-argument callable returning one (None = local limits only).
+        """
+        self.publish = publish
+        self.table = table
+        self.metrics = metrics
+        self.window = max(1, window)
+        self.sample_keys = sample_keys
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._notified = {}  # fingerprint → window start, for the local fallback
+        self.stats = {'reported': 0, 'published': 0, 'suppressed': 0}
+
+    def report(self, subject, message, key=None):
+        """Count one error; returns immediately (nothing is sent before flush())"""
+        digest = fingerprint(subject, message)
+        with self._lock:
+            occurrences = self._pending.get(digest)
+            if occurrences is None:
+                occurrences = self._pending[digest] = _Occurrences(subject, message)
+            occurrences.count += 1
+            if key is not None and len(occurrences.keys) < self.sample_keys and key not in occurrences.keys:
+                occurrences.keys.append(key)
+            self.stats['reported'] += 1
+
+    def flush_after(self, handler):
+        """
+        Decorator that flushes the pending errors when the wrapped handler returns
+        or raises. Apply it inside @metrics.flush_after so its counters are sent too.
+        """
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                try:
+                    self.flush()
+                except Exception as e:
+                    logger.error(f"❌ [ALERTS] Failed to flush error notifications: {str(e)}")
+                if self.metrics is not None:
+                    self.record_metrics(self.metrics)
+        return wrapper
+
+    def _table(self):
+        return self.table() if callable(self.table) else self.table
+
+    def window_start(self, now=None):
+        now = self._clock() if now is None else now
+        return int(now // self.window * self.window)
+
+    def flush(self):
+        """Record the pending errors and send the notifications this container won"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        window_start = self.window_start()
+        table = self._table() if self.table is not None else None
+        for digest, occurrences in pending.items():
+            notify = None
+            if table is not None:
+                try:
+                    notify = self._record_shared(table, window_start, digest, occurrences)
+                except Exception as e:
+                    logger.warning(f"⚠️ [ALERTS] Shared alert state unavailable ({str(e)}), limiting per container")
+            if notify is None:
+                notify = self._notified.get(digest) != window_start
+                if notify:
+                    self._notified[digest] = window_start
+            if notify:
+                self._send(occurrences.subject, self._notification(occurrences, window_start))
+                self.stats['suppressed'] += occurrences.count - 1
+            else:
+                self.stats['suppressed'] += occurrences.count
+
+    def _record_shared(self, table, window_start, digest, occurrences):
+        """Add the counts to the window's item; True when this container should notify"""
+        key = {'fingerprint': digest, 'window_start': window_start}
+        item = table.update_item(
+            Key=key,
+            UpdateExpression='SET subject = if_not_exists(subject, :subject), message = if_not_exists(message, :message), '
+                             'sample_keys = if_not_exists(sample_keys, :keys), expiry_time = :expiry '
+                             'ADD occurrences :count',
+            ExpressionAttributeValues={
+                ':subject': occurrences.subject,
+                ':message': occurrences.message,
+                ':keys': occurrences.keys,
+                ':expiry': window_start + ALERT_RETENTION_SECONDS,
+                ':count': occurrences.count,
+            },
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+        if 'notified_at' in item:
+            return False
+        try:
+            table.update_item(
+                Key=key,
+                UpdateExpression='SET notified_at = :now, notified_occurrences = occurrences',
+                ConditionExpression='attribute_not_exists(notified_at)',
+                ExpressionAttributeValues={':now': int(self._clock())}
+            )
+            return True
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def _notification(self, occurrences, window_start):
+        lines = [
+            occurrences.message,
+            '',
+            f"Occurrences in this invocation: {occurrences.count}",
+            f"Further occurrences in the {self.window}s window starting "
+            f"{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(window_start))} are counted and sent in the error digest.",
+        ]
+        if occurrences.keys:
+            lines.append(f"Sample keys: {', '.join(occurrences.keys)}")
+        return '\n'.join(lines)
+
+    def _send(self, subject, message):
+        try:
+            self.publish(subject[:SUBJECT_LIMIT], message)
+            self.stats['published'] += 1
+        except Exception as e:
+            logger.error(f"❌ [ALERTS] Failed to publish notification: {str(e)}")
+
+    def digest(self, now=None):
+        """
+        One summary of the closed windows of the last ALERT_DIGEST_LOOKBACK_WINDOWS
+        with occurrences after their notification. Each window item is claimed
+        (digested_at) before it is included, so concurrent runs do not repeat it.
+        Returns the number of fingerprints summarized.
+        """
+        table = self._table() if self.table is not None else None
+        if table is None:
+            return 0
+        current = self.window_start(now)
+        oldest, newest = current - ALERT_DIGEST_LOOKBACK_WINDOWS * self.window, current - self.window
+        rows = []
+        for item in self._scan_windows(table, oldest, newest):
+            window_start = int(item['window_start'])
+            if 'digested_at' in item or not oldest <= window_start <= newest:
+                continue
+            unreported = int(item.get('occurrences', 0)) - int(item.get('notified_occurrences', 0))
+            if unreported <= 0 or not self._claim_digest(table, item):
+                continue
+            rows.append((window_start, unreported, int(item.get('occurrences', 0)), item))
+        if rows:
+            self._send(f"EcoMonitor error digest: {sum(row[1] for row in rows)} more errors", self._digest_message(rows))
+        return len(rows)
+
+    @staticmethod
+    def _scan_windows(table, oldest, newest):
+        """Alert items of the windows oldest..newest (the table only holds ALERT_RETENTION_SECONDS of them)"""
+        kwargs = {
+            'FilterExpression': 'window_start BETWEEN :oldest AND :newest',
+            'ExpressionAttributeValues': {':oldest': oldest, ':newest': newest},
+        }
+        while True:
+            response = table.scan(**kwargs)
+            yield from response.get('Items', [])
+            if 'LastEvaluatedKey' not in response:
+                return
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _claim_digest(self, table, item):
+        try:
+            table.update_item(
+                Key={'fingerprint': item['fingerprint'], 'window_start': item['window_start']},
+                UpdateExpression='SET digested_at = :now',
+                ConditionExpression='attribute_not_exists(digested_at)',
+                ExpressionAttributeValues={':now': int(self._clock())}
+            )
+            return True
+        except table.meta.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+    def _digest_message(self, rows):
+        rows.sort(key=lambda row: -row[1])
+        lines = ["Errors since their first notification, per fingerprint and window:", '']
+        for window_start, unreported, total, item in rows[:ALERT_DIGEST_MAX_FINGERPRINTS]:
+            lines.append(f"[{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(window_start))}] {item.get('subject')}: "
+                         f"{unreported} more ({total} in the window)")
+            lines.append(f"    {item.get('message')}")
+            if item.get('sample_keys'):
+                lines.append(f"    Sample keys: {', '.join(item['sample_keys'])}")
+        if len(rows) > ALERT_DIGEST_MAX_FINGERPRINTS:
+            rest = rows[ALERT_DIGEST_MAX_FINGERPRINTS:]
+            lines.append(f"... and {len(rest)} more fingerprints with {sum(row[1] for row in rest)} errors")
+        return '\n'.join(lines)
+
+    def record_metrics(self, metrics):
+        """Add and reset the notification counters of the current invocation"""
+        with self._lock:
+            stats, self.stats = self.stats, {'reported': 0, 'published': 0, 'suppressed': 0}
+        if stats['reported'] or stats['published']:
+            metrics.put('ErrorsReported', stats['reported'], 'Count')
+            metrics.put('ErrorNotificationsPublished', stats['published'], 'Count')
+            metrics.put('ErrorNotificationsSuppressed', stats['suppressed'], 'Count')
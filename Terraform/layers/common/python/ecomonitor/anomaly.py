@@ -0,0 +1,298 @@
+"""
+Streaming per-device anomaly detection.
+
+Every device has a constant-size state: an exponentially weighted mean and
+variance of its readings (weight ANOMALY_ALPHA), its last value, how many
+consecutive readings repeated that value, and the time of the newest reading
+folded in. Each new reading is checked against the state before it is folded in:
+
+- outlier: |value - mean| / stddev above ANOMALY_Z_THRESHOLD once the device has
+  ANOMALY_WARMUP readings. The reading is folded in winsorized to the threshold,
+  so a single spike cannot inflate the variance, while a real level shift still
+  moves the mean within a few readings;
+- flatline: the same value ANOMALY_STUCK_READINGS times in a row (reported once
+  per flat run, when the run reaches the limit).
+
+States live in the readings table, one `<device_id>#detector` partition per
+device (sort key 'state', so the writes spread like the readings themselves),
+and in a per-container LRU cache, so a warm container reads nothing.
+A state is written back only when it advanced, conditional on the stored one
+being older: redelivered or out-of-order readings (older than the state) are
+skipped rather than counted twice, and a concurrent container's newer state
+wins. A write still throttled past the write scheduler's defer limit stays
+cached and is returned as deferred, for the caller to retry with save().
+Anomalies are aggregated per invocation into a few metrics instead of one
+alert metric per reading.
+"""
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from ecomonitor.cache import LRUCache
+from ecomonitor.capacity import WritesDeferred, scheduled
+from ecomonitor.queries import epoch_ms
+from ecomonitor.rollups import is_rollup_item, reading_datetime, reading_value
+
+logger = logging.getLogger()
+
+DETECTOR_SUFFIX = '#detector'
+DETECTOR_SORT_KEY = 'state'
+ANOMALY_DETECTION_ENABLED = os.environ.get('ANOMALY_DETECTION_ENABLED', 'true').lower() == 'true'
+ANOMALY_ALPHA = float(os.environ.get('ANOMALY_ALPHA', '0.1'))
+ANOMALY_Z_THRESHOLD = float(os.environ.get('ANOMALY_Z_THRESHOLD', '4'))
+ANOMALY_WARMUP = int(os.environ.get('ANOMALY_WARMUP', '20'))
+ANOMALY_STUCK_READINGS = int(os.environ.get('ANOMALY_STUCK_READINGS', '12'))
+# Lower bound of the stddev as a fraction of |mean|, so near-constant devices are not all outliers
+ANOMALY_MIN_STDDEV_RATIO = float(os.environ.get('ANOMALY_MIN_STDDEV_RATIO', '0.01'))
+ANOMALY_STATE_CACHE_SIZE = int(os.environ.get('ANOMALY_STATE_CACHE_SIZE', '10000'))
+ANOMALY_IO_CONCURRENCY = int(os.environ.get('ANOMALY_IO_CONCURRENCY', '8'))
+MIN_STDDEV = 1e-9
+
+OUTLIER = 'outlier'
+FLATLINE = 'flatline'
+
+def detector_partition(device_id):
+    return f"{device_id}{DETECTOR_SUFFIX}"
+
+def is_detector_item(item):
+    return str(item.get('device_id', '')).endswith(DETECTOR_SUFFIX)
+
+def _decimal(value):
+    return Decimal(repr(float(value)))
+
+class DeviceState:
+    """EWMA mean/variance, last value and stuck counter of one device"""
+    __slots__ = ('device_id', 'sensor_type', 'metric', 'count', 'mean', 'var', 'last', 'stuck', 'observed_at')
+
+    def __init__(self, device_id, sensor_type, metric, count=0, mean=0.0, var=0.0, last=None, stuck=0, observed_at=0):
+        self.device_id = device_id
+        self.sensor_type = sensor_type
+        self.metric = metric
+        self.count = count
+        self.mean = mean
+        self.var = var
+        self.last = last
+        self.stuck = stuck
+        self.observed_at = observed_at
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(
+            str(item['device_id'])[:-len(DETECTOR_SUFFIX)],
+            str(item.get('sensor_type', '')),
+            str(item.get('metric', '')),
+            int(item.get('count', 0)),
+            float(item.get('mean', 0)),
+            float(item.get('var', 0)),
+            float(item['last']) if item.get('last') is not None else None,
+            int(item.get('stuck', 0)),
+            int(item.get('observed_at', 0))
+        )
+
+    def to_item(self):
+        item = {
+            'device_id': detector_partition(self.device_id),
+            'timestamp': DETECTOR_SORT_KEY,
+            'sensor_type': self.sensor_type,
+            'metric': self.metric,
+            'count': self.count,
+            'mean': _decimal(self.mean),
+            'var': _decimal(self.var),
+            'stuck': self.stuck,
+            'observed_at': self.observed_at,
+        }
+        if self.last is not None:
+            item['last'] = _decimal(self.last)
+        return item
+
+    def copy(self):
+        return DeviceState(self.device_id, self.sensor_type, self.metric, self.count, self.mean, self.var,
+                           self.last, self.stuck, self.observed_at)
+
+    def stddev(self):
+        return max(math.sqrt(self.var), ANOMALY_MIN_STDDEV_RATIO * abs(self.mean), MIN_STDDEV)
+
+    def update(self, value, observed_at, alpha=ANOMALY_ALPHA, threshold=ANOMALY_Z_THRESHOLD,
+               warmup=ANOMALY_WARMUP, stuck_readings=ANOMALY_STUCK_READINGS):
+        """Check one reading against the state, then fold it in. Returns [(kind, detail)]."""
+        anomalies = []
+        if self.last is not None and value == self.last:
+            self.stuck += 1
+            if self.stuck + 1 == stuck_readings:
+                anomalies.append((FLATLINE, {'value': value, 'readings': stuck_readings}))
+        else:
+            self.stuck = 0
+        self.last = value
+        self.observed_at = observed_at
+
+        if self.count == 0:
+            self.count, self.mean, self.var = 1, value, 0.0
+            return anomalies
+
+        stddev = self.stddev()
+        z = (value - self.mean) / stddev
+        if self.count >= warmup and abs(z) > threshold:
+            anomalies.append((OUTLIER, {'value': value, 'mean': round(self.mean, 4), 'z': round(z, 2)}))
+            value = self.mean + math.copysign(threshold * stddev, z)
+
+        # Incremental EWMA of mean and variance (West 1979)
+        diff = value - self.mean
+        increment = alpha * diff
+        self.mean += increment
+        self.var = (1 - alpha) * (self.var + diff * increment)
+        self.count += 1
+        return anomalies
+
+class DetectionResult:
+    """Anomalies and bookkeeping counts of one detect() call"""
+
+    def __init__(self):
+        self.anomalies = []  # (device_id, sensor_type, kind, detail)
+        self.devices = 0
+        self.late = 0
+        self.written = 0
+        self.stale = 0
+        self.failed = 0
+        self.deferred = []  # (state, previous observed_at) still owed
+
+    def merge(self, other):
+        """Fold another result in (one summary per invocation across chunks)"""
+        self.anomalies.extend(other.anomalies)
+        self.devices += other.devices
+        self.late += other.late
+        self.written += other.written
+        self.stale += other.stale
+        self.failed += other.failed
+        self.deferred.extend(other.deferred)
+        return self
+
+    def counts(self):
+        """{(sensor_type, kind): anomalies}"""
+        counts = {}
+        for _, sensor_type, kind, _ in self.anomalies:
+            counts[(sensor_type, kind)] = counts.get((sensor_type, kind), 0) + 1
+        return counts
+
+    def anomalous_devices(self):
+        return len({device_id for device_id, _, _, _ in self.anomalies})
+
+class AnomalyDetector:
+    """Per-device detector states of one table, cached for the container lifetime"""
+
+    def __init__(self, table, cache=None, concurrency=ANOMALY_IO_CONCURRENCY):
+        self.table = table
+        self.cache = cache if cache is not None else LRUCache(ANOMALY_STATE_CACHE_SIZE)
+        self.concurrency = concurrency
+
+    def _load(self, device_ids):
+        """States of devices missing from the cache (GetItem each, in parallel)"""
+        missing = [device_id for device_id in device_ids if device_id not in self.cache]
+
+        def load(device_id):
+            item = self.table.get_item(Key={'device_id': detector_partition(device_id), 'timestamp': DETECTOR_SORT_KEY}).get('Item')
+            return device_id, DeviceState.from_item(item) if item else None
+
+        if missing:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(missing)))) as executor:
+                for device_id, state in executor.map(load, missing):
+                    if state is not None:
+                        self.cache.put(device_id, state)
+        return {device_id: self.cache.get(device_id) for device_id in device_ids}
+
+    def _save(self, states, result, scheduler):
+        conditional_failure = self.table.meta.client.exceptions.ConditionalCheckFailedException
+
+        def save(pair):
+            state, previous_observed_at = pair
+            item = state.to_item()
+            try:
+                scheduled(
+                    scheduler, self.table.put_item, item,
+                    Item=item,
+                    ConditionExpression='attribute_not_exists(observed_at) OR observed_at <= :previous',
+                    ExpressionAttributeValues={':previous': previous_observed_at}
+                )
+                self.cache.put(state.device_id, state)
+                return 'written'
+            except conditional_failure:
+                # Another container advanced this device first; reload its state next time
+                self.cache.invalidate(state.device_id)
+                return 'stale'
+            except WritesDeferred:
+                # Keep the cached state: the next batch continues from it, and the write is retried
+                self.cache.put(state.device_id, state)
+                return 'deferred'
+            except Exception as e:
+                self.cache.invalidate(state.device_id)
+                logger.error(f"Failed to save detector state of {state.device_id}: {str(e)}")
+                return 'failed'
+
+        with ThreadPoolExecutor(max_workers=max(1, min(self.concurrency, len(states)))) as executor:
+            outcomes = list(executor.map(save, states))
+        result.written += outcomes.count('written')
+        result.stale += outcomes.count('stale')
+        result.failed += outcomes.count('failed')
+        result.deferred.extend(pair for pair, outcome in zip(states, outcomes) if outcome == 'deferred')
+
+    def save(self, states, scheduler=None):
+        """Retry deferred (state, previous observed_at) writes. Returns a DetectionResult."""
+        result = DetectionResult()
+        if states:
+            self._save(states, result, scheduler)
+        return result
+
+    def detect(self, items, scheduler=None):
+        """Run a batch of written readings through their devices' states. Returns a DetectionResult."""
+        result = DetectionResult()
+        readings = {}
+        for item in items:
+            if is_rollup_item(item) or is_detector_item(item) or str(item.get('device_id', '')).startswith('#'):
+                continue
+            measured = reading_value(item)
+            moment = reading_datetime(item)
+            if measured is None or moment is None:
+                continue
+            readings.setdefault(str(item['device_id']), []).append(
+                (epoch_ms(moment), float(measured[1]), measured[0], str(item.get('sensor_type', '')))
+            )
+        if not readings:
+            return result
+
+        states = self._load(list(readings))
+        changed = []
+        for device_id, device_readings in readings.items():
+            device_readings.sort()
+            cached = states.get(device_id)
+            # Cached states are shared with concurrent callers; work on a copy
+            state = cached.copy() if cached is not None else None
+            previous_observed_at = state.observed_at if state is not None else 0
+            for observed_at, value, metric, sensor_type in device_readings:
+                if state is None:
+                    state = DeviceState(device_id, sensor_type, metric)
+                if observed_at <= state.observed_at:
+                    result.late += 1
+                    continue
+                for kind, detail in state.update(value, observed_at):
+                    result.anomalies.append((device_id, state.sensor_type, kind, dict(detail, observed_at=observed_at)))
+            if state is not None and state.observed_at > previous_observed_at:
+                changed.append((state, previous_observed_at))
+        result.devices = len(readings)
+        if changed:
+            self._save(changed, result, scheduler)
+        return result
+
+def record_metrics(metrics, result, dimensions=None):
+    """
+    Aggregated alert metrics of one detection pass:
+
+        AnomalyOutliers{SensorType}, AnomalyFlatlines{SensorType}   anomalies
+        AnomalousDevices                                            distinct devices
+    """
+    for (sensor_type, kind), count in result.counts().items():
+        name = 'AnomalyOutliers' if kind == OUTLIER else 'AnomalyFlatlines'
+        metrics.put(name, count, 'Count', (dimensions or []) + [{'Name': 'SensorType', 'Value': sensor_type}])
+    metrics.put('AnomalousDevices', result.anomalous_devices(), 'Count', dimensions or [])
+    if result.late:
+        metrics.put('AnomalyLateReadings', result.late, 'Count', dimensions or [])
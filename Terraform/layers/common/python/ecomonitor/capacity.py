@@ -0,0 +1,263 @@
+"""
+Capacity-aware DynamoDB write scheduling.
+
+The table is provisioned (20 WCU, 10 WCU on DateIndex), so writing as fast as
+possible only produces ProvisionedThroughputExceededException. A WriteScheduler
+keeps one token bucket per capacity pool (the table and each GSI), seeded from
+the provisioned write capacity reported by DescribeTable:
+
+- every write first takes its estimated units from the buckets it consumes,
+  queueing the caller until the buckets refill instead of sending the request;
+- ReturnConsumedCapacity=INDEXES feedback corrects the per-item estimate
+  (items over 1 KB cost more than one unit) and charges any shortfall;
+- the refill rate follows AIMD: it grows additively after accepted writes up to
+  the provisioned ceiling and is cut multiplicatively on every throttle, after
+  which the write is retried with backoff.
+
+A write that is still throttled after WRITE_MAX_DEFER_SECONDS raises
+WritesDeferred; callers report those items as deferred for a later retry rather
+than as failures. Derived writes (rollups, latest items, detector states) have
+no redelivery to fall back on, so they are kept in a Backlog and retried by the
+container instead.
+"""
+import logging
+import os
+import random
+import threading
+import time
+
+from ecomonitor.ratelimit import TokenBucket
+
+logger = logging.getLogger()
+
+WRITE_SCHEDULER_ENABLED = os.environ.get('WRITE_SCHEDULER_ENABLED', 'true').lower() == 'true'
+# Fraction of the provisioned capacity one container aims for
+WRITE_CAPACITY_SHARE = float(os.environ.get('WRITE_CAPACITY_SHARE', '0.9'))
+# Used when DescribeTable is not allowed or fails
+WRITE_CAPACITY_FALLBACK = float(os.environ.get('WRITE_CAPACITY_FALLBACK', '20'))
+WRITE_AIMD_INCREASE = float(os.environ.get('WRITE_AIMD_INCREASE', '0.5'))  # units/s per accepted item
+WRITE_AIMD_DECREASE = float(os.environ.get('WRITE_AIMD_DECREASE', '0.5'))  # rate multiplier on a throttle
+WRITE_MAX_DEFER_SECONDS = float(os.environ.get('WRITE_MAX_DEFER_SECONDS', '20'))
+
+TABLE = 'table'
+THROTTLE_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+MIN_RATE = 1.0
+BACKOFF_BASE = 0.05  # seconds
+BACKOFF_MAX = 2.0  # seconds
+ESTIMATE_WEIGHT = 0.2  # weight of the newest observation in the per-item cost estimate
+DECREASE_INTERVAL = 1.0  # seconds; concurrent throttles of one burst cut the rate only once
+
+class WritesDeferred(Exception):
+    """Writes that stayed throttled for longer than the scheduler may wait"""
+
+class Backlog:
+    """
+    Deferred writes owed by this container, one per key until they are taken
+    for a retry. `merge(owed, new)` combines two writes of the same key
+    (default: the new one replaces the owed one).
+    """
+
+    def __init__(self, merge=None):
+        self._merge = merge or (lambda owed, new: new)
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def add(self, key, value):
+        with self._lock:
+            owed = self._pending.get(key)
+            self._pending[key] = value if owed is None else self._merge(owed, value)
+
+    def take(self):
+        """Every owed write, emptying the backlog"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return list(pending.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+def is_throttle(error):
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in THROTTLE_CODES
+
+def provisioned_write_capacity(client, table_name):
+    """
+    ({pool: write units}, {index name: hash key}) of a table. Pools are 'table'
+    plus every GSI; on-demand tables report no pools (nothing to schedule).
+    """
+    description = client.describe_table(TableName=table_name)['Table']
+    if description.get('BillingModeSummary', {}).get('BillingMode') == 'PAY_PER_REQUEST':
+        return {}, {}
+    capacities = {TABLE: float(description['ProvisionedThroughput']['WriteCapacityUnits'])}
+    index_keys = {}
+    for index in description.get('GlobalSecondaryIndexes', []):
+        capacities[index['IndexName']] = float(index['ProvisionedThroughput']['WriteCapacityUnits'])
+        index_keys[index['IndexName']] = next(key['AttributeName'] for key in index['KeySchema'] if key['KeyType'] == 'HASH')
+    return capacities, index_keys
+
+def consumed_units(consumed):
+    """{pool: units} of one ConsumedCapacity entry (ReturnConsumedCapacity=INDEXES or TOTAL)"""
+    if not consumed:
+        return {}
+    units = {TABLE: float(consumed.get('Table', {}).get('CapacityUnits', consumed.get('CapacityUnits', 0)))}
+    for name, index in (consumed.get('GlobalSecondaryIndexes') or {}).items():
+        units[name] = float(index.get('CapacityUnits', 0))
+    return units
+
+class WriteScheduler:
+    """AIMD token buckets in front of a provisioned table's write capacity"""
+
+    def __init__(self, capacities, index_keys=None, share=WRITE_CAPACITY_SHARE, increase=WRITE_AIMD_INCREASE,
+                 decrease=WRITE_AIMD_DECREASE, max_defer=WRITE_MAX_DEFER_SECONDS, clock=time.monotonic, sleep=time.sleep):
+        self.ceilings = {pool: max(MIN_RATE, units * share) for pool, units in capacities.items()}
+        self.buckets = {pool: TokenBucket(ceiling, clock=clock, sleep=sleep) for pool, ceiling in self.ceilings.items()}
+        self.index_keys = dict(index_keys or {})
+        self.costs = {pool: 1.0 for pool in capacities}
+        self.increase = increase
+        self.decrease = decrease
+        self.max_defer = max_defer
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._last_decrease = None
+        self.stats = {'writes': 0, 'throttles': 0, 'waited_seconds': 0.0}
+
+    def pools_for(self, item):
+        """Capacity pools a put of `item` consumes: the table plus every GSI whose key it carries"""
+        return [TABLE] + [name for name, key in self.index_keys.items() if key in item and name in self.buckets]
+
+    def rates(self):
+        return {pool: bucket.rate for pool, bucket in self.buckets.items()}
+
+    def batch_size(self, limit):
+        """
+        Items per batch request that every bucket can admit at once. Bigger
+        batches would arrive as one burst above the provisioned rate and come
+        back partly unprocessed.
+        """
+        fits = min(bucket.capacity / self.costs.get(pool, 1.0) for pool, bucket in self.buckets.items())
+        return max(1, min(limit, int(fits)))
+
+    def _take(self, pool, units):
+        """Block until `units` are available; requests bigger than the bucket are taken in pieces"""
+        bucket = self.buckets.get(pool)
+        waited = 0.0
+        while bucket is not None and units > 0:
+            piece = min(units, bucket.capacity)
+            waited += bucket.acquire(piece)
+            units -= piece
+        return waited
+
+    def acquire(self, items=1, pools=(TABLE,)):
+        """Wait for the estimated cost of writing `items` items to `pools`. Returns the estimate."""
+        estimate = {pool: items * self.costs.get(pool, 1.0) for pool in pools}
+        waited = sum(self._take(pool, units) for pool, units in estimate.items())
+        with self._lock:
+            self.stats['waited_seconds'] += waited
+        return estimate
+
+    def observe(self, consumed, items, estimate):
+        """Feed back ConsumedCapacity entries of an accepted write and grow the rates additively"""
+        actual = {}
+        for entry in consumed or []:
+            for pool, units in consumed_units(entry).items():
+                actual[pool] = actual.get(pool, 0.0) + units
+        with self._lock:
+            self.stats['writes'] += items
+            for pool, units in actual.items():
+                if pool in self.costs and items:
+                    self.costs[pool] += ESTIMATE_WEIGHT * (units / items - self.costs[pool])
+        # Writes that cost more than estimated are paid for before the next one goes out
+        for pool, units in actual.items():
+            shortfall = units - estimate.get(pool, 0.0)
+            if shortfall > 0:
+                self._take(pool, shortfall)
+        for pool, bucket in self.buckets.items():
+            if items and bucket.rate < self.ceilings[pool]:
+                bucket.set_rate(min(self.ceilings[pool], bucket.rate + self.increase * items))
+
+    def throttled(self):
+        """Multiplicative decrease after a throttle (at most once per DECREASE_INTERVAL)"""
+        now = self._clock()
+        with self._lock:
+            self.stats['throttles'] += 1
+            if self._last_decrease is not None and now - self._last_decrease < DECREASE_INTERVAL:
+                return
+            self._last_decrease = now
+        for bucket in self.buckets.values():
+            bucket.set_rate(max(MIN_RATE, bucket.rate * self.decrease))
+        logger.warning(f"⏳ [CAPACITY] Write throttled, rates now {self.rates()}")
+
+    def backoff(self, attempt):
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+        self._sleep(delay)
+        with self._lock:
+            self.stats['waited_seconds'] += delay
+
+    def call(self, operation, items=1, pools=(TABLE,), **kwargs):
+        """
+        Run one write operation (put_item, update_item, ...) under the schedule,
+        retrying throttles with backoff. Raises WritesDeferred once the retries
+        have taken longer than max_defer seconds.
+        """
+        deadline = self._clock() + self.max_defer
+        attempt = 0
+        while True:
+            estimate = self.acquire(items, pools)
+            try:
+                response = operation(ReturnConsumedCapacity='INDEXES', **kwargs)
+            except Exception as e:
+                if not is_throttle(e):
+                    raise
+                self.throttled()
+                if self._clock() >= deadline:
+                    raise WritesDeferred(str(e)) from e
+                self.backoff(attempt)
+                attempt += 1
+                continue
+            consumed = response.get('ConsumedCapacity')
+            self.observe([consumed] if isinstance(consumed, dict) else consumed, items, estimate)
+            return response
+
+    def record_metrics(self, metrics):
+        """Add and reset the scheduler counters of the current invocation"""
+        with self._lock:
+            stats, self.stats = self.stats, {'writes': 0, 'throttles': 0, 'waited_seconds': 0.0}
+        if stats['throttles']:
+            metrics.put('WriteThrottles', stats['throttles'], 'Count')
+        if stats['waited_seconds']:
+            metrics.put('WriteSchedulerWait', stats['waited_seconds'] * 1000, 'Milliseconds')
+        for pool, rate in self.rates().items():
+            metrics.put('WriteRate', rate, 'Count/Second', [{'Name': 'Pool', 'Value': pool}])
+
+def scheduled(scheduler, operation, item=None, **kwargs):
+    """operation(**kwargs) for one item, through `scheduler` when there is one"""
+    if scheduler is None:
+        return operation(**kwargs)
+    return scheduler.call(operation, 1, scheduler.pools_for(item) if item is not None else (TABLE,), **kwargs)
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def scheduler_for(client, table_name):
+    """Per-container scheduler of a table (None when disabled or the table is on-demand)"""
+    if not WRITE_SCHEDULER_ENABLED:
+        return None
+    if table_name in _schedulers:
+        return _schedulers[table_name]
+    with _schedulers_lock:
+        if table_name not in _schedulers:
+            try:
+                capacities, index_keys = provisioned_write_capacity(client, table_name)
+            except Exception as e:
+                logger.warning(f"⚠️ [CAPACITY] DescribeTable failed ({str(e)}), assuming {WRITE_CAPACITY_FALLBACK} WCU")
+                capacities, index_keys = {TABLE: WRITE_CAPACITY_FALLBACK}, {}
+            _schedulers[table_name] = WriteScheduler(capacities, index_keys) if capacities else None
+        return _schedulers[table_name]
+
+def record_metrics(metrics):
+    """Scheduler metrics of every table this container writes to"""
+    for scheduler in list(_schedulers.values()):
+        if scheduler is not None:
+            scheduler.record_metrics(metrics)
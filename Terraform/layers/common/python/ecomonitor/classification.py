@@ -0,0 +1,153 @@
+"""
+Table-driven reading classification.
+
+Each sensor type has a BandTable: an ordered list of bands, each with an upper
+bound, whether that bound is inclusive, and the fields (category, health
+status, ...) a reading in the band gets. Inclusive bounds are nudged to the next
+float up, so every band boundary means "value < edge" and a reading's band is
+one bisect_right over the edges. Whole arrays are classified at once with NumPy
+`searchsorted` when NumPy is installed (it is optional; without it arrays fall
+back to per-value bisection).
+
+The default tables reproduce the thresholds the simulators have always used.
+Changing a threshold means changing a table (or loading one with
+load_band_tables), after which tools/recategorize.py re-applies it to the
+compacted archive.
+"""
+import bisect
+import copy
+import json
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+class BandTable:
+    """Ordered value bands of one sensor type"""
+
+    def __init__(self, sensor_type, bands):
+        """
+        `bands` is a list of {'upper': number|None, 'inclusive': bool, 'fields': {...}}
+        in ascending order; the last band must be open-ended (upper None).
+        """
+        if not bands or bands[-1].get('upper') is not None:
+            raise ValueError(f"Band table for {sensor_type} must end with an open-ended band")
+        self.sensor_type = sensor_type
+        self.bands = copy.deepcopy(bands)
+        self.edges = []
+        for band in bands[:-1]:
+            upper = float(band['upper'])
+            self.edges.append(math.nextafter(upper, math.inf) if band.get('inclusive') else upper)
+        if self.edges != sorted(self.edges):
+            raise ValueError(f"Band bounds for {sensor_type} must be ascending")
+        self.fields = [band['fields'] for band in bands]
+        self.field_names = sorted({name for fields in self.fields for name in fields})
+
+    @classmethod
+    def from_spec(cls, sensor_type, spec):
+        return cls(sensor_type, spec)
+
+    def to_spec(self):
+        return copy.deepcopy(self.bands)
+
+    def index(self, value):
+        """Band index of one reading"""
+        return bisect.bisect_right(self.edges, value)
+
+    def classify(self, value):
+        """Category fields of one reading (a fresh dict the caller may modify)"""
+        return dict(self.fields[self.index(value)])
+
+    def indexes(self, values):
+        """
+        Band index of every value in a sequence of numbers (a NumPy array when
+        NumPy is available). Missing values (None/NaN) get the index len(bands).
+        """
+        if numpy is not None:
+            values = numpy.asarray(values, dtype=float)
+            band_indexes = numpy.searchsorted(numpy.asarray(self.edges), values, side='right')
+            band_indexes[numpy.isnan(values)] = len(self.bands)
+            return band_indexes
+        return [
+            len(self.bands) if value is None or value != value else bisect.bisect_right(self.edges, value)
+            for value in values
+        ]
+
+    def classify_array(self, values):
+        """{field: labels} for a whole column of readings; missing values get None"""
+        band_indexes = self.indexes(values)
+        columns = {}
+        for name in self.field_names:
+            labels = [fields.get(name) for fields in self.fields] + [None]
+            if numpy is not None:
+                columns[name] = numpy.asarray(labels, dtype=object)[band_indexes].tolist()
+            else:
+                columns[name] = [labels[index] for index in band_indexes]
+        return columns
+
+DEFAULT_BANDS = {
+    'aqi': [
+        {'upper': 50, 'inclusive': True, 'fields': {'category': "Good", 'health_concern': "Minimal"}},
+        {'upper': 100, 'inclusive': True, 'fields': {'category': "Moderate", 'health_concern': "Acceptable"}},
+        {'upper': 150, 'inclusive': True, 'fields': {'category': "Unhealthy for Sensitive Groups", 'health_concern': "Sensitive people may experience problems"}},
+        {'upper': None, 'fields': {'category': "Unhealthy", 'health_concern': "Everyone may experience problems"}},
+    ],
+    'co2': [
+        {'upper': 400, 'inclusive': False, 'fields': {'category': "Excellent", 'health_impact': "Fresh outdoor air level"}},
+        {'upper': 600, 'inclusive': False, 'fields': {'category': "Good", 'health_impact': "Acceptable indoor air quality"}},
+        {'upper': 1000, 'inclusive': False, 'fields': {'category': "Acceptable", 'health_impact': "Drowsiness may occur"}},
+        {'upper': 1500, 'inclusive': False, 'fields': {'category': "High", 'health_impact': "Stuffy air, poor concentration"}},
+        {'upper': None, 'fields': {'category': "Very High", 'health_impact': "Immediate ventilation required"}},
+    ],
+    'humidity': [
+        {'upper': 40, 'inclusive': False, 'fields': {'category': "Low"}},
+        {'upper': 60, 'inclusive': False, 'fields': {'category': "Optimal"}},
+        {'upper': 75, 'inclusive': False, 'fields': {'category': "High"}},
+        {'upper': None, 'fields': {'category': "Very High"}},
+    ],
+    'temperature': [
+        {'upper': 18, 'inclusive': False, 'fields': {'category': "Very Cold", 'health_status': "Alert"}},
+        {'upper': 20, 'inclusive': False, 'fields': {'category': "Cold", 'health_status': "Moderate"}},
+        {'upper': 28, 'inclusive': True, 'fields': {'category': "Optimal", 'health_status': "Good"}},
+        {'upper': 35, 'inclusive': True, 'fields': {'category': "Warm", 'health_status': "Moderate"}},
+        {'upper': None, 'fields': {'category': "Very Hot", 'health_status': "Alert"}},
+    ],
+}
+
+BAND_TABLES = {}
+
+def register_bands(table):
+    """Add or replace the band table of a sensor type"""
+    BAND_TABLES[table.sensor_type] = table
+    return table
+
+def get_bands(sensor_type):
+    try:
+        return BAND_TABLES[sensor_type]
+    except KeyError:
+        raise ValueError(f"No classification bands registered for type: {sensor_type}")
+
+def load_band_tables(source):
+    """Register band tables from a {sensor_type: [bands...]} dict or JSON file path"""
+    if isinstance(source, str):
+        with open(source) as handle:
+            source = json.load(handle)
+    return [register_bands(BandTable.from_spec(sensor_type, spec)) for sensor_type, spec in source.items()]
+
+def classify_item(item, value_field, sensor_type, overwrite=False):
+    """
+    Add the category fields of `item[value_field]` to a reading item. Fields the
+    device already sent are kept unless `overwrite` is set. Returns the item.
+    """
+    table = BAND_TABLES.get(sensor_type)
+    value = item.get(value_field)
+    if table is None or value is None or isinstance(value, (bool, str)):
+        return item
+    for name, label in table.classify(value).items():
+        if overwrite or name not in item:
+            item[name] = label
+    return item
+
+load_band_tables(DEFAULT_BANDS)
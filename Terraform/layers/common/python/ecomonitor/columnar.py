@@ -0,0 +1,142 @@
+"""
+Compact column-oriented file format for sensor readings.
+
+Rows (dicts) are pivoted into columns. Columns whose values are all numbers are
+stored as float64 arrays (NaN marks a missing value); every other column is
+dictionary-encoded into a uint32 index array plus a list of distinct strings
+(index 0 means missing). The layout is:
+
+    b'ECOL' | version (1 byte) | header length (uint32 LE) | header JSON | column arrays
+
+and the whole file is gzip-compressed. Repeated strings such as device ids and
+categories collapse to a few bytes per row, and a reader can pull a single
+column without parsing the others.
+"""
+import array
+import gzip
+import json
+import math
+import struct
+import sys
+from decimal import Decimal
+
+MAGIC = b'ECOL'
+VERSION = 1
+FILE_EXTENSION = '.ecol.gz'
+
+NUMERIC = 'f64'
+DICTIONARY = 'dict'
+
+def _is_number(value):
+    return isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+def encode_rows(rows, column_order=None):
+    """Encode a list of dict rows into gzip-compressed ECOL bytes"""
+    columns = list(column_order or [])
+    seen = set(columns)
+    for row in rows:
+        for name in row:
+            if name not in seen:
+                seen.add(name)
+                columns.append(name)
+    return encode_columns({name: [row.get(name) for row in rows] for name in columns}, len(rows))
+
+def encode_columns(columns, rows_count):
+    """
+    Encode {column: values} (None marks a missing value) into gzip-compressed
+    ECOL bytes. Numeric columns may be passed as array('d') as returned by
+    decode_columns, so a file can be rewritten without pivoting it into rows.
+    """
+    header = {'rows': rows_count, 'columns': []}
+    payload = []
+    for name, values in columns.items():
+        if isinstance(values, array.array) and values.typecode == 'd':
+            data = values
+            header['columns'].append({'name': name, 'type': NUMERIC, 'bytes': len(data) * data.itemsize})
+            payload.append(_little_endian(data).tobytes())
+            continue
+        present = [value for value in values if value is not None]
+        if present and all(_is_number(value) for value in present):
+            data = array.array('d', (float(value) if value is not None else math.nan for value in values))
+            header['columns'].append({'name': name, 'type': NUMERIC, 'bytes': len(data) * data.itemsize})
+        else:
+            dictionary = {}
+            indexes = array.array('I')
+            for value in values:
+                if value is None:
+                    indexes.append(0)
+                    continue
+                text = value if isinstance(value, str) else json.dumps(value, default=str)
+                index = dictionary.get(text)
+                if index is None:
+                    index = dictionary[text] = len(dictionary) + 1
+                indexes.append(index)
+            data = indexes
+            header['columns'].append({
+                'name': name,
+                'type': DICTIONARY,
+                'bytes': len(data) * data.itemsize,
+                'dictionary': list(dictionary)
+            })
+        payload.append(_little_endian(data).tobytes())
+
+    header_bytes = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    raw = MAGIC + bytes([VERSION]) + struct.pack('<I', len(header_bytes)) + header_bytes + b''.join(payload)
+    return gzip.compress(raw, compresslevel=6)
+
+def _read_header(raw):
+    if raw[:4] != MAGIC:
+        raise ValueError("Not an ECOL file")
+    if raw[4] != VERSION:
+        raise ValueError(f"Unsupported ECOL version: {raw[4]}")
+    (header_length,) = struct.unpack_from('<I', raw, 5)
+    offset = 9 + header_length
+    return json.loads(raw[9:offset].decode('utf-8')), offset
+
+def decode_columns(data, columns=None):
+    """
+    Decode ECOL bytes into {column: values}. Numeric columns come back as
+    array('d') with NaN for missing values, dictionary columns as lists of
+    strings/None. Pass `columns` to decode only a subset.
+    """
+    raw = gzip.decompress(data)
+    header, offset = _read_header(raw)
+    wanted = set(columns) if columns else None
+    result = {}
+    for column in header['columns']:
+        size = column['bytes']
+        if wanted is None or column['name'] in wanted:
+            chunk = raw[offset:offset + size]
+            if column['type'] == NUMERIC:
+                values = array.array('d')
+                values.frombytes(chunk)
+                result[column['name']] = _little_endian(values)
+            else:
+                indexes = array.array('I')
+                indexes.frombytes(chunk)
+                dictionary = [None] + column['dictionary']
+                result[column['name']] = [dictionary[index] for index in _little_endian(indexes)]
+        offset += size
+    return result
+
+def decode_rows(data, columns=None):
+    """Decode ECOL bytes back into a list of dict rows (missing values are omitted), optionally only `columns`"""
+    columns = decode_columns(data, columns)
+    names = list(columns)
+    rows_count = len(next(iter(columns.values()))) if columns else 0
+    rows = []
+    for position in range(rows_count):
+        row = {}
+        for name in names:
+            value = columns[name][position]
+            if value is None or (isinstance(value, float) and math.isnan(value)):
+                continue
+            row[name] = value
+        rows.append(row)
+    return rows
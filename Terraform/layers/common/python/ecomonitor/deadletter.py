@@ -0,0 +1,67 @@
+"""
+Dead-letter sink for readings that can never be written.
+
+Readings that fail schema validation (see ecomonitor.schemas) or are not valid
+JSON never reach DynamoDB and never page anyone. They are written to S3 under
+DEAD_LETTER_PREFIX, as one NDJSON object per source object, one line per
+rejected reading:
+
+    <prefix><source key>.rejected.ndjson            (or .partN.ndjson for big files)
+    {"source": "bucket/key", "sensor_type": ..., "problems": [...], "record": ...}
+
+The key is derived from the source key only, so a redelivered object
+overwrites its dead letters instead of duplicating them. DEAD_LETTER_BUCKET
+defaults to the source bucket; the processor's S3 trigger only covers
+sensors/, so dead letters are not ingested again; a fixed `record` uploaded
+under sensors/ is replayed.
+"""
+import json
+import os
+
+DEAD_LETTER_BUCKET = os.environ.get('DEAD_LETTER_BUCKET')
+DEAD_LETTER_PREFIX = os.environ.get('DEAD_LETTER_PREFIX', 'dead-letter/')
+DEAD_LETTER_PART_SIZE = int(os.environ.get('DEAD_LETTER_PART_SIZE', '1000'))  # lines per object
+
+class DeadLetters:
+    """Rejected readings of one source object, written to S3 in parts of `part_size` lines"""
+
+    def __init__(self, client, source_bucket, source_key, bucket=None, prefix=DEAD_LETTER_PREFIX,
+                 part_size=DEAD_LETTER_PART_SIZE):
+        self.client = client
+        self.source_bucket = source_bucket
+        self.source_key = source_key
+        self.bucket = bucket or DEAD_LETTER_BUCKET or source_bucket
+        self.prefix = prefix
+        self.part_size = max(1, part_size)
+        self.pending = []
+        self.parts = 0
+        self.count = 0
+        self.keys = []
+
+    def add(self, record, problems, sensor_type=None):
+        """Queue one rejected reading; `problems` is a list of reasons or an exception"""
+        if isinstance(problems, BaseException):
+            problems = list(getattr(problems, 'problems', None) or [str(problems)])
+        self.pending.append({
+            'source': f"{self.source_bucket}/{self.source_key}",
+            'sensor_type': sensor_type,
+            'problems': problems,
+            'record': record,
+        })
+        self.count += 1
+        if len(self.pending) >= self.part_size:
+            self._write(f"{self.prefix}{self.source_key}.part{self.parts}.ndjson")
+
+    def flush(self):
+        """Write the queued readings; returns the dead-letter keys written so far"""
+        if self.pending:
+            suffix = f".part{self.parts}" if self.parts else '.rejected'
+            self._write(f"{self.prefix}{self.source_key}{suffix}.ndjson")
+        return self.keys
+
+    def _write(self, key):
+        body = ''.join(json.dumps(line, default=str, ensure_ascii=False) + '\n' for line in self.pending)
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=body.encode('utf-8'), ContentType='application/x-ndjson')
+        self.pending = []
+        self.parts += 1
+        self.keys.append(key)
@@ -0,0 +1,248 @@
+"""
+Multi-reading device payload envelope.
+
+A publisher with many readings (the fleet simulator, a gateway) sends them as
+one message instead of one verbose JSON document each. The envelope only
+carries what the processor cannot derive: category and health fields are
+recomputed from the classification bands, and a device's sensor type,
+location and unit are stated once per envelope rather than once per reading.
+
+Binary layout (version 1; integers are varints, see ecomonitor.varint):
+
+    b'EMV' | version (1 byte) | batch id (length + UTF-8)
+    | strings: count, then length + UTF-8 each
+    | devices: count, then 4 string references each:
+               device_id, sensor_type, location, unit (0 = none, n = strings[n - 1])
+    | readings: count | scale (1 byte, FLOAT_SCALE = float64)
+    | device index per reading
+    | epoch-millis times: first absolute, then zigzag deltas
+    | values: zigzag varints of value * 10**scale, or float64 LE
+
+A reading typically costs 4-6 bytes instead of a ~250 byte JSON document. The
+JSON fallback has the same structure, for consumers that need text:
+
+    {"envelope": 1, "batch_id": "...",
+     "devices": [[device_id, sensor_type, location, unit], ...],
+     "readings": [[device index, epoch millis, value], ...]}
+
+Both forms decode to the reading documents the simulators publish (device_id,
+<value field>, unit, location, reading_time, sensor_type) with `timestamp`
+set to the reading's epoch millis, as the IoT rules set it for single readings.
+Several readings of a device within the same millisecond get -1, -2, ...
+suffixes, so every reading keeps its own, redelivery-stable sort key.
+"""
+import array
+import datetime
+import json
+import sys
+from decimal import Decimal
+
+from ecomonitor.profiles import PROFILES
+from ecomonitor.varint import (FLOAT_SCALE, read_string, read_varint, scale_of, scaled, unzigzag, write_string,
+                               write_varint, zigzag)
+
+MAGIC = b'EMV'
+VERSION = 1
+ENVELOPE_TOPIC = 'eco/sensors/envelope'
+FILE_EXTENSION = '.emv'
+# AWS IoT Core rejects messages above 128 KB
+MAX_MESSAGE_BYTES = 128 * 1024
+DEFAULT_VALUE_FIELD = 'value'
+
+def value_field(sensor_type):
+    profile = PROFILES.get(sensor_type)
+    return profile.value_field if profile is not None else DEFAULT_VALUE_FIELD
+
+class EnvelopeBuilder:
+    """Readings of one envelope, encoded to binary or JSON"""
+
+    def __init__(self, batch_id=''):
+        self.batch_id = str(batch_id)
+        self.devices = []
+        self._device_index = {}
+        self.readings = []  # (device index, epoch millis, value)
+
+    def __len__(self):
+        return len(self.readings)
+
+    def add(self, device_id, sensor_type, value, observed_at, location=None, unit=None):
+        """Add one reading; observed_at is epoch millis or a datetime (naive = UTC). A missing value raises ValueError."""
+        if value is None:
+            raise ValueError(f"Reading of {device_id} at {observed_at} has no value")
+        if isinstance(observed_at, datetime.datetime):
+            observed_at = int(observed_at.replace(tzinfo=observed_at.tzinfo or datetime.timezone.utc).timestamp() * 1000)
+        device = (str(device_id), str(sensor_type), location, unit)
+        index = self._device_index.get(device)
+        if index is None:
+            index = self._device_index[device] = len(self.devices)
+            self.devices.append(device)
+        self.readings.append((index, int(observed_at), value))
+        return self
+
+    def encode(self):
+        """Binary envelope bytes"""
+        strings, string_index = [], {}
+
+        def reference(value):
+            if value is None:
+                return 0
+            value = str(value)
+            if value not in string_index:
+                string_index[value] = len(strings)
+                strings.append(value)
+            return string_index[value] + 1
+
+        devices = [[reference(field) for field in device] for device in self.devices]
+        out = bytearray(MAGIC)
+        out.append(VERSION)
+        write_string(out, self.batch_id)
+        write_varint(out, len(strings))
+        for value in strings:
+            write_string(out, value)
+        write_varint(out, len(devices))
+        for references in devices:
+            for reference_id in references:
+                write_varint(out, reference_id)
+
+        values = [value for _, _, value in self.readings]
+        scale = scale_of(values)
+        write_varint(out, len(self.readings))
+        out.append(scale)
+        for index, _, _ in self.readings:
+            write_varint(out, index)
+        previous = 0
+        for position, (_, observed_at, _) in enumerate(self.readings):
+            write_varint(out, observed_at if position == 0 else zigzag(observed_at - previous))
+            previous = observed_at
+        if scale == FLOAT_SCALE:
+            data = array.array('d', (float(value) for value in values))
+            if sys.byteorder != 'little':
+                data.byteswap()
+            out.extend(data.tobytes())
+        else:
+            for value in values:
+                write_varint(out, zigzag(scaled(value, scale)))
+        return bytes(out)
+
+    def encode_json(self):
+        """JSON fallback envelope (UTF-8 bytes)"""
+        document = {
+            'envelope': VERSION,
+            'batch_id': self.batch_id,
+            'devices': [list(device) for device in self.devices],
+            'readings': [[index, observed_at, float(value) if isinstance(value, Decimal) else value]
+                         for index, observed_at, value in self.readings],
+        }
+        return json.dumps(document, separators=(',', ':')).encode('utf-8')
+
+def pack(readings, batch_id, max_readings, encoding='binary', max_bytes=MAX_MESSAGE_BYTES):
+    """
+    Encode readings [(device_id, sensor_type, value, observed_at, location, unit), ...]
+    into envelopes of at most `max_readings` readings and `max_bytes` bytes.
+    Returns [(payload bytes, readings)] in input order.
+    """
+    messages = []
+    max_readings = max(1, max_readings)
+
+    def emit(group):
+        builder = EnvelopeBuilder(f"{batch_id}-{len(messages)}")
+        for reading in group:
+            builder.add(*reading)
+        payload = builder.encode_json() if encoding == 'json' else builder.encode()
+        if len(payload) > max_bytes and len(group) > 1:
+            middle = len(group) // 2
+            emit(group[:middle])
+            emit(group[middle:])
+            return
+        messages.append((payload, group))
+
+    for start in range(0, len(readings), max_readings):
+        emit(readings[start:start + max_readings])
+    return messages
+
+def is_binary_envelope(body):
+    return bytes(body[:len(MAGIC)]) == MAGIC
+
+def is_json_envelope(document):
+    return isinstance(document, dict) and 'envelope' in document and 'readings' in document
+
+def _documents(devices, readings):
+    """Reading documents of decoded devices [(device_id, sensor_type, location, unit)] and readings [(index, millis, value)]"""
+    documents = []
+    seen = {}
+    for index, observed_at, value in readings:
+        device_id, sensor_type, location, unit = devices[index]
+        timestamp = str(observed_at)
+        repeat = seen.get((device_id, observed_at), 0)
+        seen[(device_id, observed_at)] = repeat + 1
+        if repeat:
+            timestamp = f"{timestamp}-{repeat}"
+        moment = datetime.datetime.utcfromtimestamp(observed_at / 1000.0)
+        document = {'device_id': device_id, value_field(sensor_type): value}
+        if unit:
+            document['unit'] = unit
+        document['timestamp'] = timestamp
+        document['reading_time'] = moment.isoformat(timespec='milliseconds')
+        if location:
+            document['location'] = location
+        document['sensor_type'] = sensor_type
+        documents.append(document)
+    return documents
+
+def decode(body):
+    """Reading documents of a binary envelope (values as Decimal, ready for DynamoDB)"""
+    data = bytes(body)
+    if not is_binary_envelope(data):
+        raise ValueError("Not a binary reading envelope")
+    offset = len(MAGIC)
+    if data[offset] != VERSION:
+        raise ValueError(f"Unsupported envelope version: {data[offset]}")
+    _, offset = read_string(data, offset + 1)  # batch id: only traces the publish
+
+    count, offset = read_varint(data, offset)
+    strings = []
+    for _ in range(count):
+        value, offset = read_string(data, offset)
+        strings.append(value)
+    count, offset = read_varint(data, offset)
+    devices = []
+    for _ in range(count):
+        fields = []
+        for _ in range(4):
+            reference, offset = read_varint(data, offset)
+            fields.append(strings[reference - 1] if reference else None)
+        devices.append(tuple(fields))
+
+    count, offset = read_varint(data, offset)
+    scale = data[offset]
+    offset += 1
+    indexes = []
+    for _ in range(count):
+        index, offset = read_varint(data, offset)
+        indexes.append(index)
+    times = []
+    previous = 0
+    for position in range(count):
+        raw, offset = read_varint(data, offset)
+        previous = raw if position == 0 else previous + unzigzag(raw)
+        times.append(previous)
+    if scale == FLOAT_SCALE:
+        floats = array.array('d')
+        floats.frombytes(data[offset:offset + count * 8])
+        if sys.byteorder != 'little':
+            floats.byteswap()
+        values = [Decimal(repr(value)) for value in floats]
+    else:
+        values = []
+        for _ in range(count):
+            raw, offset = read_varint(data, offset)
+            values.append(Decimal(unzigzag(raw)).scaleb(-scale))
+    return _documents(devices, zip(indexes, times, values))
+
+def decode_json(document):
+    """Reading documents of a parsed JSON envelope"""
+    if document.get('envelope') != VERSION:
+        raise ValueError(f"Unsupported envelope version: {document.get('envelope')}")
+    devices = [tuple(list(device) + [None] * (4 - len(device))) for device in document.get('devices', [])]
+    readings = [(int(index), int(observed_at), value) for index, observed_at, value in document.get('readings', [])]
+    return _documents(devices, readings)
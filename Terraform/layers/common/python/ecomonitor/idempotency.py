@@ -0,0 +1,110 @@
+"""
+Idempotent ingestion helpers.
+
+S3 event notifications are delivered at least once, so the same object can be
+processed several times. Three mechanisms keep a redelivery from creating or
+counting a reading twice:
+
+- stable reading keys: a reading without its own timestamp gets a sort key
+  derived from the source object (key + version/ETag) and its payload, so every
+  delivery of it targets the same item instead of a per-request id;
+- a bounded in-container cache of recently written reading keys, which drops
+  duplicates arriving at a warm container without any DynamoDB call;
+- conditional writes: readings are put with attribute_not_exists, and whole
+  batch files are claimed with a leased marker item before they are streamed.
+  The claim records how many lines of the file are done (written together with
+  their rollups and other derived state), so a retry after a failure resumes
+  after them instead of deriving their state a second time.
+"""
+import hashlib
+import os
+import time
+import urllib.parse
+
+from ecomonitor.capacity import scheduled
+
+IDEMPOTENCY_WINDOW_SECONDS = int(os.environ.get('IDEMPOTENCY_WINDOW_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '900'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '4096'))
+
+CLAIM_PREFIX = '#ingest#'
+CLAIM_SORT_KEY = 'claim'
+IN_PROGRESS = 'in_progress'
+DONE = 'done'
+
+def source_identity(record):
+    """'bucket/key@version' of an S3 event record; the version falls back to the ETag, then the sequencer"""
+    s3 = record['s3']
+    obj = s3['object']
+    key = urllib.parse.unquote_plus(obj['key'])
+    version = obj.get('versionId') or obj.get('eTag') or obj.get('sequencer') or ''
+    return f"{s3['bucket']['name']}/{key}@{version}"
+
+def stable_reading_key(identity, payload):
+    """Deterministic sort key for a reading from its source identity and raw payload"""
+    digest = hashlib.sha256(identity.encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(payload if isinstance(payload, bytes) else str(payload).encode('utf-8'))
+    return digest.hexdigest()[:32]
+
+def put_if_absent(table, item, scheduler=None):
+    """PutItem unless an item with the same key exists. Returns False for a duplicate."""
+    try:
+        scheduled(scheduler, table.put_item, item, Item=item, ConditionExpression='attribute_not_exists(device_id)')
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def _claim_key(identity):
+    return {'device_id': f"{CLAIM_PREFIX}{identity}", 'timestamp': CLAIM_SORT_KEY}
+
+def claim(table, identity, lease_seconds=IDEMPOTENCY_LEASE_SECONDS, now=None):
+    """
+    Claim a source object for processing. Succeeds when it was never claimed or
+    a previous claim's lease expired without completing (a crashed or failed
+    invocation). Returns the progress the previous owners checkpointed (0 for a
+    fresh claim), or None when the caller does not own the claim.
+    """
+    now = int(now if now is not None else time.time())
+    try:
+        response = table.update_item(
+            Key=_claim_key(identity),
+            UpdateExpression='SET claim_status = :in_progress, lease_until = :lease, expiry_time = :expiry',
+            ConditionExpression='attribute_not_exists(device_id) OR (claim_status = :in_progress AND lease_until < :now)',
+            ExpressionAttributeValues={
+                ':in_progress': IN_PROGRESS,
+                ':lease': now + lease_seconds,
+                ':expiry': now + IDEMPOTENCY_WINDOW_SECONDS,
+                ':now': now,
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return None
+    return int(response.get('Attributes', {}).get('progress', 0))
+
+def checkpoint(table, identity, progress, lease_seconds=IDEMPOTENCY_LEASE_SECONDS, now=None):
+    """Record the progress of a claimed source (e.g. lines done) and extend its lease"""
+    now = int(now if now is not None else time.time())
+    table.update_item(
+        Key=_claim_key(identity),
+        UpdateExpression='SET progress = :progress, lease_until = :lease',
+        ExpressionAttributeValues={':progress': progress, ':lease': now + lease_seconds}
+    )
+
+def complete(table, identity, now=None):
+    """Mark a claimed source as processed; the marker expires with the idempotency window"""
+    now = int(now if now is not None else time.time())
+    table.update_item(
+        Key=_claim_key(identity),
+        UpdateExpression='SET claim_status = :done, expiry_time = :expiry REMOVE lease_until',
+        ExpressionAttributeValues={':done': DONE, ':expiry': now + IDEMPOTENCY_WINDOW_SECONDS}
+    )
+
+def release(table, identity):
+    """Give a claim up after a failure: its lease ends now, so a retry can claim it and resume from its progress"""
+    table.update_item(
+        Key=_claim_key(identity),
+        UpdateExpression='SET lease_until = :expired',
+        ExpressionAttributeValues={':expired': 0}
+    )
@@ -0,0 +1,73 @@
+"""
+Opt-in cold-start profiler.
+
+With INIT_PROFILE=true, a handler module calls start() before its imports and
+finish() after them. In between, every first-time import made directly by the
+module is timed (including the modules it pulls in), and report() adds the
+result to a MetricsBuffer once per container:
+
+    InitDuration{Function}                  total import phase of the handler module
+    ModuleImportTime{Function, Module}      cumulative time of each direct import
+
+Client construction is lazy (see ecomonitor.runtime) and is reported separately
+as ClientInitTime by runtime.record_client_metrics(). When the variable is not
+set every function here is a no-op.
+"""
+import builtins
+import os
+import sys
+import time
+
+ENABLED = os.environ.get('INIT_PROFILE', 'false').lower() == 'true'
+
+_original_import = None
+_depth = 0
+_started = None
+_init_ms = None
+_imports = {}
+_reported = False
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    global _depth
+    top_level = _depth == 0 and level == 0 and name not in sys.modules
+    _depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        _depth -= 1
+        if top_level:
+            _imports[name] = _imports.get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def start():
+    """Begin timing the calling module's imports"""
+    global _original_import, _started
+    if not ENABLED or _original_import is not None:
+        return
+    _started = time.perf_counter()
+    _original_import = builtins.__import__
+    builtins.__import__ = _timed_import
+
+def finish():
+    """Stop timing and fix the init duration"""
+    global _original_import, _init_ms
+    if _original_import is None:
+        return
+    builtins.__import__ = _original_import
+    _original_import = None
+    _init_ms = (time.perf_counter() - _started) * 1000
+
+def import_times():
+    """{module: milliseconds} of the profiled imports, slowest first"""
+    return dict(sorted(_imports.items(), key=lambda entry: entry[1], reverse=True))
+
+def report(metrics, top=10):
+    """Add the init profile to `metrics` the first time it is called in a container"""
+    global _reported
+    if _init_ms is None or _reported:
+        return
+    _reported = True
+    function = [{'Name': 'Function', 'Value': os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')}]
+    metrics.put('InitDuration', _init_ms, 'Milliseconds', function)
+    for module, elapsed_ms in list(import_times().items())[:top]:
+        metrics.put('ModuleImportTime', elapsed_ms, 'Milliseconds', function + [{'Name': 'Module', 'Value': module}])
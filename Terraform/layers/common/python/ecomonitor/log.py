@@ -0,0 +1,140 @@
+"""
+Level-gated, sampled structured logging.
+
+Every line is one JSON object: {"level", "event", "message", ...fields}. The hot
+path pays nothing for lines that are not emitted:
+
+- the level is checked before anything is formatted, and the JSON is only
+  built when a handler actually writes the record;
+- field values may be zero-argument callables, evaluated only for emitted lines;
+- per-event sampling rates come from LOG_SAMPLE_RATES, e.g.
+  "s3.read=0.01,iot.publish=0.05" (prefix matches: "s3=0.01" covers "s3.read");
+  sampled lines carry their `sample_rate` so counts can be re-weighted;
+- payload() serializes full documents only with LOG_DEBUG_PAYLOADS=true;
+- failure() is never gated or sampled and dumps the complete failed record, so
+  forensics do not depend on what the hot path logged.
+
+LOG_LEVEL sets the level of the root logger (default INFO).
+"""
+import json
+import logging
+import os
+import random
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_DEBUG_PAYLOADS = os.environ.get('LOG_DEBUG_PAYLOADS', 'false').lower() == 'true'
+# Longest string field written by the non-failure paths
+LOG_MAX_FIELD_CHARS = int(os.environ.get('LOG_MAX_FIELD_CHARS', '512'))
+
+def parse_sample_rates(spec):
+    """'event=rate,...' → {event: rate}"""
+    rates = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            name, rate = part.split('=', 1)
+            rates[name.strip()] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+SAMPLE_RATES = parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+
+def sample_rate(event, rates=None):
+    """Rate of the longest configured prefix of `event` (1.0 when none is configured)"""
+    rates = SAMPLE_RATES if rates is None else rates
+    name = event
+    while True:
+        if name in rates:
+            return rates[name]
+        if '.' not in name:
+            return 1.0
+        name = name.rsplit('.', 1)[0]
+
+def _truncate(value, limit):
+    if isinstance(value, str) and limit and len(value) > limit:
+        return f"{value[:limit]}…(+{len(value) - limit} chars)"
+    return value
+
+class _Line:
+    """Log message whose JSON is built only when a handler formats it"""
+    __slots__ = ('fields', 'limit')
+
+    def __init__(self, fields, limit):
+        self.fields = fields
+        self.limit = limit
+
+    def __str__(self):
+        rendered = {}
+        for name, value in self.fields.items():
+            if callable(value):
+                value = value()
+            rendered[name] = _truncate(value, self.limit)
+        return json.dumps(rendered, default=str, ensure_ascii=False)
+
+class StructuredLogger:
+    """JSON-line logger with per-invocation context, sampling and lazy fields"""
+
+    def __init__(self, logger=None, rates=None, rng=random.random):
+        self.logger = logger or logging.getLogger()
+        self.rates = rates
+        self.context = {}
+        self._rng = rng
+
+    def bind(self, **context):
+        """Fields added to every line until the next bind() (e.g. the request id)"""
+        self.context = {name: value for name, value in context.items() if value is not None}
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, event, message='', **fields):
+        if not self.logger.isEnabledFor(level):
+            return False
+        line = {'level': logging.getLevelName(level), 'event': event}
+        if level < logging.WARNING:
+            rate = sample_rate(event, self.rates)
+            if rate < 1.0:
+                if self._rng() >= rate:
+                    return False
+                line['sample_rate'] = rate
+        if message:
+            line['message'] = message
+        line.update(self.context)
+        line.update(fields)
+        self.logger.log(level, _Line(line, LOG_MAX_FIELD_CHARS))
+        return True
+
+    def debug(self, event, message='', **fields):
+        return self.log(logging.DEBUG, event, message, **fields)
+
+    def info(self, event, message='', **fields):
+        return self.log(logging.INFO, event, message, **fields)
+
+    def warning(self, event, message='', **fields):
+        return self.log(logging.WARNING, event, message, **fields)
+
+    def error(self, event, message='', **fields):
+        return self.log(logging.ERROR, event, message, **fields)
+
+    def payload(self, event, message, payload, **fields):
+        """Debug line with a full document, serialized only when LOG_DEBUG_PAYLOADS is on"""
+        if not LOG_DEBUG_PAYLOADS:
+            return False
+        return self.log(logging.DEBUG if self.enabled(logging.DEBUG) else logging.INFO, event, message, payload=payload, **fields)
+
+    def failure(self, event, message, record=None, error=None, **fields):
+        """Error line with the complete failed record; never sampled or truncated"""
+        line = {'level': 'ERROR', 'event': event, 'message': message}
+        line.update(self.context)
+        line.update(fields)
+        if error is not None:
+            line['error'] = str(error)
+            line['error_type'] = type(error).__name__
+        if record is not None:
+            line['record'] = record
+        self.logger.error(_Line(line, None))
+        return True
+
+def configure(level=LOG_LEVEL):
+    """Set the root logger level; returns a StructuredLogger over it"""
+    root = logging.getLogger()
+    root.setLevel(level)
+    return StructuredLogger(root)
@@ -0,0 +1,173 @@
+"""
+Buffered CloudWatch metrics.
+
+Metrics are collected in memory during an invocation and sent when the buffer
+is flushed. Datums with the same namespace, name, unit and dimensions are merged
+into a single StatisticSet, and PutMetricData is called with up to 1000 datums
+at a time. With METRICS_MODE=emf the buffer writes Embedded Metric Format log
+lines instead and makes no API calls at all.
+"""
+import datetime
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from ecomonitor.runtime import get_client
+
+logger = logging.getLogger()
+
+MAX_DATUMS_PER_CALL = 1000  # PutMetricData limit
+MAX_EMF_METRICS = 100  # metrics per EMF directive
+MAX_EMF_VALUES = 100  # values per metric in one EMF document
+
+MODE_API = 'api'
+MODE_EMF = 'emf'
+
+class _Aggregate:
+    """Running statistics for one metric series"""
+    __slots__ = ('count', 'sum', 'min', 'max', 'values', 'timestamp')
+
+    def __init__(self, value, keep_values):
+        self.count = 1
+        self.sum = value
+        self.min = value
+        self.max = value
+        self.values = [value] if keep_values else None
+        self.timestamp = datetime.datetime.utcnow()
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if self.values is not None:
+            self.values.append(value)
+
+class MetricsBuffer:
+    """Collects metrics during an invocation and publishes them in batches"""
+
+    def __init__(self, namespace, default_dimensions=None, mode=None, client=None):
+        self.namespace = namespace
+        self.default_dimensions = default_dimensions or []
+        self.mode = (mode or os.environ.get('METRICS_MODE', MODE_API)).lower()
+        self._client = client
+        self._series = {}
+        self._lock = threading.Lock()
+        self.last_flush_ms = None  # duration of the previous non-empty flush
+
+    def __len__(self):
+        return len(self._series)
+
+    def put(self, metric_name, value, unit='None', dimensions=None, namespace=None):
+        """Record one value; nothing is sent until flush()"""
+        dims = self.default_dimensions if dimensions is None else dimensions
+        key = (
+            namespace or self.namespace,
+            metric_name,
+            unit,
+            tuple((d['Name'], str(d['Value'])) for d in dims)
+        )
+        value = float(value)
+        with self._lock:
+            aggregate = self._series.get(key)
+            if aggregate is None:
+                self._series[key] = _Aggregate(value, self.mode == MODE_EMF)
+            else:
+                aggregate.add(value)
+
+    def flush(self):
+        """Publish everything buffered so far and reset the buffer"""
+        with self._lock:
+            series, self._series = self._series, {}
+        if not series:
+            return 0
+        started = time.perf_counter()
+        try:
+            if self.mode == MODE_EMF:
+                return self._flush_emf(series)
+            return self._flush_api(series)
+        finally:
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+
+    def flush_after(self, handler):
+        """Decorator that flushes the buffer when the wrapped handler returns or raises"""
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            try:
+                return handler(*args, **kwargs)
+            finally:
+                self.flush()
+        return wrapper
+
+    def _flush_api(self, series):
+        by_namespace = {}
+        for (namespace, name, unit, dims), aggregate in series.items():
+            datum = {
+                'MetricName': name,
+                'Unit': unit,
+                'Timestamp': aggregate.timestamp,
+                'Dimensions': [{'Name': n, 'Value': v} for n, v in dims]
+            }
+            if aggregate.count == 1:
+                datum['Value'] = aggregate.sum
+            else:
+                datum['StatisticValues'] = {
+                    'SampleCount': aggregate.count,
+                    'Sum': aggregate.sum,
+                    'Minimum': aggregate.min,
+                    'Maximum': aggregate.max
+                }
+            by_namespace.setdefault(namespace, []).append(datum)
+
+        client = self._client or get_client('cloudwatch')
+        calls = 0
+        for namespace, datums in by_namespace.items():
+            for start in range(0, len(datums), MAX_DATUMS_PER_CALL):
+                batch = datums[start:start + MAX_DATUMS_PER_CALL]
+                try:
+                    client.put_metric_data(Namespace=namespace, MetricData=batch)
+                    calls += 1
+                except Exception as e:
+                    logger.error(f"Failed to put {len(batch)} metrics to {namespace}: {str(e)}")
+        return calls
+
+    def _flush_emf(self, series):
+        # One document per namespace and dimension set, split to respect EMF limits
+        groups = {}
+        for (namespace, name, unit, dims), aggregate in series.items():
+            groups.setdefault((namespace, dims), []).append((name, unit, aggregate))
+
+        lines = 0
+        for (namespace, dims), metrics in groups.items():
+            for start in range(0, len(metrics), MAX_EMF_METRICS):
+                chunk = metrics[start:start + MAX_EMF_METRICS]
+                depth = max(len(aggregate.values) for _, _, aggregate in chunk)
+                for offset in range(0, depth, MAX_EMF_VALUES):
+                    document = {
+                        '_aws': {
+                            'Timestamp': int(time.time() * 1000),
+                            'CloudWatchMetrics': [{
+                                'Namespace': namespace,
+                                'Dimensions': [[n for n, _ in dims]],
+                                'Metrics': []
+                            }]
+                        }
+                    }
+                    document.update(dims)
+                    directive = document['_aws']['CloudWatchMetrics'][0]
+                    for name, unit, aggregate in chunk:
+                        values = aggregate.values[offset:offset + MAX_EMF_VALUES]
+                        if not values:
+                            continue
+                        directive['Metrics'].append({'Name': name, 'Unit': unit})
+                        document[name] = values[0] if len(values) == 1 else values
+                    sys.stdout.write(json.dumps(document) + '\n')
+                    lines += 1
+        sys.stdout.flush()
+        return lines
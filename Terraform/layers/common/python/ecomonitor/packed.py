@@ -0,0 +1,323 @@
+"""
+Hourly packed reading items.
+
+Instead of one DynamoDB item per reading, the packed layout keeps one item per
+device per hour:
+
+    device_id = '<device_id>#packed'   timestamp = 'YYYY-MM-DDTHH'
+    chunks    = [binary, ...]          one chunk per appending batch
+    sensor_type, metric, unit, location, expiry_time, reading_count, chunk_count
+
+A chunk holds the readings of one batch as two delta-encoded columns:
+
+    b'P' | version (1 byte) | count (varint) | scale (1 byte)
+         | epoch-millis timestamps: first absolute, then zigzag varint deltas
+         | values: zigzag varint deltas of value * 10**scale,
+                   or float64 LE when scale == FLOAT_SCALE
+
+so a reading every minute costs about 4-5 bytes instead of a ~300 byte item.
+Batches are appended with list_append (no read, no lost update under
+concurrent writers); decoding concatenates the chunks, orders them by time and
+keeps the last value per timestamp, so a redelivered batch changes nothing.
+Once an item has PACKED_MAX_CHUNKS chunks the writer folds them into one with a
+conditional rewrite (which also makes reading_count exact again: until then it
+counts appended readings, redeliveries included). Categories are not stored: they are derived again from the
+classification bands when readings are decoded.
+
+A range scan of one device reads one item per hour of data.
+"""
+import array
+import datetime
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from ecomonitor import classification
+from ecomonitor.capacity import WritesDeferred, scheduled
+from ecomonitor.queries import epoch_ms, paginate
+from ecomonitor.rollups import is_rollup_item, reading_datetime, reading_value
+from ecomonitor.varint import FLOAT_SCALE, read_varint, scale_of, scaled, unzigzag, write_varint, zigzag
+
+logger = logging.getLogger()
+
+PACKED_SUFFIX = '#packed'
+HOUR_FORMAT = '%Y-%m-%dT%H'
+MAGIC = b'P'
+VERSION = 1
+PACKED_MAX_CHUNKS = int(os.environ.get('PACKED_MAX_CHUNKS', '24'))
+PACKED_WRITE_CONCURRENCY = int(os.environ.get('PACKED_WRITE_CONCURRENCY', '8'))
+# Per-device attributes kept on the packed item (latest value wins, so the
+# item's expiry_time is that of its newest batch)
+STATIC_FIELDS = ('unit', 'location', 'expiry_time')
+
+def packed_partition(device_id):
+    return f"{device_id}{PACKED_SUFFIX}"
+
+def is_packed_item(item):
+    return str(item.get('device_id', '')).endswith(PACKED_SUFFIX)
+
+# ---------------------------------------------------------------------------
+# Chunk codec
+# ---------------------------------------------------------------------------
+
+def encode_chunk(timestamps, values):
+    """Pack parallel sequences of epoch-millis timestamps and numeric values"""
+    if len(timestamps) != len(values):
+        raise ValueError("timestamps and values must have the same length")
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    write_varint(out, len(timestamps))
+    scale = scale_of(values)
+    out.append(scale)
+
+    previous = 0
+    for position, timestamp in enumerate(timestamps):
+        timestamp = int(timestamp)
+        write_varint(out, timestamp if position == 0 else zigzag(timestamp - previous))
+        previous = timestamp
+
+    if scale == FLOAT_SCALE:
+        data = array.array('d', (float(value) for value in values))
+        if sys.byteorder != 'little':
+            data.byteswap()
+        out.extend(data.tobytes())
+    else:
+        previous = 0
+        for value in values:
+            current = scaled(value, scale)
+            write_varint(out, zigzag(current - previous))
+            previous = current
+    return bytes(out)
+
+def decode_chunk(data):
+    """(array('q') timestamps, array('d') values) of one chunk"""
+    data = bytes(getattr(data, 'value', data))
+    if data[:1] != MAGIC:
+        raise ValueError("Not a packed reading chunk")
+    if data[1] != VERSION:
+        raise ValueError(f"Unsupported packed chunk version: {data[1]}")
+    count, offset = read_varint(data, 2)
+    scale = data[offset]
+    offset += 1
+
+    timestamps = array.array('q')
+    previous = 0
+    for position in range(count):
+        raw, offset = read_varint(data, offset)
+        previous = raw if position == 0 else previous + unzigzag(raw)
+        timestamps.append(previous)
+
+    values = array.array('d')
+    if scale == FLOAT_SCALE:
+        values.frombytes(data[offset:offset + count * 8])
+        if sys.byteorder != 'little':
+            values.byteswap()
+    else:
+        factor = 10 ** scale
+        previous = 0
+        for _ in range(count):
+            raw, offset = read_varint(data, offset)
+            previous += unzigzag(raw)
+            values.append(previous / factor)
+    return timestamps, values
+
+def decode_item(item):
+    """Time-ordered (timestamps, values) arrays of a packed item; the last value per timestamp wins"""
+    merged = {}
+    for chunk in item.get('chunks') or []:
+        timestamps, values = decode_chunk(chunk)
+        merged.update(zip(timestamps, values))
+    ordered = sorted(merged)
+    return array.array('q', ordered), array.array('d', (merged[timestamp] for timestamp in ordered))
+
+def item_readings(item):
+    """Reading dicts of a packed item, with the category fields derived from the bands"""
+    timestamps, values = decode_item(item)
+    device_id = str(item['device_id'])[:-len(PACKED_SUFFIX)]
+    sensor_type = str(item.get('sensor_type', ''))
+    metric = str(item.get('metric', 'value'))
+    static = {name: item[name] for name in STATIC_FIELDS if name in item}
+    labels = {}
+    if sensor_type in classification.BAND_TABLES:
+        labels = classification.get_bands(sensor_type).classify_array(values)
+    readings = []
+    for position, (timestamp, value) in enumerate(zip(timestamps, values)):
+        reading = {'device_id': device_id, 'sensor_type': sensor_type, 'observed_at': timestamp, metric: value}
+        reading.update(static)
+        for name, column in labels.items():
+            if column[position] is not None:
+                reading[name] = column[position]
+        readings.append(reading)
+    return readings
+
+# ---------------------------------------------------------------------------
+# Write side
+# ---------------------------------------------------------------------------
+
+class HourBatch:
+    """Readings of one device and hour collected from a batch of items"""
+    __slots__ = ('device_id', 'hour', 'sensor_type', 'metric', 'static', 'readings', 'items')
+
+    def __init__(self, device_id, hour, sensor_type, metric):
+        self.device_id = device_id
+        self.hour = hour
+        self.sensor_type = sensor_type
+        self.metric = metric
+        self.static = {}
+        self.readings = {}
+        self.items = []
+
+    @property
+    def key(self):
+        return {'device_id': packed_partition(self.device_id), 'timestamp': self.hour}
+
+def group_readings(items, now=None):
+    """
+    Group reading items into HourBatches. Returns (batches, skipped) where
+    skipped are items without a numeric value for their sensor profile.
+    """
+    now = now or datetime.datetime.utcnow()
+    batches, skipped = {}, []
+    for item in items:
+        if is_rollup_item(item) or str(item.get('device_id', '')).startswith('#'):
+            continue
+        measured = reading_value(item)
+        if measured is None:
+            skipped.append(item)
+            continue
+        metric, value = measured
+        moment = reading_datetime(item, now)
+        device_id = str(item['device_id'])
+        hour = moment.strftime(HOUR_FORMAT)
+        batch = batches.get((device_id, hour))
+        if batch is None:
+            batch = batches[(device_id, hour)] = HourBatch(device_id, hour, str(item['sensor_type']), metric)
+        batch.readings[epoch_ms(moment)] = value
+        batch.items.append(item)
+        batch.static.update({name: item[name] for name in STATIC_FIELDS if item.get(name) is not None})
+    return list(batches.values()), skipped
+
+def append_batch(table, batch, scheduler=None):
+    """Append one HourBatch as a new chunk. Returns the item's chunk count."""
+    ordered = sorted(batch.readings)
+    chunk = encode_chunk(ordered, [batch.readings[timestamp] for timestamp in ordered])
+    names = {'#chunks': 'chunks', '#metric': 'metric'}
+    values = {
+        ':chunk': [chunk],
+        ':empty': [],
+        ':readings': len(ordered),
+        ':one': 1,
+        ':sensor_type': batch.sensor_type,
+        ':metric': batch.metric,
+    }
+    assignments = ['#chunks = list_append(if_not_exists(#chunks, :empty), :chunk)', 'sensor_type = :sensor_type', '#metric = :metric']
+    for position, (name, value) in enumerate(sorted(batch.static.items())):
+        names[f'#s{position}'] = name
+        values[f':s{position}'] = value
+        assignments.append(f'#s{position} = :s{position}')
+    response = scheduled(
+        scheduler, table.update_item, batch.key,
+        Key=batch.key,
+        UpdateExpression=f"SET {', '.join(assignments)} ADD reading_count :readings, chunk_count :one",
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+        ReturnValues='UPDATED_NEW'
+    )
+    return int(response.get('Attributes', {}).get('chunk_count', 1))
+
+def compact(table, key, scheduler=None):
+    """
+    Fold the chunks of a packed item into one. The rewrite is conditional on the
+    chunk count it read, so a concurrent append is never lost (the compaction is
+    simply skipped and retried by a later append). Returns True when rewritten.
+    """
+    item = table.get_item(Key=key, ConsistentRead=True).get('Item')
+    if not item or len(item.get('chunks') or []) <= 1:
+        return False
+    timestamps, values = decode_item(item)
+    chunk_count = item['chunk_count']
+    item = dict(item, chunks=[encode_chunk(timestamps, values)], chunk_count=1, reading_count=len(timestamps))
+    try:
+        scheduled(
+            scheduler, table.put_item, item,
+            Item=item,
+            ConditionExpression='chunk_count = :chunk_count',
+            ExpressionAttributeValues={':chunk_count': chunk_count}
+        )
+        return True
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+
+def append_readings(table, items, scheduler=None, concurrency=PACKED_WRITE_CONCURRENCY, max_chunks=PACKED_MAX_CHUNKS):
+    """
+    Append reading items to their hourly packed items, one UpdateItem per
+    device-hour. Returns (failed_items, deferred_items, stats); an item fails or
+    is deferred together with the rest of its device-hour.
+    """
+    batches, skipped = group_readings(items)
+    stats = {'hours': len(batches), 'readings': sum(len(batch.readings) for batch in batches), 'compacted': 0, 'bytes': 0}
+    if not batches:
+        return skipped, [], stats
+
+    def write(batch):
+        try:
+            chunk_count = append_batch(table, batch, scheduler)
+            if chunk_count >= max_chunks and compact(table, batch.key, scheduler):
+                return 'compacted', None
+            return 'written', None
+        except WritesDeferred as e:
+            return 'deferred', e
+        except Exception as e:
+            logger.error(f"Failed to append packed readings of {batch.device_id} {batch.hour}: {str(e)}")
+            return 'failed', e
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(batches)))) as executor:
+        outcomes = list(executor.map(write, batches))
+
+    failed, deferred = list(skipped), []
+    for batch, (outcome, _) in zip(batches, outcomes):
+        if outcome == 'failed':
+            failed.extend(batch.items)
+        elif outcome == 'deferred':
+            deferred.extend(batch.items)
+        elif outcome == 'compacted':
+            stats['compacted'] += 1
+    return failed, deferred, stats
+
+# ---------------------------------------------------------------------------
+# Read side
+# ---------------------------------------------------------------------------
+
+def iter_packed_items(table, device_id, start, end):
+    """Packed items of a device whose hour overlaps [start, end] (datetimes, UTC)"""
+    return paginate(
+        table.query,
+        KeyConditionExpression='device_id = :pk AND #ts BETWEEN :start AND :end',
+        ExpressionAttributeNames={'#ts': 'timestamp'},
+        ExpressionAttributeValues={
+            ':pk': packed_partition(device_id),
+            ':start': start.strftime(HOUR_FORMAT),
+            ':end': end.strftime(HOUR_FORMAT),
+        }
+    )
+
+def device_series(table, device_id, start, end):
+    """(array('q') epoch-millis timestamps, array('d') values) of a device in [start, end]"""
+    low, high = epoch_ms(start), epoch_ms(end)
+    timestamps, values = array.array('q'), array.array('d')
+    for item in iter_packed_items(table, device_id, start, end):
+        hour_timestamps, hour_values = decode_item(item)
+        for timestamp, value in zip(hour_timestamps, hour_values):
+            if low <= timestamp <= high:
+                timestamps.append(timestamp)
+                values.append(value)
+    return timestamps, values
+
+def iter_device_readings(table, device_id, start, end):
+    """Reading dicts of a device in [start, end], categories included, oldest first"""
+    low, high = epoch_ms(start), epoch_ms(end)
+    for item in iter_packed_items(table, device_id, start, end):
+        for reading in item_readings(item):
+            if low <= reading['observed_at'] <= high:
+                yield reading
@@ -0,0 +1,103 @@
+"""
+Sensor profiles.
+
+A profile captures everything that differs between the sensor simulators: the
+payload field that carries the reading, its unit, the IoT topic and the default
+value distribution. Categories come from the sensor type's band table in
+ecomonitor.classification. The single-device simulators and the fleet simulator
+both build their payloads from these profiles, so a new sensor type only needs a
+new profile (and its bands).
+"""
+import random
+
+from ecomonitor import classification
+
+def sample_value(distribution, rng=random):
+    """Draw one reading from a distribution spec such as {'type': 'uniform', 'low': 10, 'high': 150}"""
+    kind = distribution.get('type', 'uniform')
+    if kind == 'uniform':
+        value = rng.uniform(distribution['low'], distribution['high'])
+    elif kind == 'normal':
+        value = rng.gauss(distribution['mean'], distribution['stddev'])
+    elif kind == 'constant':
+        value = distribution['value']
+    else:
+        raise ValueError(f"Unknown distribution type: {kind}")
+
+    # Optional clamping keeps normal draws inside a physically sensible range
+    if 'min' in distribution:
+        value = max(distribution['min'], value)
+    if 'max' in distribution:
+        value = min(distribution['max'], value)
+    return round(value, distribution.get('precision', 1))
+
+class SensorProfile:
+    """Payload layout, topic, value distribution and category logic of one sensor type"""
+
+    def __init__(self, sensor_type, value_field, topic, metric_name, distribution,
+                 unit=None, metric_unit='None', metric_dimension=None):
+        self.sensor_type = sensor_type
+        self.value_field = value_field
+        self.topic = topic
+        self.metric_name = metric_name
+        self.distribution = distribution
+        self.unit = unit
+        self.metric_unit = metric_unit
+        # Value of the SensorType metric dimension used by the dashboards
+        self.metric_dimension = metric_dimension or sensor_type.upper()
+
+    def classify(self, value):
+        return classification.get_bands(self.sensor_type).classify(value)
+
+    def categorize(self, item, overwrite=False):
+        """Add the category fields to a stored reading item (see classification.classify_item)"""
+        return classification.classify_item(item, self.value_field, self.sensor_type, overwrite)
+
+    def sample(self, distribution=None, rng=random):
+        return sample_value(distribution or self.distribution, rng)
+
+    def build_payload(self, device_id, value, timestamp, reading_time, location=None):
+        """Device payload in the same layout the single-device simulators publish"""
+        payload = {'device_id': device_id, self.value_field: value}
+        if self.unit:
+            payload['unit'] = self.unit
+        payload.update(self.classify(value))
+        payload['timestamp'] = timestamp
+        payload['reading_time'] = reading_time
+        if location:
+            payload['location'] = location
+        return payload
+
+PROFILES = {}
+
+def register_profile(profile):
+    """Add or replace the profile for a sensor type"""
+    PROFILES[profile.sensor_type] = profile
+    return profile
+
+def get_profile(sensor_type):
+    try:
+        return PROFILES[sensor_type]
+    except KeyError:
+        raise ValueError(f"No sensor profile registered for type: {sensor_type}")
+
+register_profile(SensorProfile(
+    'aqi', 'aqi', 'eco/sensors/aqi', 'AQIReading',
+    {'type': 'uniform', 'low': 10.0, 'high': 150.0},
+    metric_dimension='AQI'
+))
+register_profile(SensorProfile(
+    'co2', 'co2', 'eco/sensors/co2', 'CO2Reading',
+    {'type': 'uniform', 'low': 300.0, 'high': 1500.0},
+    unit='ppm', metric_dimension='CO2'
+))
+register_profile(SensorProfile(
+    'humidity', 'humidity', 'eco/sensors/humidity', 'HumidityReading',
+    {'type': 'uniform', 'low': 30.0, 'high': 90.0},
+    unit='percentage', metric_unit='Percent', metric_dimension='Humidity'
+))
+register_profile(SensorProfile(
+    'temperature', 'temperature', 'eco/sensors/temperature', 'TemperatureReading',
+    {'type': 'uniform', 'low': 18.0, 'high': 35.0},
+    unit='Celsius', metric_dimension='Temperature'
+))
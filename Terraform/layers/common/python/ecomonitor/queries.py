@@ -0,0 +1,290 @@
+"""
+Read access to ecomonitor_processed_data.
+
+Three access patterns are served without scanning:
+
+- latest reading per device: the processor keeps one item per device in the
+  `#latest#<shard>` partitions (shard = CRC32 of the device id modulo
+  LATEST_SHARDS, sort key = device_id), written with a newer-only condition,
+  so the whole fleet's current state is one parallel Query per shard;
+- a device's readings in a time range: key-condition Query on device_id/timestamp,
+  whose values are time-ordered sort keys (see ecomonitor.sortkeys);
+- every reading of a date: one Query per DateIndex shard, run in parallel and
+  merged in timestamp order (see ecomonitor.sharding).
+
+Range queries are exposed as generators that page through results lazily, and
+list-returning helpers go through an in-process LRU+TTL cache that survives
+across warm invocations.
+"""
+import datetime
+import heapq
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from ecomonitor.cache import LRUCache
+from ecomonitor.capacity import WritesDeferred, scheduled
+from ecomonitor.rollups import is_rollup_item, reading_datetime
+from ecomonitor.sharding import DATE_INDEX_LEGACY_READS, DATE_INDEX_SHARDS, SHARD_SEPARATOR, date_keys, shard_for
+from ecomonitor.sortkeys import lower_bound, upper_bound
+
+logger = logging.getLogger()
+
+LATEST_PARTITION = '#latest'
+# One hot partition key would take every ingest's latest write; the shard count may only grow
+LATEST_SHARDS = int(os.environ.get('LATEST_SHARDS', '8'))
+DATE_INDEX = 'DateIndex'
+QUERY_PAGE_SIZE = int(os.environ.get('QUERY_PAGE_SIZE', '500'))
+SHARD_QUERY_CONCURRENCY = int(os.environ.get('SHARD_QUERY_CONCURRENCY', '8'))
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', '1024'))
+QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', '30'))
+LATEST_WRITE_CONCURRENCY = int(os.environ.get('LATEST_WRITE_CONCURRENCY', '8'))
+
+def latest_partition(device_id, shards=LATEST_SHARDS):
+    """Partition key of a device's latest item: '#latest#<shard>'"""
+    return f"{LATEST_PARTITION}{SHARD_SEPARATOR}{shard_for(device_id, shards)}"
+
+def latest_partitions(shards=LATEST_SHARDS):
+    """Every partition key a fleet reader must query"""
+    return [f"{LATEST_PARTITION}{SHARD_SEPARATOR}{shard}" for shard in range(shards)]
+
+def is_latest_partition(value):
+    return str(value).startswith(LATEST_PARTITION + SHARD_SEPARATOR)
+
+def epoch_ms(moment):
+    return int(moment.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+def timestamp_bound(value, upper=False):
+    """
+    Sort-key bound for a time range: datetimes become sort-key prefixes that
+    include every key of their millisecond (see ecomonitor.sortkeys), strings pass through
+    """
+    if isinstance(value, datetime.datetime):
+        return upper_bound(epoch_ms(value)) if upper else lower_bound(epoch_ms(value))
+    return str(value)
+
+def paginate(query, **kwargs):
+    """Yield items from a boto3 Table.query (or compatible callable) page by page"""
+    while True:
+        response = query(**kwargs)
+        yield from response.get('Items', [])
+        if 'LastEvaluatedKey' not in response:
+            return
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def prefetching_paginate(executor, query, **kwargs):
+    """
+    Like paginate(), but the first page is requested immediately and each next
+    page is requested on `executor` while the current one is being consumed.
+    """
+    pending = executor.submit(query, **kwargs)
+
+    def items(pending=pending, kwargs=kwargs):
+        while pending is not None:
+            response = pending.result()
+            pending = None
+            if 'LastEvaluatedKey' in response:
+                kwargs = dict(kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
+                pending = executor.submit(query, **kwargs)
+            yield from response.get('Items', [])
+    return items()
+
+def latest_items(query, partitions=None, page_size=QUERY_PAGE_SIZE):
+    """
+    Latest items of every device, querying the partitions in parallel. A device
+    found in several partitions (after LATEST_SHARDS grew) keeps the newest.
+    """
+    partitions = latest_partitions() if partitions is None else partitions
+
+    def read(partition):
+        return list(paginate(query, KeyConditionExpression='device_id = :pk',
+                             ExpressionAttributeValues={':pk': partition}, Limit=page_size))
+
+    newest = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(SHARD_QUERY_CONCURRENCY, len(partitions)))) as executor:
+        for items in executor.map(read, partitions):
+            for item in items:
+                current = newest.get(item['timestamp'])
+                if current is None or int(item.get('observed_at', 0)) > int(current.get('observed_at', 0)):
+                    newest[item['timestamp']] = item
+    return list(newest.values())
+
+def merge_by_timestamp(streams):
+    """Merge per-shard streams (each sorted by timestamp) into one timestamp-ordered stream"""
+    return heapq.merge(*streams, key=lambda item: (str(item.get('timestamp', '')), str(item.get('device_id', ''))))
+
+# ---------------------------------------------------------------------------
+# Write side: latest reading per device
+# ---------------------------------------------------------------------------
+
+def latest_candidates(items, now=None):
+    """The newest reading of each device in a batch, as items of its `#latest#<shard>` partition"""
+    now = now or datetime.datetime.utcnow()
+    newest = {}
+    for item in items:
+        if is_rollup_item(item) or is_latest_partition(item.get('device_id', '')):
+            continue
+        observed_at = epoch_ms(reading_datetime(item, now))
+        device_id = str(item['device_id'])
+        current = newest.get(device_id)
+        if current is None or observed_at >= current[0]:
+            newest[device_id] = (observed_at, item)
+
+    candidates = []
+    for device_id, (observed_at, item) in newest.items():
+        latest = dict(item)
+        latest['device_id'] = latest_partition(device_id)
+        latest['timestamp'] = device_id
+        latest['reading_timestamp'] = item['timestamp']
+        latest['observed_at'] = observed_at
+        # Latest items stay out of the DateIndex and never expire
+        latest.pop('reading_date', None)
+        latest.pop('expiry_time', None)
+        candidates.append(latest)
+    return candidates
+
+def update_latest(table, items, concurrency=LATEST_WRITE_CONCURRENCY, scheduler=None):
+    """
+    Keep each device's latest item pointing at its newest reading. Writes are
+    conditional on the stored reading being older, so out-of-order and
+    redelivered files never move a device backwards. Pass a capacity.WriteScheduler
+    to pace the writes. Returns (written, stale, failed, deferred), where deferred
+    are the readings whose latest write stayed throttled past the scheduler's defer limit.
+    """
+    candidates = latest_candidates(items)
+    if not candidates:
+        return 0, 0, 0, []
+    conditional_failure = table.meta.client.exceptions.ConditionalCheckFailedException
+
+    def write(candidate):
+        try:
+            scheduled(
+                scheduler, table.put_item, candidate,
+                Item=candidate,
+                ConditionExpression='attribute_not_exists(observed_at) OR observed_at <= :observed_at',
+                ExpressionAttributeValues={':observed_at': candidate['observed_at']}
+            )
+            return 'written'
+        except conditional_failure:
+            return 'stale'
+        except WritesDeferred:
+            return 'deferred'
+        except Exception as e:
+            logger.error(f"Failed to update latest reading of {candidate['timestamp']}: {str(e)}")
+            return 'failed'
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(candidates)))) as executor:
+        outcomes = list(executor.map(write, candidates))
+    deferred = [_as_reading(candidate) for candidate, outcome in zip(candidates, outcomes) if outcome == 'deferred']
+    return outcomes.count('written'), outcomes.count('stale'), outcomes.count('failed'), deferred
+
+# ---------------------------------------------------------------------------
+# Read side
+# ---------------------------------------------------------------------------
+
+def _as_reading(latest_item):
+    reading = dict(latest_item)
+    reading['device_id'] = reading['timestamp']
+    reading['timestamp'] = reading.pop('reading_timestamp', reading['timestamp'])
+    return reading
+
+class ReadingStore:
+    """
+    Cached reader over the processed-data table.
+
+    `iter_*` methods stream every matching item page by page and bypass the
+    cache; the plain methods return lists and are cached for QUERY_CACHE_TTL
+    seconds. Cached values are shared, so callers must not mutate them.
+    """
+
+    def __init__(self, table, cache=None, page_size=QUERY_PAGE_SIZE):
+        self.table = table
+        self.cache = cache if cache is not None else LRUCache(QUERY_CACHE_SIZE, QUERY_CACHE_TTL)
+        self.page_size = page_size
+
+    def _query(self, key_condition, values, index=None, names=None, newest_first=False, limit=None):
+        kwargs = {
+            'KeyConditionExpression': key_condition,
+            'ExpressionAttributeValues': values,
+            'ScanIndexForward': not newest_first,
+            'Limit': min(self.page_size, limit) if limit else self.page_size,
+        }
+        if names:
+            kwargs['ExpressionAttributeNames'] = names
+        if index:
+            kwargs['IndexName'] = index
+        for count, item in enumerate(paginate(self.table.query, **kwargs), 1):
+            yield item
+            if limit and count >= limit:
+                return
+
+    def latest(self, device_id):
+        """Newest reading of one device, or None"""
+        def load():
+            item = self.table.get_item(Key={'device_id': latest_partition(device_id), 'timestamp': str(device_id)}).get('Item')
+            return _as_reading(item) if item else None
+        return self.cache.get_or_load(('latest', str(device_id)), load)
+
+    def iter_fleet_latest(self):
+        """Newest reading of every device (one paginated Query per `#latest` shard, in parallel)"""
+        for item in latest_items(self.table.query, page_size=self.page_size):
+            yield _as_reading(item)
+
+    def fleet_latest(self):
+        return self.cache.get_or_load(('fleet',), lambda: list(self.iter_fleet_latest()))
+
+    def iter_device_readings(self, device_id, start, end, newest_first=False, limit=None):
+        """Readings of a device whose timestamp sort key is in [start, end]"""
+        return self._query(
+            'device_id = :pk AND #ts BETWEEN :start AND :end',
+            {':pk': str(device_id), ':start': timestamp_bound(start), ':end': timestamp_bound(end, upper=True)},
+            names={'#ts': 'timestamp'},
+            newest_first=newest_first,
+            limit=limit
+        )
+
+    def device_readings(self, device_id, start, end, newest_first=False, limit=None):
+        key = ('device', str(device_id), timestamp_bound(start), timestamp_bound(end, upper=True), newest_first, limit)
+        return self.cache.get_or_load(key, lambda: list(self.iter_device_readings(device_id, start, end, newest_first, limit)))
+
+    def iter_readings_by_date(self, reading_date, start=None, end=None, limit=None,
+                              shards=DATE_INDEX_SHARDS, include_legacy=DATE_INDEX_LEGACY_READS):
+        """
+        Readings of one date (YYYY-MM-DD) through the sharded DateIndex,
+        optionally within a timestamp range. Every shard is queried in parallel
+        and the results are merged lazily in timestamp order.
+        """
+        if isinstance(reading_date, (datetime.date, datetime.datetime)):
+            reading_date = reading_date.strftime('%Y-%m-%d')
+        condition = 'reading_date = :date'
+        values = {}
+        names = None
+        if start is not None or end is not None:
+            condition += ' AND #ts BETWEEN :start AND :end'
+            values = {':start': timestamp_bound(start or ''), ':end': timestamp_bound(end or '\uffff', upper=True)}
+            names = {'#ts': 'timestamp'}
+
+        keys = date_keys(reading_date, shards, include_legacy)
+        executor = ThreadPoolExecutor(max_workers=max(1, min(SHARD_QUERY_CONCURRENCY, len(keys))))
+        try:
+            streams = []
+            for key in keys:
+                kwargs = {
+                    'KeyConditionExpression': condition,
+                    'ExpressionAttributeValues': dict(values, **{':date': key}),
+                    'IndexName': DATE_INDEX,
+                    'Limit': min(self.page_size, limit) if limit else self.page_size,
+                }
+                if names:
+                    kwargs['ExpressionAttributeNames'] = names
+                streams.append(prefetching_paginate(executor, self.table.query, **kwargs))
+            for count, item in enumerate(merge_by_timestamp(streams), 1):
+                yield item
+                if limit and count >= limit:
+                    return
+        finally:
+            executor.shutdown(wait=False)
+
+    def readings_by_date(self, reading_date, start=None, end=None, limit=None):
+        key = ('date', str(reading_date), start and timestamp_bound(start), end and timestamp_bound(end, upper=True), limit)
+        return self.cache.get_or_load(key, lambda: list(self.iter_readings_by_date(reading_date, start, end, limit)))
@@ -0,0 +1,69 @@
+"""
+Thread-safe token bucket.
+
+Callers take tokens before doing rate-limited work; when the bucket is empty
+acquire() sleeps until enough tokens have refilled. A rate of 0 disables the
+limit entirely.
+"""
+import threading
+import time
+
+# Shortfalls below this are rounding error: their wait could be smaller than the clock's resolution
+TOKEN_EPSILON = 1e-9
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate` tokens per second"""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self._updated = now
+
+    def set_rate(self, rate, burst=None):
+        """Change the refill rate, keeping the tokens accumulated so far"""
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = float(rate)
+            self.capacity = float(burst if burst is not None else max(1.0, self.rate))
+            self.tokens = min(self.tokens, self.capacity)
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if they are available right now"""
+        if self.rate <= 0:
+            return True
+        with self._lock:
+            self._refill(self._clock())
+            if self.tokens >= tokens - TOKEN_EPSILON:
+                self.tokens = max(0.0, self.tokens - tokens)
+                return True
+            return False
+
+    def acquire(self, tokens=1):
+        """Block until tokens are available; returns the time spent waiting in seconds"""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill(self._clock())
+                if self.tokens >= tokens - TOKEN_EPSILON:
+                    self.tokens = max(0.0, self.tokens - tokens)
+                    return waited
+                # Requests bigger than the bucket wait for a full bucket and drain it
+                needed = min(tokens, self.capacity) - self.tokens
+                delay = needed / self.rate
+                if self.tokens >= self.capacity:
+                    self.tokens = 0.0
+                    return waited
+            self._sleep(delay)
+            waited += delay
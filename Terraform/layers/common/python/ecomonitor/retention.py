@@ -0,0 +1,407 @@
+"""
+Tiered retention of readings, with archives of what expires.
+
+The table's TTL attribute is `expiry_time` (epoch seconds). The processor sets
+it on every reading at ingest from a per sensor type policy:
+
+    RETENTION_POLICY="temperature=90,humidity=90,co2=180,aqi=365"   days per type
+    RETENTION_DEFAULT_DAYS=365                                       other types (0 = keep)
+
+Retention counts from the date the reading was taken (the date part of
+`reading_date`): the readings of one type and date all expire at midnight UTC
+`days` after the end of that date. Readings that arrive late (backfills) are
+kept at least ARCHIVE_LEAD_DAYS + 1 days after ingest. Hourly packed items carry
+the expiry of their newest batch; rollups and `#latest` items never expire.
+
+Before the first readings of a date can expire (ARCHIVE_LEAD_DAYS ahead of the
+shortest retention), archive_date() streams every reading of the date into
+compressed ECOL parts (see ecomonitor.columnar):
+
+    archive/readings/dt=YYYY-MM-DD/shard=<n>/part-0000.ecol.gz   one unit per DateIndex shard
+    archive/readings/dt=YYYY-MM-DD/shard=<n>/manifest.json       (shard=legacy for bare dates)
+    archive/readings/dt=YYYY-MM-DD/packed/...                     packed items, decoded into readings
+    archive/readings/dt=YYYY-MM-DD/late-<n>/...                   readings added after the date was archived
+    archive/readings/dt=YYYY-MM-DD/manifest.json                  written last: the date is complete
+
+A unit is read with one paginated Query and written part by part, so memory
+stays at one part (ARCHIVE_PART_ROWS rows). Units whose manifest exists are
+skipped, so a run that stops early (out of time) resumes where it left off and
+a complete date is never exported twice. Packed items are found through the
+latest items (ecomonitor.queries.latest_items), which list every device that has reported.
+
+A reading written for a date that may already be archived (late_dates()) makes
+the processor put an empty marker, mark_late(), under
+
+    archive/late/dt=YYYY-MM-DD/<token>
+
+archive_late() later exports the readings of such a date that its archive does
+not hold yet as one more unit (late-0001/, late-0002/...), adds it to the date
+manifest, and deletes the markers it handled.
+
+iter_archive() reads an archived date back, optionally only some columns.
+Numbers come back as floats, everything else as strings.
+"""
+import calendar
+import datetime
+import itertools
+import json
+import logging
+import os
+import time
+import uuid
+
+from ecomonitor import columnar
+from ecomonitor import packed
+from ecomonitor.queries import DATE_INDEX, QUERY_PAGE_SIZE, latest_items, paginate
+from ecomonitor.sharding import DATE_INDEX_LEGACY_READS, DATE_INDEX_SHARDS, SHARD_SEPARATOR, base_date, date_keys
+
+logger = logging.getLogger()
+
+ARCHIVE_PREFIX = os.environ.get('ARCHIVE_PREFIX', 'archive/readings/')
+# Markers of dates that received readings after they may have been archived
+ARCHIVE_LATE_PREFIX = os.environ.get('ARCHIVE_LATE_PREFIX', 'archive/late/')
+ARCHIVE_PART_ROWS = int(os.environ.get('ARCHIVE_PART_ROWS', '100000'))
+# Days before the shortest retention ends that a date is archived
+ARCHIVE_LEAD_DAYS = int(os.environ.get('ARCHIVE_LEAD_DAYS', '3'))
+# Earlier due dates a run still checks, so missed runs catch up
+ARCHIVE_LOOKBACK_DAYS = int(os.environ.get('ARCHIVE_LOOKBACK_DAYS', '7'))
+# Also archive hourly packed items; on by default with the packed storage layout
+ARCHIVE_PACKED = os.environ.get(
+    'ARCHIVE_PACKED', 'true' if os.environ.get('STORAGE_LAYOUT', 'items').lower() == 'packed' else 'false'
+).lower() == 'true'
+# Leading columns of every part; the others follow in order of appearance
+ARCHIVE_COLUMNS = ('device_id', 'timestamp', 'sensor_type', 'reading_date', 'expiry_time')
+MANIFEST = 'manifest.json'
+
+def parse_policy(spec):
+    """'type=days,...' → {type: days}"""
+    policy = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            name, days = part.split('=', 1)
+            policy[name.strip()] = int(days)
+    return policy
+
+RETENTION_POLICY = parse_policy(os.environ.get('RETENTION_POLICY', ''))
+RETENTION_DEFAULT_DAYS = int(os.environ.get('RETENTION_DEFAULT_DAYS', '0'))
+
+# ---------------------------------------------------------------------------
+# Policy
+# ---------------------------------------------------------------------------
+
+def retention_days(sensor_type, policy=None, default=None):
+    """Days a reading of `sensor_type` is kept; 0 or less means forever"""
+    policy = RETENTION_POLICY if policy is None else policy
+    return policy.get(str(sensor_type), RETENTION_DEFAULT_DAYS if default is None else default)
+
+def shortest_retention(policy=None, default=None):
+    """The shortest finite retention in days, or None when nothing expires"""
+    policy = RETENTION_POLICY if policy is None else policy
+    default = RETENTION_DEFAULT_DAYS if default is None else default
+    days = [value for value in list(policy.values()) + [default] if value > 0]
+    return min(days) if days else None
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(base_date(value))
+
+def expiry_for(sensor_type, reading_date, policy=None, default=None, today=None):
+    """`expiry_time` of a reading taken on `reading_date` and ingested `today`, or None when its type is kept"""
+    days = retention_days(sensor_type, policy, default)
+    if days <= 0:
+        return None
+    today = today or datetime.datetime.utcnow().date()
+    expires = max(_as_date(reading_date) + datetime.timedelta(days=days + 1),
+                  today + datetime.timedelta(days=ARCHIVE_LEAD_DAYS + 1))
+    return calendar.timegm(expires.timetuple())
+
+def assign_expiry(item, policy=None, default=None):
+    """Set the item's `expiry_time` from the policy (the policy wins over a sent value)"""
+    expiry = expiry_for(item.get('sensor_type'), item['reading_date'], policy, default)
+    if expiry is None:
+        item.pop('expiry_time', None)
+    else:
+        item['expiry_time'] = expiry
+    return item
+
+def due_dates(today=None, lead_days=ARCHIVE_LEAD_DAYS, lookback_days=ARCHIVE_LOOKBACK_DAYS, policy=None, default=None):
+    """
+    Closed dates whose first readings expire within `lead_days`, plus the
+    `lookback_days` before the newest of them, oldest first.
+    """
+    shortest = shortest_retention(policy, default)
+    if shortest is None:
+        return []
+    today = today or datetime.datetime.utcnow().date()
+    newest = today - datetime.timedelta(days=1 + max(0, shortest - lead_days))
+    return [newest - datetime.timedelta(days=back) for back in range(lookback_days, -1, -1)]
+
+def late_dates(items, today=None, lead_days=ARCHIVE_LEAD_DAYS, policy=None, default=None):
+    """
+    Dates of expiring readings among `items` that may already be archived (on or
+    before the newest due date): their readings would outlive the archive run.
+    """
+    shortest = shortest_retention(policy, default)
+    if shortest is None:
+        return set()
+    newest = due_dates(today, lead_days, 0, policy, default)[-1]
+    dates = set()
+    for item in items:
+        if item.get('expiry_time') is None or not item.get('reading_date'):
+            continue
+        reading_date = _as_date(item['reading_date'])
+        if reading_date <= newest:
+            dates.add(reading_date)
+    return dates
+
+# ---------------------------------------------------------------------------
+# Archive writer
+# ---------------------------------------------------------------------------
+
+def date_prefix(reading_date, prefix=ARCHIVE_PREFIX):
+    return f"{prefix}dt={_as_date(reading_date).isoformat()}/"
+
+def load_json(s3, bucket, key):
+    """A JSON object from S3, or None when it does not exist"""
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)['Body'].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+class PartWriter:
+    """Streams rows into numbered ECOL parts under one prefix"""
+
+    def __init__(self, s3, bucket, prefix, part_rows=ARCHIVE_PART_ROWS):
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.part_rows = max(1, part_rows)
+        self.pending = []
+        self.parts = []
+        self.rows = 0
+        self.sensor_types = {}
+
+    def add(self, row):
+        self.pending.append(row)
+        sensor_type = str(row.get('sensor_type'))
+        self.sensor_types[sensor_type] = self.sensor_types.get(sensor_type, 0) + 1
+        if len(self.pending) >= self.part_rows:
+            self._write()
+
+    def close(self):
+        """Write the last part; returns the part entries of the manifest"""
+        if self.pending:
+            self._write()
+        return self.parts
+
+    def _write(self):
+        body = columnar.encode_rows(self.pending, ARCHIVE_COLUMNS)
+        key = f"{self.prefix}part-{len(self.parts):04d}{columnar.FILE_EXTENSION}"
+        self.s3.put_object(Bucket=self.bucket, Key=key, Body=body)
+        self.parts.append({'key': key, 'rows': len(self.pending), 'bytes': len(body)})
+        self.rows += len(self.pending)
+        self.pending = []
+
+def _unit_name(date_key):
+    return f"shard={date_key.split(SHARD_SEPARATOR, 1)[1]}" if SHARD_SEPARATOR in date_key else 'shard=legacy'
+
+def _shard_rows(table, date_key, page_size):
+    return paginate(
+        table.query,
+        IndexName=DATE_INDEX,
+        KeyConditionExpression='reading_date = :date',
+        ExpressionAttributeValues={':date': date_key},
+        Limit=page_size
+    )
+
+def _packed_rows(table, reading_date, page_size):
+    """Readings of every device's packed items whose hour falls on `reading_date`"""
+    start = datetime.datetime.combine(reading_date, datetime.time())
+    end = start + datetime.timedelta(hours=23)
+    for device in latest_items(table.query, page_size=page_size):
+        for item in packed.iter_packed_items(table, device['timestamp'], start, end):
+            for reading in packed.item_readings(item):
+                reading['timestamp'] = str(reading['observed_at'])
+                reading['reading_date'] = reading_date.isoformat()
+                yield reading
+
+def archive_unit(s3, bucket, prefix, rows, part_rows=ARCHIVE_PART_ROWS):
+    """Write `rows` as parts plus the unit manifest under `prefix`; returns the manifest"""
+    writer = PartWriter(s3, bucket, prefix, part_rows)
+    for row in rows:
+        writer.add(row)
+    parts = writer.close()
+    manifest = {
+        'prefix': prefix,
+        'rows': writer.rows,
+        'parts': parts,
+        'sensor_types': writer.sensor_types,
+        'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+    }
+    s3.put_object(Bucket=bucket, Key=f"{prefix}{MANIFEST}", Body=json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+def _date_units(table, reading_date, include_packed, shards, include_legacy, page_size):
+    """(unit name, rows callable) of every unit of one date"""
+    units = [(_unit_name(key), lambda key=key: _shard_rows(table, key, page_size))
+             for key in date_keys(reading_date.isoformat(), shards, include_legacy)]
+    if include_packed:
+        units.append(('packed', lambda: _packed_rows(table, reading_date, page_size)))
+    return units
+
+def archive_date(table, s3, bucket, reading_date, prefix=ARCHIVE_PREFIX, part_rows=ARCHIVE_PART_ROWS,
+                 include_packed=ARCHIVE_PACKED, shards=DATE_INDEX_SHARDS, include_legacy=DATE_INDEX_LEGACY_READS,
+                 page_size=QUERY_PAGE_SIZE, should_stop=None, force=False):
+    """
+    Archive every reading of one date. Returns the date manifest, or None when
+    `should_stop()` turned true before every unit was written (a later run
+    resumes with the units still missing). `force` rewrites an existing archive,
+    e.g. after a large backfill of the date (late readings are added by archive_late()).
+    """
+    reading_date = _as_date(reading_date)
+    root = date_prefix(reading_date, prefix)
+    manifest = None if force else load_json(s3, bucket, f"{root}{MANIFEST}")
+    if manifest is not None:
+        return manifest
+    if force:
+        s3.delete_object(Bucket=bucket, Key=f"{root}{MANIFEST}")
+
+    written = []
+    for name, rows in _date_units(table, reading_date, include_packed, shards, include_legacy, page_size):
+        unit_prefix = f"{root}{name}/"
+        unit = None if force else load_json(s3, bucket, f"{unit_prefix}{MANIFEST}")
+        if unit is None:
+            if should_stop is not None and should_stop():
+                logger.warning(f"⏸️ [ARCHIVE] {reading_date} stopped before {name}; the next run resumes it")
+                return None
+            unit = archive_unit(s3, bucket, unit_prefix, rows(), part_rows)
+        unit['unit'] = name
+        written.append(unit)
+
+    sensor_types = {}
+    for unit in written:
+        for sensor_type, count in unit['sensor_types'].items():
+            sensor_types[sensor_type] = sensor_types.get(sensor_type, 0) + count
+    manifest = {
+        'date': reading_date.isoformat(),
+        'format': 'ecol',
+        'rows': sum(unit['rows'] for unit in written),
+        'bytes': sum(part['bytes'] for unit in written for part in unit['parts']),
+        'sensor_types': sensor_types,
+        'units': [{'unit': unit['unit'], 'rows': unit['rows'], 'parts': unit['parts']} for unit in written],
+        'created_at': datetime.datetime.utcnow().isoformat() + 'Z',
+    }
+    s3.put_object(Bucket=bucket, Key=f"{root}{MANIFEST}", Body=json.dumps(manifest, indent=2).encode('utf-8'))
+    logger.info(f"🗄️ [ARCHIVE] {reading_date}: {manifest['rows']} readings in "
+                f"{sum(len(unit['parts']) for unit in written)} parts ({manifest['bytes']} bytes)")
+    return manifest
+
+# ---------------------------------------------------------------------------
+# Late readings
+# ---------------------------------------------------------------------------
+
+def mark_late(s3, bucket, dates, prefix=ARCHIVE_LATE_PREFIX):
+    """Put one marker per date that received late readings; every call writes new ones"""
+    token = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    for reading_date in dates:
+        s3.put_object(Bucket=bucket, Key=f"{prefix}dt={_as_date(reading_date).isoformat()}/{token}", Body=b'')
+
+def list_late(s3, bucket, prefix=ARCHIVE_LATE_PREFIX):
+    """{date: [marker keys]} of the dates with late readings"""
+    markers = {}
+    kwargs = {'Bucket': bucket, 'Prefix': f"{prefix}dt="}
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        for entry in response.get('Contents', []):
+            folder = entry['Key'][len(prefix):].split('/', 1)[0]
+            markers.setdefault(_as_date(folder[len('dt='):]), []).append(entry['Key'])
+        if not response.get('IsTruncated'):
+            return markers
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+def _delete_keys(s3, bucket, keys):
+    for start in range(0, len(keys), 1000):
+        s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True})
+
+def archive_late(table, s3, bucket, reading_date, prefix=ARCHIVE_PREFIX, part_rows=ARCHIVE_PART_ROWS,
+                 include_packed=ARCHIVE_PACKED, shards=DATE_INDEX_SHARDS, include_legacy=DATE_INDEX_LEGACY_READS,
+                 page_size=QUERY_PAGE_SIZE):
+    """
+    Add the readings of an archived date that its archive does not hold yet as a
+    new `late-<n>` unit of the date manifest. Returns the number of rows added
+    (0 when every reading was archived already), or None when the date has no
+    complete archive.
+    """
+    reading_date = _as_date(reading_date)
+    root = date_prefix(reading_date, prefix)
+    manifest = load_json(s3, bucket, f"{root}{MANIFEST}")
+    if manifest is None:
+        return None
+    archived = {(str(row['device_id']), str(row['timestamp']))
+                for row in iter_archive(s3, bucket, reading_date, ('device_id', 'timestamp'), prefix)}
+    rows = (row
+            for _, unit_rows in _date_units(table, reading_date, include_packed, shards, include_legacy, page_size)
+            for row in unit_rows()
+            if (str(row['device_id']), str(row['timestamp'])) not in archived)
+    first = next(rows, None)
+    if first is None:
+        return 0
+
+    name = f"late-{sum(1 for unit in manifest['units'] if unit['unit'].startswith('late-')) + 1:04d}"
+    unit = archive_unit(s3, bucket, f"{root}{name}/", itertools.chain([first], rows), part_rows)
+    manifest['units'].append({'unit': name, 'rows': unit['rows'], 'parts': unit['parts']})
+    manifest['rows'] += unit['rows']
+    manifest['bytes'] += sum(part['bytes'] for part in unit['parts'])
+    for sensor_type, count in unit['sensor_types'].items():
+        manifest['sensor_types'][sensor_type] = manifest['sensor_types'].get(sensor_type, 0) + count
+    manifest['updated_at'] = datetime.datetime.utcnow().isoformat() + 'Z'
+    s3.put_object(Bucket=bucket, Key=f"{root}{MANIFEST}", Body=json.dumps(manifest, indent=2).encode('utf-8'))
+    logger.info(f"🗄️ [ARCHIVE] {reading_date}: {unit['rows']} late readings added as {name}")
+    return unit['rows']
+
+def archive_late_dates(table, s3, bucket, oldest_due, prefix=ARCHIVE_PREFIX, late_prefix=ARCHIVE_LATE_PREFIX,
+                       include_packed=ARCHIVE_PACKED, should_stop=None):
+    """
+    Handle every date marked by mark_late(). Archived dates get a late unit; dates
+    older than `oldest_due` without an archive (never due in a run's window) are
+    archived now; the markers of both are deleted. Newer dates without an archive
+    keep their markers until their regular archive exists. Returns {date: rows added}.
+    """
+    added = {}
+    for reading_date, keys in sorted(list_late(s3, bucket, late_prefix).items()):
+        if should_stop is not None and should_stop():
+            logger.warning(f"⏸️ [ARCHIVE] Stopped before the late readings of {reading_date}; the next run resumes them")
+            break
+        rows = archive_late(table, s3, bucket, reading_date, prefix, include_packed=include_packed)
+        if rows is None:
+            if reading_date >= oldest_due:
+                continue
+            manifest = archive_date(table, s3, bucket, reading_date, prefix, include_packed=include_packed,
+                                    should_stop=should_stop)
+            if manifest is None:
+                break
+            rows = manifest['rows']
+        _delete_keys(s3, bucket, keys)
+        added[reading_date.isoformat()] = rows
+    return added
+
+# ---------------------------------------------------------------------------
+# Archive reader
+# ---------------------------------------------------------------------------
+
+def load_manifest(s3, bucket, reading_date, prefix=ARCHIVE_PREFIX):
+    """The manifest of an archived date, or None when the date is not (completely) archived"""
+    return load_json(s3, bucket, f"{date_prefix(reading_date, prefix)}{MANIFEST}")
+
+def iter_archive(s3, bucket, reading_date, columns=None, prefix=ARCHIVE_PREFIX):
+    """Rows of an archived date, part by part; pass `columns` to decode only those"""
+    manifest = load_manifest(s3, bucket, reading_date, prefix)
+    if manifest is None:
+        raise LookupError(f"No complete archive for {_as_date(reading_date)} under {prefix}")
+    for unit in manifest['units']:
+        for part in unit['parts']:
+            data = s3.get_object(Bucket=bucket, Key=part['key'])['Body'].read()
+            yield from columnar.decode_rows(data, columns)
@@ -0,0 +1,341 @@
+"""
+Incremental per-device rollups.
+
+For every reading the processor writes, the windows that contain it
+(ROLLUP_GRANULARITIES, hour and day by default; minute is available) are updated
+with count, sum, min, max and sum of squares. Readings in one batch are merged
+per device and window first, so each window costs a single UpdateItem whose ADD
+clause is atomic under concurrent invocations.
+
+min/max cannot be expressed with ADD. The container remembers the extremes each
+window had after its last update: a batch inside them only adds, and a batch
+that moves one sets both in the same UpdateItem, conditional on the stored
+extremes being no wider. Only a window this container has not seen yet (or one
+another container widened meanwhile) may need a second, conditional write.
+
+Cost: every window is a small item (1 WCU per update), so a single-reading S3
+object costs one WCU per granularity, 2 with the defaults, on top of the reading
+itself (table + DateIndex). Batch files and envelopes merge their readings per
+device and window before writing.
+
+Rollups live in the readings table under their own partition key
+`<device_id>#rollup#<granularity>` with the window start as the sort key, so a
+trend query reads one item per window instead of every reading.
+"""
+import datetime
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from ecomonitor.cache import LRUCache
+from ecomonitor.capacity import WritesDeferred, scheduled
+from ecomonitor.profiles import PROFILES
+from ecomonitor.sortkeys import key_epoch_ms
+
+logger = logging.getLogger()
+
+GRANULARITY_FORMATS = {
+    'minute': '%Y-%m-%dT%H:%M',
+    'hour': '%Y-%m-%dT%H',
+    'day': '%Y-%m-%d',
+}
+DEFAULT_GRANULARITIES = tuple(
+    part.strip() for part in os.environ.get('ROLLUP_GRANULARITIES', 'hour,day').split(',') if part.strip()
+)
+ROLLUP_KEY_SEPARATOR = '#rollup#'
+UPDATE_CONCURRENCY = int(os.environ.get('ROLLUP_UPDATE_CONCURRENCY', '8'))
+ROLLUP_EXTREMES_CACHE_SIZE = int(os.environ.get('ROLLUP_EXTREMES_CACHE_SIZE', '10000'))
+
+# (min, max) stored in each recently updated window, as of this container's last update
+_extremes = LRUCache(ROLLUP_EXTREMES_CACHE_SIZE)
+
+def rollup_partition(device_id, granularity):
+    return f"{device_id}{ROLLUP_KEY_SEPARATOR}{granularity}"
+
+def is_rollup_item(item):
+    return ROLLUP_KEY_SEPARATOR in str(item.get('device_id', ''))
+
+def _parse_iso(value):
+    text = str(value).rstrip('Z')
+    try:
+        return datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+
+def reading_datetime(item, default=None):
+    """
+    UTC time of a reading: `reading_time` when it is an ISO timestamp, else the
+    epoch millis of its `timestamp` (a sort key, or the bare number the IoT
+    rule's timestamp() adds), else `default`.
+    """
+    if item.get('reading_time') is not None:
+        moment = _parse_iso(item['reading_time'])
+        if moment is not None:
+            if moment.tzinfo is not None:
+                moment = moment.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+            return moment
+    epoch_ms = key_epoch_ms(item.get('timestamp', ''))
+    if epoch_ms is not None:
+        return datetime.datetime.utcfromtimestamp(epoch_ms / 1000.0)
+    return default
+
+def reading_value(item):
+    """(metric name, Decimal value) of a reading according to its sensor profile, or None"""
+    profile = PROFILES.get(str(item.get('sensor_type', '')))
+    if profile is None:
+        return None
+    value = item.get(profile.value_field)
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        value = Decimal(str(value))
+    except ArithmeticError:
+        return None
+    if not value.is_finite():
+        return None
+    return profile.value_field, value
+
+class Rollup:
+    """count/sum/min/max/sum of squares for one device × granularity × window"""
+    __slots__ = ('device_id', 'granularity', 'window', 'sensor_type', 'metric', 'count', 'sum', 'min', 'max', 'sum_sq')
+
+    def __init__(self, device_id, granularity, window, sensor_type, metric):
+        self.device_id = device_id
+        self.granularity = granularity
+        self.window = window
+        self.sensor_type = sensor_type
+        self.metric = metric
+        self.count = 0
+        self.sum = Decimal(0)
+        self.sum_sq = Decimal(0)
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.sum_sq += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Fold another rollup of the same window in; returns self"""
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+        return self
+
+    def extremes_only(self):
+        """A rollup that only carries this one's min/max (for a tightening write still owed)"""
+        rollup = Rollup(self.device_id, self.granularity, self.window, self.sensor_type, self.metric)
+        rollup.min, rollup.max = self.min, self.max
+        return rollup
+
+    @property
+    def key(self):
+        return {'device_id': rollup_partition(self.device_id, self.granularity), 'timestamp': self.window}
+
+    @property
+    def window_key(self):
+        return self.device_id, self.granularity, self.window
+
+def merge_readings(items, granularities=DEFAULT_GRANULARITIES, now=None):
+    """Fold a batch of reading items into one Rollup per device × granularity × window"""
+    now = now or datetime.datetime.utcnow()
+    rollups = {}
+    for item in items:
+        if is_rollup_item(item):
+            continue
+        measured = reading_value(item)
+        if measured is None:
+            continue
+        metric, value = measured
+        moment = reading_datetime(item, now)
+        device_id = str(item['device_id'])
+        for granularity in granularities:
+            window = moment.strftime(GRANULARITY_FORMATS[granularity])
+            key = (device_id, granularity, window)
+            rollup = rollups.get(key)
+            if rollup is None:
+                rollup = rollups[key] = Rollup(device_id, granularity, window, str(item['sensor_type']), metric)
+            rollup.add(value)
+    return list(rollups.values())
+
+def merge_rollups(rollups):
+    """Rollups of the same window folded into one"""
+    merged = {}
+    for rollup in rollups:
+        if rollup.window_key in merged:
+            merged[rollup.window_key].merge(rollup)
+        else:
+            merged[rollup.window_key] = rollup
+    return list(merged.values())
+
+def _number(value):
+    return {'N': str(value)}
+
+def _update(client, table_name, key, rollup, scheduler, extremes=None):
+    """
+    The rollup's ADD in one UpdateItem. min/max are initialised with if_not_exists,
+    or set to `extremes` (min, max) if the stored ones are no wider. Returns the response.
+    """
+    if extremes is None:
+        low, high = rollup.min, rollup.max
+        kwargs = {}
+        assignments = 'SET #min = if_not_exists(#min, :min), #max = if_not_exists(#max, :max), '
+    else:
+        low, high = extremes
+        kwargs = {'ConditionExpression': '#min >= :min AND #max <= :max'}
+        assignments = 'SET #min = :min, #max = :max, '
+    return scheduled(
+        scheduler, client.update_item,
+        TableName=table_name,
+        Key=key,
+        UpdateExpression=(
+            'ADD #count :count, #sum :sum, #sum_sq :sum_sq ' + assignments +
+            'sensor_type = :sensor_type, metric = :metric, granularity = :granularity, updated_at = :updated_at'
+        ),
+        ExpressionAttributeNames={'#count': 'count', '#sum': 'sum', '#sum_sq': 'sum_sq', '#min': 'min', '#max': 'max'},
+        ExpressionAttributeValues={
+            ':count': _number(rollup.count),
+            ':sum': _number(rollup.sum),
+            ':sum_sq': _number(rollup.sum_sq),
+            ':min': _number(low),
+            ':max': _number(high),
+            ':sensor_type': {'S': rollup.sensor_type},
+            ':metric': {'S': rollup.metric},
+            ':granularity': {'S': rollup.granularity},
+            ':updated_at': {'S': datetime.datetime.utcnow().isoformat()},
+        },
+        ReturnValues='UPDATED_NEW',
+        **kwargs
+    )
+
+def apply_rollup(client, table_name, rollup, scheduler=None):
+    """
+    Write one merged rollup. Returns (writes, owed): writes is 1, or more when
+    the window's stored extremes were unknown to this container or moved by
+    another one; owed is None, or a rollup carrying only the extremes when the
+    counts were stored but tightening min/max was deferred. Raises
+    WritesDeferred when nothing was stored.
+    """
+    key = {name: {'S': value} for name, value in rollup.key.items()}
+    cache_key = (key['device_id']['S'], key['timestamp']['S'])
+    known = _extremes.get(cache_key)
+    writes = 0
+    if known is not None and (rollup.min < known[0] or rollup.max > known[1]):
+        # The batch moves an extreme: set both, unless another writer stored wider ones meanwhile
+        low, high = min(known[0], rollup.min), max(known[1], rollup.max)
+        try:
+            _update(client, table_name, key, rollup, scheduler, (low, high))
+            _extremes.put(cache_key, (low, high))
+            return 1, None
+        except client.exceptions.ConditionalCheckFailedException:
+            _extremes.invalidate(cache_key)
+            writes += 1
+
+    # Extremes inside the known ones (or unknown): add, and initialise min/max of a new window
+    response = _update(client, table_name, key, rollup, scheduler)
+    writes += 1
+    stored = response.get('Attributes', {})
+    low, high = (Decimal(stored[attribute]['N']) if attribute in stored else None for attribute in ('min', 'max'))
+    for attribute, operator, value in (('min', '>', rollup.min), ('max', '<', rollup.max)):
+        current = low if attribute == 'min' else high
+        if current is None or not (current > value if operator == '>' else current < value):
+            continue
+        try:
+            scheduled(
+                scheduler, client.update_item,
+                TableName=table_name,
+                Key=key,
+                UpdateExpression=f'SET #{attribute} = :value',
+                ConditionExpression=f'#{attribute} {operator} :value',
+                ExpressionAttributeNames={f'#{attribute}': attribute},
+                ExpressionAttributeValues={':value': _number(value)}
+            )
+            writes += 1
+        except client.exceptions.ConditionalCheckFailedException:
+            # A concurrent writer already stored a tighter extreme
+            pass
+        except WritesDeferred:
+            _extremes.invalidate(cache_key)
+            return writes, rollup.extremes_only()
+        if attribute == 'min':
+            low = value
+        else:
+            high = value
+    if low is not None and high is not None:
+        _extremes.put(cache_key, (low, high))
+    return writes, None
+
+def apply_rollups(client, table_name, rollups, concurrency=UPDATE_CONCURRENCY, scheduler=None):
+    """
+    Apply merged rollups concurrently, paced by `scheduler` if given.
+    Returns (writes, failures, deferred): deferred are the rollups (or the parts
+    of them) that stayed throttled past the scheduler's defer limit and are still owed.
+    """
+    if not rollups:
+        return 0, 0, []
+
+    def apply(rollup):
+        try:
+            writes, owed = apply_rollup(client, table_name, rollup, scheduler)
+            return writes, 0, owed
+        except WritesDeferred:
+            return 0, 0, rollup
+        except Exception as e:
+            logger.error(f"Failed to update rollup {rollup.key}: {str(e)}")
+            return 0, 1, None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(rollups)))) as executor:
+        outcomes = list(executor.map(apply, rollups))
+    return (sum(writes for writes, _, _ in outcomes), sum(failures for _, failures, _ in outcomes),
+            [owed for _, _, owed in outcomes if owed is not None])
+
+def summarize_rollup(item):
+    """Rollup item with derived mean and population standard deviation"""
+    count = int(item.get('count', 0))
+    total = Decimal(str(item.get('sum', 0)))
+    sum_sq = Decimal(str(item.get('sum_sq', 0)))
+    mean = total / count if count else None
+    variance = (sum_sq / count - mean * mean) if count else None
+    return {
+        'device_id': str(item['device_id']).split(ROLLUP_KEY_SEPARATOR)[0],
+        'granularity': item.get('granularity'),
+        'window': item['timestamp'],
+        'sensor_type': item.get('sensor_type'),
+        'metric': item.get('metric'),
+        'count': count,
+        'sum': total,
+        'min': item.get('min'),
+        'max': item.get('max'),
+        'mean': mean,
+        'stddev': Decimal(str(math.sqrt(max(0.0, float(variance))))) if variance is not None else None,
+    }
+
+def query_rollups(table, device_id, granularity, start, end):
+    """
+    Rollups of one device for windows in [start, end], where start/end are
+    window strings in the granularity's format (e.g. '2024-05-01T10' for hours).
+    Reads O(windows) items through a key-condition Query on a boto3 Table.
+    """
+    kwargs = {
+        'KeyConditionExpression': 'device_id = :pk AND #ts BETWEEN :start AND :end',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {':pk': rollup_partition(device_id, granularity), ':start': start, ':end': end},
+    }
+    summaries = []
+    while True:
+        response = table.query(**kwargs)
+        summaries.extend(summarize_rollup(item) for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return summaries
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
@@ -0,0 +1,143 @@
+"""
+Per-container AWS client cache.
+
+Clients are created lazily on first use and reused by every later invocation
+that lands on the same warm container, so credential resolution, endpoint
+loading and TLS setup happen once instead of once per call. Clients are keyed by
+service, endpoint URL and region, which lets the simulators keep one iot-data
+client per IoT endpoint.
+
+boto3/botocore are only imported when the first client is built, and
+lazy_client()/lazy_resource() hand out module-level placeholders that build the
+real client on first attribute access, so importing a handler module costs
+nothing for services it never calls (e.g. SNS on the error path only).
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger()
+
+MAX_POOL_CONNECTIONS = int(os.environ.get('BOTO_MAX_POOL_CONNECTIONS', '50'))
+MAX_ATTEMPTS = int(os.environ.get('BOTO_MAX_ATTEMPTS', '3'))
+RETRY_MODE = os.environ.get('BOTO_RETRY_MODE', 'standard')
+CONNECT_TIMEOUT = float(os.environ.get('BOTO_CONNECT_TIMEOUT', '2'))
+READ_TIMEOUT = float(os.environ.get('BOTO_READ_TIMEOUT', '5'))
+
+_session = None
+_default_config = None
+_cache = {}
+_stats = {}
+_lock = threading.Lock()
+
+def default_config():
+    """Shared botocore Config (pool size, retries, timeouts), built on first use"""
+    global _default_config
+    if _default_config is None:
+        from botocore.config import Config
+
+        _default_config = Config(
+            max_pool_connections=MAX_POOL_CONNECTIONS,
+            retries={'max_attempts': MAX_ATTEMPTS, 'mode': RETRY_MODE},
+            connect_timeout=CONNECT_TIMEOUT,
+            read_timeout=READ_TIMEOUT,
+            tcp_keepalive=True
+        )
+    return _default_config
+
+def _get_session():
+    global _session
+    if _session is None:
+        import boto3
+
+        _session = boto3.session.Session()
+    return _session
+
+def _get_or_create(kind, service, endpoint_url, region_name, config):
+    key = (kind, service, endpoint_url, region_name)
+    cached = _cache.get(key)
+    if cached is not None:
+        _stats[key]['reuses'] += 1
+        return cached
+
+    with _lock:
+        # Another thread may have built it while we waited
+        cached = _cache.get(key)
+        if cached is not None:
+            _stats[key]['reuses'] += 1
+            return cached
+
+        started = time.perf_counter()
+        factory = _get_session().client if kind == 'client' else _get_session().resource
+        created = factory(
+            service,
+            endpoint_url=endpoint_url,
+            region_name=region_name,
+            config=config or default_config()
+        )
+        init_ms = (time.perf_counter() - started) * 1000
+        _cache[key] = created
+        _stats[key] = {'init_ms': init_ms, 'reuses': 0, 'reported': False, 'reported_reuses': 0}
+        logger.info(f"🔌 [RUNTIME] Created {service} {kind} in {init_ms:.1f} ms")
+        return created
+
+def get_client(service, endpoint_url=None, region_name=None, config=None):
+    """Cached boto3 client for a service/endpoint/region combination"""
+    return _get_or_create('client', service, endpoint_url, region_name, config)
+
+def get_resource(service, endpoint_url=None, region_name=None, config=None):
+    """Cached boto3 resource for a service/endpoint/region combination"""
+    return _get_or_create('resource', service, endpoint_url, region_name, config)
+
+class _Lazy:
+    """Placeholder that resolves to a cached client/resource on first attribute access"""
+
+    def __init__(self, kind, service, endpoint_url=None, region_name=None, config=None):
+        self._args = (kind, service, endpoint_url, region_name, config)
+
+    def __getattr__(self, name):
+        return getattr(_get_or_create(*self._args), name)
+
+    def __repr__(self):
+        return f"<lazy {self._args[0]} {self._args[1]}>"
+
+def lazy_client(service, endpoint_url=None, region_name=None, config=None):
+    """Module-level stand-in for get_client(): nothing is imported or built until it is used"""
+    return _Lazy('client', service, endpoint_url, region_name, config)
+
+def lazy_resource(service, endpoint_url=None, region_name=None, config=None):
+    """Module-level stand-in for get_resource()"""
+    return _Lazy('resource', service, endpoint_url, region_name, config)
+
+def client_stats():
+    """Init time and reuse count of every cached client, keyed by 'kind:service[@endpoint]'"""
+    report = {}
+    for (kind, service, endpoint_url, region_name), stats in list(_stats.items()):
+        label = f"{kind}:{service}"
+        if endpoint_url:
+            label += f"@{endpoint_url}"
+        if region_name:
+            label += f"[{region_name}]"
+        report[label] = {'init_ms': stats['init_ms'], 'reuses': stats['reuses']}
+    return report
+
+def record_client_metrics(metrics):
+    """Add client init times (first report only) and reuses since the last report to a MetricsBuffer"""
+    for (kind, service, _, _), stats in list(_stats.items()):
+        dimensions = [{'Name': 'Service', 'Value': service}]
+        if not stats['reported']:
+            metrics.put('ClientInitTime', stats['init_ms'], 'Milliseconds', dimensions)
+            stats['reported'] = True
+        reuses = stats['reuses'] - stats['reported_reuses']
+        if reuses:
+            metrics.put('ClientReuses', reuses, 'Count', dimensions)
+            stats['reported_reuses'] = stats['reuses']
+
+def reset():
+    """Drop every cached client (used by local harnesses to simulate a cold start)"""
+    global _session
+    with _lock:
+        _cache.clear()
+        _stats.clear()
+        _session = None
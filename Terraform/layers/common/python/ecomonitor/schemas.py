@@ -0,0 +1,218 @@
+"""
+Per-sensor-type reading schemas, compiled into validator/coercers.
+
+A Schema names the reading's value field, its plausible range and the optional
+text fields. compile_schema() turns it into one function that, in a single
+pass over a reading:
+
+- checks that the key attributes (device_id, timestamp and, when present,
+  reading_date and sensor_type) are non-empty, coercing them to str;
+- checks that the value field is present, numeric (numeric strings are
+  accepted), finite and within range, converting it to Decimal unless it
+  already is an int or Decimal;
+- coerces the text fields to str, and converts any other float (nested ones
+  included) to Decimal, since boto3 refuses floats.
+
+Each problem found is collected and reported together as RecordRejected, so a
+reading DynamoDB would refuse is rejected locally, before any write round
+trip. Validators are compiled once per sensor type and cached for the container
+lifetime; types without a schema get the generic validator (key attributes and
+floats only). Ranges can be overridden with SCHEMA_RANGES, e.g.
+"co2=0:20000,temperature=-80:120".
+
+Sensor types are resolved from an S3 key through a precomputed prefix map
+(`sensors/<type>/` for every registered type); other keys fall back to their
+path segments and then to the type names they contain, as before, and keys
+that say nothing give 'unknown'.
+"""
+import math
+import os
+from decimal import Decimal, InvalidOperation
+
+from ecomonitor.profiles import PROFILES
+
+UNKNOWN = 'unknown'
+KEY_FIELDS = ('device_id', 'timestamp')
+OPTIONAL_KEY_FIELDS = ('reading_date', 'sensor_type')
+TEXT_FIELDS = ('unit', 'location', 'reading_time', 'category', 'health_concern', 'health_status',
+               'health_impact', 'comfort_level')
+KEY_PREFIX = 'sensors/'
+
+class RecordRejected(ValueError):
+    """A reading that can never be written; `problems` lists every reason"""
+
+    def __init__(self, problems):
+        super().__init__('; '.join(problems))
+        self.problems = list(problems)
+
+class Schema:
+    """Value field, plausible range and text fields of one sensor type's readings"""
+
+    def __init__(self, sensor_type, value_field, minimum=None, maximum=None, text_fields=TEXT_FIELDS):
+        self.sensor_type = sensor_type
+        self.value_field = value_field
+        self.minimum = minimum
+        self.maximum = maximum
+        self.text_fields = tuple(text_fields)
+
+# Physically plausible ranges; anything outside is a broken sensor or a unit mix-up
+DEFAULT_RANGES = {
+    'aqi': (0, 500),
+    'co2': (0, 10000),
+    'humidity': (0, 100),
+    'temperature': (-60, 90),
+}
+
+def parse_ranges(spec):
+    """'type=min:max,...' → {type: (min, max)}; an empty bound is open"""
+    ranges = {}
+    for part in (spec or '').split(','):
+        if '=' in part:
+            name, bounds = part.split('=', 1)
+            low, _, high = bounds.partition(':')
+            ranges[name.strip()] = (float(low) if low.strip() else None, float(high) if high.strip() else None)
+    return ranges
+
+SCHEMAS = {}
+_validators = {}
+# 'sensors/<type>/' → type, kept in step with SCHEMAS
+_prefixes = {}
+
+def register_schema(schema):
+    """Add or replace the schema of a sensor type (its compiled validator is rebuilt on next use)"""
+    SCHEMAS[schema.sensor_type] = schema
+    _validators.pop(schema.sensor_type, None)
+    _prefixes[f"{KEY_PREFIX}{schema.sensor_type}/"] = schema.sensor_type
+    return schema
+
+def _number(value):
+    """int/Decimal as they are, floats and numeric strings as Decimal; None when not a finite number"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        if isinstance(value, Decimal):
+            number = value
+        elif isinstance(value, float):
+            number = Decimal(repr(value))
+        elif isinstance(value, str):
+            number = Decimal(value.strip())
+        else:
+            return None
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+def _has_float(value):
+    if isinstance(value, float):
+        return True
+    if isinstance(value, dict):
+        return any(_has_float(inner) for inner in value.values())
+    if isinstance(value, list):
+        return any(_has_float(inner) for inner in value)
+    return False
+
+def _floats_to_decimal(value):
+    """Copy of a (nested) value with floats as Decimal; ValueError for NaN/infinity"""
+    if isinstance(value, float):
+        if not math.isfinite(value):
+            raise ValueError(f"{value} is not a finite number")
+        return Decimal(repr(value))
+    if isinstance(value, dict):
+        return {name: _floats_to_decimal(inner) for name, inner in value.items()}
+    if isinstance(value, list):
+        return [_floats_to_decimal(inner) for inner in value]
+    return value
+
+def compile_schema(schema=None):
+    """Validator/coercer of a schema (None = generic): item → item, or raises RecordRejected"""
+    value_field = schema.value_field if schema is not None else None
+    minimum = schema.minimum if schema is not None else None
+    maximum = schema.maximum if schema is not None else None
+    text_fields = schema.text_fields if schema is not None else ()
+    checked = frozenset(KEY_FIELDS + OPTIONAL_KEY_FIELDS + text_fields + ((value_field,) if value_field else ()))
+
+    def validate(item):
+        problems = []
+        for name in KEY_FIELDS:
+            value = item.get(name)
+            if value is None or value == '':
+                problems.append(f"missing {name}")
+            elif not isinstance(value, str):
+                item[name] = str(value)
+        for name in OPTIONAL_KEY_FIELDS:
+            value = item.get(name)
+            if value is not None and not isinstance(value, str):
+                item[name] = value = str(value)
+            if value == '':
+                problems.append(f"empty {name}")
+
+        if value_field is not None:
+            value = item.get(value_field)
+            number = _number(value)
+            if value is None:
+                problems.append(f"missing {value_field}")
+            elif number is None:
+                problems.append(f"{value_field} is not a finite number: {value!r}")
+            else:
+                if number is not value:
+                    item[value_field] = number
+                if minimum is not None and number < minimum:
+                    problems.append(f"{value_field} {number} below {minimum:g}")
+                elif maximum is not None and number > maximum:
+                    problems.append(f"{value_field} {number} above {maximum:g}")
+
+        for name in text_fields:
+            value = item.get(name)
+            if value is not None and not isinstance(value, str):
+                item[name] = str(value)
+
+        for name, value in item.items():
+            if name not in checked and _has_float(value):
+                try:
+                    item[name] = _floats_to_decimal(value)
+                except ValueError as e:
+                    problems.append(f"{name}: {e}")
+
+        if problems:
+            raise RecordRejected(problems)
+        return item
+
+    return validate
+
+def validator_for(sensor_type):
+    """Compiled validator of a sensor type, built on first use"""
+    validator = _validators.get(sensor_type)
+    if validator is None:
+        validator = _validators[sensor_type] = compile_schema(SCHEMAS.get(sensor_type))
+    return validator
+
+def validate(item, sensor_type):
+    return validator_for(sensor_type)(item)
+
+def resolve_sensor_type(key):
+    """Sensor type of an S3 key: its `sensors/<type>/` prefix, else a path segment or name containing a type"""
+    if key.startswith(KEY_PREFIX):
+        end = key.find('/', len(KEY_PREFIX))
+        if end != -1:
+            sensor_type = _prefixes.get(key[:end + 1])
+            if sensor_type is not None:
+                return sensor_type
+    lowered = key.lower()
+    for segment in lowered.split('/')[:-1]:
+        if segment in SCHEMAS:
+            return segment
+    # Keys outside the sensors/<type>/ layout, e.g. "archive/co2_2024.json"
+    for sensor_type in SCHEMAS:
+        if sensor_type in lowered:
+            return sensor_type
+    return UNKNOWN
+
+def _register_defaults():
+    overrides = parse_ranges(os.environ.get('SCHEMA_RANGES', ''))
+    for sensor_type, profile in PROFILES.items():
+        minimum, maximum = overrides.get(sensor_type, DEFAULT_RANGES.get(sensor_type, (None, None)))
+        register_schema(Schema(sensor_type, profile.value_field, minimum, maximum))
+
+_register_defaults()
@@ -0,0 +1,42 @@
+"""
+Write-sharded DateIndex keys.
+
+DateIndex is hashed on `reading_date`, so with a plain 'YYYY-MM-DD' value every
+write of a day lands on one GSI partition. Items instead carry
+`YYYY-MM-DD#<shard>`, where the shard is a stable CRC32 of the device id modulo
+DATE_INDEX_SHARDS: a device always maps to the same shard, writes spread over
+all shards, and a date reader fans out one Query per shard.
+
+Items written before sharding still carry the bare date. Readers include it as
+an extra "shard" while DATE_INDEX_LEGACY_READS is on (the default), until
+tools/migrate_date_shards.py has rewritten them. The shard count may only grow:
+a reader configured with N shards still covers items written with fewer.
+"""
+import os
+import zlib
+
+DATE_INDEX_SHARDS = int(os.environ.get('DATE_INDEX_SHARDS', '8'))
+DATE_INDEX_LEGACY_READS = os.environ.get('DATE_INDEX_LEGACY_READS', 'true').lower() == 'true'
+SHARD_SEPARATOR = '#'
+
+def shard_for(device_id, shards=DATE_INDEX_SHARDS):
+    """Deterministic shard of a device (the same in every process, unlike hash())"""
+    return zlib.crc32(str(device_id).encode('utf-8')) % shards
+
+def sharded_date(reading_date, device_id, shards=DATE_INDEX_SHARDS):
+    """`reading_date` value for an item: 'YYYY-MM-DD#<shard>'"""
+    return f"{reading_date}{SHARD_SEPARATOR}{shard_for(device_id, shards)}"
+
+def is_sharded(value):
+    return SHARD_SEPARATOR in str(value)
+
+def base_date(value):
+    """The date part of a (possibly sharded) reading_date"""
+    return str(value).split(SHARD_SEPARATOR, 1)[0]
+
+def date_keys(reading_date, shards=DATE_INDEX_SHARDS, include_legacy=DATE_INDEX_LEGACY_READS):
+    """Every DateIndex hash key a reader must query for one date"""
+    keys = [f"{reading_date}{SHARD_SEPARATOR}{shard}" for shard in range(shards)]
+    if include_legacy:
+        keys.append(str(reading_date))
+    return keys
@@ -0,0 +1,68 @@
+"""
+Time-ordered reading sort keys.
+
+A reading's `timestamp` range key is derived from the reading itself:
+
+    timestamp = '<observed epoch millis, zero-padded to 13 digits>#<suffix>'
+    e.g.        '1714521600123#5f0c2a91'
+
+The prefix is the time the reading was taken (its `reading_time`, else its
+numeric epoch-millis timestamp), so a device's items sort by time and "the last
+hour of device X" is a key-condition Query. The suffix is a short digest of the
+value the reading arrived with (the IoT rule's timestamp(), the device's own
+key, or the processor's stable fallback key), which keeps readings of the same
+millisecond apart and maps every redelivery of a reading to the same item.
+
+Bounds for a time range are bare prefixes: lower_bound(ms) sorts before every
+key of that millisecond and upper_bound(ms) after them, so
+`#ts BETWEEN lower_bound(start) AND upper_bound(end)` covers [start, end].
+Keys written before this layout (bare epoch millis, request ids, digests) are
+rewritten by tools/migrate_sort_keys.py.
+"""
+import calendar
+import hashlib
+import re
+
+KEY_SEPARATOR = '#'
+EPOCH_DIGITS = 13
+SUFFIX_LENGTH = 8
+# Sorts after the separator and every suffix character
+UPPER_SENTINEL = '~'
+MAX_EPOCH_MS = 10 ** EPOCH_DIGITS - 1
+
+_SORT_KEY = re.compile(r'^\d{%d}%s[0-9a-f]{%d}$' % (EPOCH_DIGITS, KEY_SEPARATOR, SUFFIX_LENGTH))
+
+def in_range(epoch_ms):
+    """Whether epoch millis fit the fixed-width prefix (1970 to 2286)"""
+    return 0 <= epoch_ms <= MAX_EPOCH_MS
+
+def suffix(source):
+    return hashlib.sha1(str(source).encode('utf-8')).hexdigest()[:SUFFIX_LENGTH]
+
+def sort_key(epoch_ms, source):
+    """Sort key of a reading taken at `epoch_ms` that arrived with key `source`; a sort key passes through"""
+    if is_sort_key(source):
+        return source
+    if not in_range(epoch_ms):
+        raise ValueError(f"Epoch millis out of the sort key range: {epoch_ms}")
+    return f"{epoch_ms:0{EPOCH_DIGITS}d}{KEY_SEPARATOR}{suffix(source)}"
+
+def datetime_key(moment, source):
+    """sort_key() of a reading taken at `moment` (naive UTC datetime)"""
+    return sort_key(calendar.timegm(moment.timetuple()) * 1000 + moment.microsecond // 1000, source)
+
+def is_sort_key(value):
+    return isinstance(value, str) and _SORT_KEY.match(value) is not None
+
+def key_epoch_ms(value):
+    """Epoch millis of a sort key or of a bare epoch-millis key, else None"""
+    prefix = str(value).split(KEY_SEPARATOR, 1)[0]
+    if prefix.isdigit() and len(prefix) >= 12:
+        return int(prefix)
+    return None
+
+def lower_bound(epoch_ms):
+    return f"{max(0, epoch_ms):0{EPOCH_DIGITS}d}"
+
+def upper_bound(epoch_ms):
+    return f"{min(epoch_ms, MAX_EPOCH_MS):0{EPOCH_DIGITS}d}{UPPER_SENTINEL}"
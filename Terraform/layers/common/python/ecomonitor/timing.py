@@ -0,0 +1,185 @@
+"""
+Per-stage hot-path timing.
+
+A StageTimer collects the durations of named stages of one invocation
+(`with timer.stage('s3_get'):` or `@timer.timed('json_parse')`) and, when the
+invocation ends, adds p50/p95/max per stage to a MetricsBuffer:
+
+    StageLatencyP50{Function, Stage}    milliseconds
+    StageLatencyP95{Function, Stage}
+    StageLatencyMax{Function, Stage}
+    StageCount{Function, Stage}         samples in the invocation
+
+Samples are plain floats appended to a per-stage list (appends are atomic, so
+stages may be timed from worker threads); percentiles are only computed once
+per invocation. The metrics flush of an invocation cannot time itself, so the
+`metrics_flush` stage reports the previous invocation's flush.
+
+With TIMING_PROFILE=true every invocation also runs under cProfile: the top
+TIMING_PROFILE_TOP functions by cumulative time are logged and, with
+TIMING_PROFILE_DIR set, the raw stats are written there for snakeviz/pstats.
+TIMING_ENABLED=false turns stage timing into a no-op.
+"""
+import cProfile
+import functools
+import io
+import logging
+import math
+import os
+import pstats
+import time
+
+logger = logging.getLogger()
+
+TIMING_ENABLED = os.environ.get('TIMING_ENABLED', 'true').lower() == 'true'
+TIMING_PROFILE = os.environ.get('TIMING_PROFILE', 'false').lower() == 'true'
+TIMING_PROFILE_TOP = int(os.environ.get('TIMING_PROFILE_TOP', '25'))
+TIMING_PROFILE_DIR = os.environ.get('TIMING_PROFILE_DIR')
+
+DEFAULT_NAMESPACE = 'EcoMonitor/DataPipeline'
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return 0.0
+    return ordered[max(0, min(len(ordered), math.ceil(pct / 100.0 * len(ordered))) - 1)]
+
+class _Stage:
+    """Context manager timing one stage (a class rather than a generator: cheaper to enter)"""
+    __slots__ = ('samples', 'clock', 'started')
+
+    def __init__(self, samples, clock):
+        self.samples = samples
+        self.clock = clock
+
+    def __enter__(self):
+        self.started = self.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.samples.append((self.clock() - self.started) * 1000)
+        return False
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_NO_STAGE = _NoStage()
+
+class StageTimer:
+    """Stage durations of the current invocation, exported as percentiles"""
+
+    def __init__(self, metrics, function=None, namespace=DEFAULT_NAMESPACE, enabled=TIMING_ENABLED,
+                 profile=TIMING_PROFILE, clock=time.perf_counter):
+        self.metrics = metrics
+        self.function = function or os.environ.get('AWS_LAMBDA_FUNCTION_NAME', 'local')
+        self.namespace = namespace
+        self.enabled = enabled
+        self.profile = profile
+        self._clock = clock
+        self._samples = {}
+
+    def reset(self):
+        self._samples = {}
+
+    def _stage_samples(self, name):
+        samples = self._samples.get(name)
+        if samples is None:
+            samples = self._samples.setdefault(name, [])
+        return samples
+
+    def stage(self, name):
+        """`with timer.stage(name):` adds the block's duration to the stage"""
+        if not self.enabled:
+            return _NO_STAGE
+        return _Stage(self._stage_samples(name), self._clock)
+
+    def add(self, name, elapsed_ms):
+        """Record a duration measured elsewhere"""
+        if self.enabled:
+            self._stage_samples(name).append(elapsed_ms)
+
+    def timed(self, name):
+        """Decorator timing every call of a function as stage `name`"""
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = self._clock()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._stage_samples(name).append((self._clock() - started) * 1000)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """{stage: {'count', 'p50_ms', 'p95_ms', 'max_ms', 'total_ms'}} of the current invocation"""
+        result = {}
+        for name, samples in list(self._samples.items()):
+            ordered = sorted(samples)
+            if not ordered:
+                continue
+            result[name] = {
+                'count': len(ordered),
+                'p50_ms': round(percentile(ordered, 50), 3),
+                'p95_ms': round(percentile(ordered, 95), 3),
+                'max_ms': round(ordered[-1], 3),
+                'total_ms': round(sum(ordered), 3),
+            }
+        return result
+
+    def record_metrics(self):
+        """Add the per-stage percentiles of this invocation to the metrics buffer"""
+        last_flush_ms = getattr(self.metrics, 'last_flush_ms', None)
+        if last_flush_ms is not None:
+            self.add('metrics_flush', last_flush_ms)
+        summary = self.summary()
+        for name, stats in summary.items():
+            dimensions = [{'Name': 'Function', 'Value': self.function}, {'Name': 'Stage', 'Value': name}]
+            self.metrics.put('StageLatencyP50', stats['p50_ms'], 'Milliseconds', dimensions, namespace=self.namespace)
+            self.metrics.put('StageLatencyP95', stats['p95_ms'], 'Milliseconds', dimensions, namespace=self.namespace)
+            self.metrics.put('StageLatencyMax', stats['max_ms'], 'Milliseconds', dimensions, namespace=self.namespace)
+            self.metrics.put('StageCount', stats['count'], 'Count', dimensions, namespace=self.namespace)
+        return summary
+
+    def instrument(self, handler):
+        """
+        Handler decorator: starts a fresh set of stages, optionally profiles the
+        call, and adds the stage metrics before the (outer) metrics flush.
+        Apply it inside @metrics.flush_after.
+        """
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            self.reset()
+            profiler = None
+            if self.profile:
+                profiler = cProfile.Profile()
+                profiler.enable()
+            try:
+                with self.stage('handler'):
+                    return handler(event, context)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                    self._report_profile(profiler, getattr(context, 'aws_request_id', None))
+                if self.enabled:
+                    self.record_metrics()
+        return wrapper
+
+    def _report_profile(self, profiler, request_id):
+        try:
+            if TIMING_PROFILE_DIR:
+                os.makedirs(TIMING_PROFILE_DIR, exist_ok=True)
+                profiler.dump_stats(os.path.join(TIMING_PROFILE_DIR, f"{self.function}-{request_id or int(time.time() * 1000)}.prof"))
+            output = io.StringIO()
+            pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(TIMING_PROFILE_TOP)
+            logger.info(f"🔬 [PROFILE] {self.function} {request_id or ''}\n{output.getvalue()}")
+        except Exception as e:
+            logger.warning(f"⚠️ [PROFILE] Could not report profile: {str(e)}")
@@ -0,0 +1,69 @@
+"""
+Variable-length integer primitives shared by the binary codecs (ecomonitor.packed,
+ecomonitor.envelope).
+
+Unsigned integers are LEB128 varints (7 bits per byte, high bit = more bytes
+follow); signed integers are zigzag-mapped first so small negative deltas stay
+small. Decimal readings are stored as integers scaled by 10**scale, where the
+scale is the fewest decimal places that represent every value of a column
+exactly (FLOAT_SCALE marks a float64 column instead).
+"""
+from decimal import Decimal
+
+MAX_SCALE = 6  # decimal places kept exactly; more falls back to float64
+FLOAT_SCALE = 255
+
+def write_varint(out, value):
+    """Append an unsigned varint to a bytearray"""
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, offset):
+    """(value, next offset) of the varint at `offset`"""
+    result = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, offset
+        shift += 7
+
+def write_string(out, value):
+    """Append a length-prefixed UTF-8 string"""
+    encoded = value.encode('utf-8')
+    write_varint(out, len(encoded))
+    out.extend(encoded)
+
+def read_string(data, offset):
+    length, offset = read_varint(data, offset)
+    return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+def as_decimal(value):
+    return Decimal(repr(value)) if isinstance(value, float) else value if isinstance(value, Decimal) else Decimal(value)
+
+def scale_of(values):
+    """Decimal places that represent every value exactly, or FLOAT_SCALE"""
+    scale = 0
+    for value in values:
+        value = as_decimal(value)
+        if not value.is_finite():
+            return FLOAT_SCALE
+        exponent = value.normalize().as_tuple().exponent
+        if exponent < 0:
+            scale = max(scale, -exponent)
+        if scale > MAX_SCALE:
+            return FLOAT_SCALE
+    return scale
+
+def scaled(value, scale):
+    """Integer value * 10**scale of a value whose scale_of() is at most `scale`"""
+    return int(as_decimal(value).scaleb(scale))
@@ -70,6 +70,29 @@ resource "aws_s3_bucket_notification" "bucket_notification" {
     filter_suffix       = ".json"
   }
 
+  # Gateway batch files (newline-delimited JSON, optionally gzipped) are streamed by the same processor
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.s3_to_dynamo_function.arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "sensors/"
+    filter_suffix       = ".ndjson"
+  }
+
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.s3_to_dynamo_function.arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "sensors/"
+    filter_suffix       = ".ndjson.gz"
+  }
+
+  # Multi-reading envelopes published by the fleet simulator
+  lambda_function {
+    lambda_function_arn = aws_lambda_function.s3_to_dynamo_function.arn
+    events              = ["s3:ObjectCreated:*"]
+    filter_prefix       = "sensors/envelope/"
+    filter_suffix       = ".emv"
+  }
+
   depends_on = [
     aws_lambda_permission.allow_s3
   ]
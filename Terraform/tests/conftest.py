@@ -0,0 +1,6 @@
+"""Put the shared Lambda layer (ecomonitor) on the path, as the Lambda runtime does"""
+import os
+import sys
+
+TERRAFORM_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python'))
@@ -0,0 +1,126 @@
+"""AIMD behaviour of the write scheduler (ecomonitor.capacity) on an injected clock"""
+import pytest
+
+from ecomonitor import capacity
+from ecomonitor.capacity import TABLE, WriteScheduler, WritesDeferred
+
+
+class FakeClock:
+    """Monotonic clock that only moves when the scheduler sleeps (or the test advances it)"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+
+class Throttled(Exception):
+    def __init__(self):
+        super().__init__('Throttled')
+        self.response = {'Error': {'Code': 'ProvisionedThroughputExceededException'}}
+
+
+def scheduler(clock, **kwargs):
+    # 20 WCU on the table and 10 on DateIndex, as provisioned
+    return WriteScheduler({TABLE: 20, 'DateIndex': 10}, {'DateIndex': 'reading_date'}, share=0.9,
+                          increase=0.5, decrease=0.5, clock=clock, sleep=clock.sleep, **kwargs)
+
+
+def accepted(**kwargs):
+    return {'ConsumedCapacity': {'Table': {'CapacityUnits': 1.0}}}
+
+
+def test_rates_start_at_the_provisioned_share():
+    assert scheduler(FakeClock()).rates() == {TABLE: 18.0, 'DateIndex': 9.0}
+
+
+def test_throttle_cuts_the_rates_once_per_burst_and_writes_recover_them():
+    clock = FakeClock()
+    writes = scheduler(clock)
+    writes.throttled()
+    writes.throttled()  # same burst: no second cut
+    assert writes.rates() == {TABLE: 9.0, 'DateIndex': 4.5}
+    assert writes.stats['throttles'] == 2
+
+    clock.sleep(capacity.DECREASE_INTERVAL)
+    writes.throttled()
+    assert writes.rates() == {TABLE: 4.5, 'DateIndex': 2.25}
+
+    # Additive increase per accepted item, capped at the ceilings
+    for _ in range(4):
+        writes.call(accepted)
+    assert writes.rates() == {TABLE: 6.5, 'DateIndex': 4.25}
+    for _ in range(40):
+        writes.call(accepted)
+    assert writes.rates() == {TABLE: 18.0, 'DateIndex': 9.0}
+
+
+def test_rates_never_drop_below_the_minimum():
+    clock = FakeClock()
+    writes = scheduler(clock)
+    for _ in range(10):
+        writes.throttled()
+        clock.sleep(capacity.DECREASE_INTERVAL)
+    assert writes.rates() == {TABLE: capacity.MIN_RATE, 'DateIndex': capacity.MIN_RATE}
+
+
+def test_throttled_write_is_retried_after_a_backoff():
+    clock = FakeClock()
+    writes = scheduler(clock)
+    outcomes = [Throttled(), Throttled(), accepted()]
+
+    def put_item(**kwargs):
+        assert kwargs['ReturnConsumedCapacity'] == 'INDEXES'
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    started = clock.now
+    assert writes.call(put_item, Item={'device_id': 'd1'}) == accepted()
+    assert writes.stats['throttles'] == 2 and writes.stats['writes'] == 1
+    assert clock.now - started == pytest.approx(writes.stats['waited_seconds'])
+    assert writes.rates()[TABLE] < 18.0
+
+
+def test_write_still_throttled_after_max_defer_is_deferred():
+    clock = FakeClock()
+    writes = scheduler(clock, max_defer=5)
+
+    def put_item(**kwargs):
+        raise Throttled()
+
+    with pytest.raises(WritesDeferred):
+        writes.call(put_item, Item={'device_id': 'd1'})
+    assert writes.stats['writes'] == 0
+
+
+def test_other_errors_are_not_retried():
+    writes = scheduler(FakeClock())
+    calls = []
+
+    def put_item(**kwargs):
+        calls.append(kwargs)
+        raise KeyError('device_id')
+
+    with pytest.raises(KeyError):
+        writes.call(put_item)
+    assert len(calls) == 1 and writes.stats['throttles'] == 0
+
+
+def test_consumed_capacity_feedback_raises_the_item_estimate():
+    writes = scheduler(FakeClock())
+    for _ in range(20):
+        writes.call(lambda **kwargs: {'ConsumedCapacity': {'Table': {'CapacityUnits': 3.0}}})
+    assert writes.costs[TABLE] == pytest.approx(3.0, abs=0.05)
+    assert writes.batch_size(25) == 6  # an 18-unit bucket admits six 3-unit items at once
+
+
+def test_items_consume_the_pools_of_the_indexes_they_carry():
+    writes = scheduler(FakeClock())
+    assert writes.pools_for({'device_id': 'd1', 'reading_date': '2024-05-01#3'}) == [TABLE, 'DateIndex']
+    assert writes.pools_for({'device_id': '#latest#3'}) == [TABLE]
@@ -0,0 +1,79 @@
+"""Round-trips of the multi-reading envelope (ecomonitor.envelope)"""
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from ecomonitor import envelope
+
+BASE_MS = 1714521600000
+
+
+def fleet_builder():
+    builder = envelope.EnvelopeBuilder('batch-7')
+    builder.add('temp-001', 'temperature', Decimal('21.5'), BASE_MS, location='lab', unit='C')
+    builder.add('co2-001', 'co2', 415, BASE_MS + 1000)
+    builder.add('temp-001', 'temperature', Decimal('-3.25'), BASE_MS + 500, location='lab', unit='C')
+    builder.add('hum-001', 'humidity', Decimal('48'), datetime.datetime(2024, 5, 1, 0, 0, 2), unit='%')
+    builder.add('co2-001', 'co2', 420, BASE_MS + 1000)
+    return builder
+
+
+def expected_documents():
+    return [
+        {'device_id': 'temp-001', 'temperature': 21.5, 'unit': 'C', 'timestamp': str(BASE_MS),
+         'reading_time': '2024-05-01T00:00:00.000', 'location': 'lab', 'sensor_type': 'temperature'},
+        {'device_id': 'co2-001', 'co2': 415, 'timestamp': str(BASE_MS + 1000),
+         'reading_time': '2024-05-01T00:00:01.000', 'sensor_type': 'co2'},
+        {'device_id': 'temp-001', 'temperature': -3.25, 'unit': 'C', 'timestamp': str(BASE_MS + 500),
+         'reading_time': '2024-05-01T00:00:00.500', 'location': 'lab', 'sensor_type': 'temperature'},
+        {'device_id': 'hum-001', 'humidity': 48, 'unit': '%', 'timestamp': str(BASE_MS + 2000),
+         'reading_time': '2024-05-01T00:00:02.000', 'sensor_type': 'humidity'},
+        # Same device and millisecond: the repeat gets its own sort key
+        {'device_id': 'co2-001', 'co2': 420, 'timestamp': f"{BASE_MS + 1000}-1",
+         'reading_time': '2024-05-01T00:00:01.000', 'sensor_type': 'co2'},
+    ]
+
+
+def test_binary_round_trip_of_a_multi_device_envelope():
+    body = fleet_builder().encode()
+    assert envelope.is_binary_envelope(body)
+    documents = envelope.decode(body)
+    assert documents == expected_documents()
+    assert all(isinstance(document[envelope.value_field(document['sensor_type'])], Decimal) for document in documents)
+
+
+def test_json_fallback_round_trip():
+    document = json.loads(fleet_builder().encode_json())
+    assert envelope.is_json_envelope(document)
+    assert envelope.decode_json(document) == expected_documents()
+
+
+def test_float_values_beyond_the_exact_scale():
+    builder = envelope.EnvelopeBuilder()
+    builder.add('aqi-001', 'aqi', 1.23456789, BASE_MS)
+    builder.add('aqi-001', 'aqi', -0.5, BASE_MS + 1)
+    assert [document['aqi'] for document in envelope.decode(builder.encode())] == [Decimal('1.23456789'), Decimal('-0.5')]
+
+
+def test_missing_value_is_rejected_when_added():
+    builder = envelope.EnvelopeBuilder()
+    with pytest.raises(ValueError):
+        builder.add('temp-001', 'temperature', None, BASE_MS)
+    assert len(builder) == 0
+
+
+def test_pack_splits_by_reading_count_in_input_order():
+    readings = [(f"temp-{position:03d}", 'temperature', position, BASE_MS + position, None, 'C') for position in range(5)]
+    messages = envelope.pack(readings, 'run', max_readings=2)
+    assert [group for _, group in messages] == [readings[0:2], readings[2:4], readings[4:5]]
+    decoded = [document['device_id'] for payload, _ in messages for document in envelope.decode(payload)]
+    assert decoded == [device_id for device_id, *_ in readings]
+
+
+def test_other_payloads_are_rejected():
+    with pytest.raises(ValueError):
+        envelope.decode(b'{"device_id": "temp-001"}')
+    with pytest.raises(ValueError):
+        envelope.decode_json({'envelope': 2, 'devices': [], 'readings': []})
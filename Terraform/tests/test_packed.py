@@ -0,0 +1,55 @@
+"""Round-trips of the packed chunk codec (ecomonitor.packed)"""
+from decimal import Decimal
+
+import pytest
+
+from ecomonitor import packed
+from ecomonitor.varint import FLOAT_SCALE
+
+BASE_MS = 1714521600000
+
+
+def round_trip(timestamps, values):
+    decoded_timestamps, decoded_values = packed.decode_chunk(packed.encode_chunk(timestamps, values))
+    return list(decoded_timestamps), list(decoded_values)
+
+
+def test_mixed_sign_and_scale_decimals():
+    values = [Decimal('-12.5'), Decimal('0'), Decimal('3'), Decimal('-0.001'), Decimal('1000.25'), Decimal('-7')]
+    timestamps = [BASE_MS + position * 60000 for position in range(len(values))]
+    assert round_trip(timestamps, values) == (timestamps, [float(value) for value in values])
+
+
+def test_out_of_order_timestamps_keep_their_order():
+    timestamps = [BASE_MS + 5000, BASE_MS, BASE_MS + 120000, BASE_MS + 1, BASE_MS + 5000]
+    values = [Decimal('1.5'), Decimal('-2'), Decimal('3.25'), Decimal('4'), Decimal('5.5')]
+    assert round_trip(timestamps, values) == (timestamps, [float(value) for value in values])
+
+
+def test_values_beyond_max_scale_fall_back_to_float64():
+    values = [Decimal('0.1234567'), Decimal('-98.7654321'), 2.5]
+    data = packed.encode_chunk([BASE_MS, BASE_MS + 1, BASE_MS + 2], values)
+    assert data[3] == FLOAT_SCALE
+    assert packed.decode_chunk(data)[1].tolist() == [float(value) for value in values]
+
+
+def test_empty_chunk():
+    assert round_trip([], []) == ([], [])
+
+
+def test_mismatched_lengths_are_rejected():
+    with pytest.raises(ValueError):
+        packed.encode_chunk([BASE_MS], [])
+
+
+def test_other_bytes_are_rejected():
+    with pytest.raises(ValueError):
+        packed.decode_chunk(b'EMV\x01')
+
+
+def test_item_decodes_in_time_order_with_the_last_value_per_timestamp():
+    first = packed.encode_chunk([BASE_MS + 2000, BASE_MS], [Decimal('2'), Decimal('1')])
+    redelivered = packed.encode_chunk([BASE_MS + 2000, BASE_MS + 1000], [Decimal('2.5'), Decimal('-1.5')])
+    timestamps, values = packed.decode_item({'chunks': [first, redelivered]})
+    assert list(timestamps) == [BASE_MS, BASE_MS + 1000, BASE_MS + 2000]
+    assert list(values) == [1.0, -1.5, 2.5]
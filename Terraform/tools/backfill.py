@@ -0,0 +1,320 @@
+"""
+Replay the raw `sensors/` archive into DynamoDB.
+
+The S3 trigger only sees new objects, so after a processor fix or schema
+change this tool reprocesses a date range of the archive. The range is split
+into slices (one sensor type × `--slice-hours` each, with the multi-reading
+envelopes under sensors/envelope/ as one more source); every slice lists its own
+keys with a paginated StartAfter listing, so listing runs in parallel across
+slices. Slices are spread over a process pool, and each worker fetches its
+objects concurrently, runs them through the processor's own parse/transform
+code (s3_to_dynamo) and writes them with BatchWriteItem.
+
+Readings keep the key the S3 trigger would have given them (the fallback
+timestamp is derived from the object key/ETag and payload, and readings without
+a time of their own are timed by the object's epoch-ms name), so a replay
+overwrites instead of duplicating. Rollups are additive and would count a
+replayed reading twice, so they are only maintained with --rollups (for ranges
+that were never ingested). Anomaly detection is skipped: replayed history would
+be compared against the live per-device state. Readings the schemas reject
+are only counted (`rejected`): the live trigger already dead-lettered them.
+
+Completed slices are recorded in a checkpoint file; re-running the same command
+resumes where the previous run stopped.
+
+Usage (from Terraform/):
+    python tools/backfill.py --bucket ecomonitor-raw-b01006432 --table ecomonitor_processed_data \
+        --start 2024-01-01 --end 2025-01-01 --workers 8 --rate 2000 --checkpoint backfill.json
+"""
+import argparse
+import datetime
+import io
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.dirname(TOOLS_DIR)
+sys.path[:0] = [
+    os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python'),
+    os.path.join(TERRAFORM_DIR, 'data cleaner'),
+]
+
+from ecomonitor import idempotency
+from ecomonitor.ratelimit import TokenBucket
+
+SOURCE_PREFIX = os.environ.get('COMPACTION_SOURCE_PREFIX', 'sensors/')
+# Source prefixes under sensors/; 'envelope' holds multi-reading envelopes of every type
+SENSOR_TYPES = ['temperature', 'humidity', 'aqi', 'co2', 'envelope']
+HOUR_MS = 3600 * 1000
+
+FETCH_CONCURRENCY = int(os.environ.get('BACKFILL_FETCH_CONCURRENCY', '32'))
+WRITE_CONCURRENCY = int(os.environ.get('BACKFILL_WRITE_CONCURRENCY', '4'))
+# Keys fetched and written together, bounding a worker's memory on dense slices
+KEY_BATCH_SIZE = int(os.environ.get('BACKFILL_KEY_BATCH_SIZE', '1000'))
+
+_processor = None
+_write_bucket = None
+
+def to_epoch_ms(moment):
+    return int(moment.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+
+def key_epoch_ms(key):
+    """Epoch millis encoded in sensors/<type>/<epoch_ms>.<ext> or sensors/envelope/<epoch_ms>-<uuid>.emv, or None"""
+    stem = key.rsplit('/', 1)[-1].split('.', 1)[0].split('-', 1)[0]
+    return int(stem) if stem.isdigit() else None
+
+def slices(start, end, sensor_types, slice_hours):
+    """(slice id, sensor type, start_ms, end_ms) covering [start, end) for every sensor type"""
+    start_ms, end_ms = to_epoch_ms(start), to_epoch_ms(end)
+    step = slice_hours * HOUR_MS
+    return [
+        (f"{sensor_type}/{slice_start}", sensor_type, slice_start, min(slice_start + step, end_ms))
+        for sensor_type in sensor_types
+        for slice_start in range(start_ms, end_ms, step)
+    ]
+
+def list_slice_objects(s3, bucket, sensor_type, start_ms, end_ms):
+    """(key, etag) of the objects whose epoch-ms name falls in [start_ms, end_ms)"""
+    prefix = f"{SOURCE_PREFIX}{sensor_type}/"
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'StartAfter': f"{prefix}{start_ms}"}
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        for entry in response.get('Contents', []):
+            epoch_ms = key_epoch_ms(entry['Key'])
+            if epoch_ms is None:
+                continue
+            if epoch_ms >= end_ms:
+                return
+            if epoch_ms >= start_ms:
+                yield entry['Key'], entry.get('ETag', '').strip('"')
+        if not response.get('IsTruncated'):
+            return
+        kwargs.pop('StartAfter', None)
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+def load_processor(table_name=None, rollups=False):
+    """Import s3_to_dynamo once per process, configured for replay"""
+    global _processor
+    if _processor is None:
+        if table_name:
+            os.environ['DYNAMODB_TABLE_NAME'] = table_name
+        import s3_to_dynamo
+        # Per-object INFO logging would dominate a replay of millions of objects
+        s3_to_dynamo.logger.setLevel(logging.WARNING)
+        s3_to_dynamo.ROLLUPS_ENABLED = rollups
+        s3_to_dynamo.ANOMALY_DETECTION_ENABLED = False
+        _processor = s3_to_dynamo
+    return _processor
+
+def init_worker(table_name, rollups, rate):
+    """Process pool initializer; `rate` is this worker's share of the write rate"""
+    global _write_bucket
+    load_processor(table_name, rollups)
+    _write_bucket = TokenBucket(rate)
+
+def transform_object(processor, bucket, key, etag, body, sensor_type, counters):
+    """Items of one archived object, transformed exactly as the S3 trigger would"""
+    identity = f"{bucket}/{key}@{etag}"
+    detected = processor.detect_sensor_type(key)
+    sensor_type = sensor_type if detected == 'unknown' else detected
+    moment = datetime.datetime.utcfromtimestamp(key_epoch_ms(key) / 1000.0)
+    if processor.is_stream_key(key):
+        lines = processor.open_line_stream(io.BytesIO(body))
+        fallback_prefix = idempotency.stable_reading_key(identity, b'')
+        return list(processor.iter_stream_items(lines, key, sensor_type, fallback_prefix, counters, received_at=moment))
+    documents, _ = processor.parse_documents(body)
+    counters['readings'] += len(documents)
+    fallback_timestamp = idempotency.stable_reading_key(identity, body)
+    items, rejected = processor.transform_documents(documents, key, sensor_type, fallback_timestamp, moment)
+    counters['rejected'] += len(rejected)
+    return items
+
+def write_chunk(processor, items):
+    """Rate-limited BatchWriteItem of one chunk plus the derived latest/rollup state"""
+    if _write_bucket is not None:
+        _write_bucket.acquire(len(items))
+    unprocessed, invalid = processor.batch_write_items(items)
+    failed_keys = {processor.item_key(item) for item in unprocessed} | {processor.item_key(item) for item, _ in invalid}
+    processor.record_written([item for item in items if processor.item_key(item) not in failed_keys])
+    return len(items) - len(failed_keys), len(failed_keys)
+
+def backfill_slice(bucket, slice_id, sensor_type, start_ms, end_ms):
+    """List, fetch, transform and write one slice. Returns its counters."""
+    started = time.perf_counter()
+    processor = load_processor()
+    s3 = processor.s3_client
+    counters = {'slice': slice_id, 'objects': 0, 'readings': 0, 'malformed': 0, 'rejected': 0, 'errors': 0, 'written': 0, 'failed': 0, 'bytes': 0}
+
+    def fetch(entry):
+        key, etag = entry
+        try:
+            return key, etag, s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+        except Exception as e:
+            processor.logger.error(f"❌ [BACKFILL] Could not read {key}: {str(e)}")
+            return key, etag, None
+
+    def flush(entries):
+        items = {}
+        for key, etag, body in fetch_pool.map(fetch, entries):
+            counters['objects'] += 1
+            if body is None:
+                counters['errors'] += 1
+                continue
+            counters['bytes'] += len(body)
+            try:
+                for item in transform_object(processor, bucket, key, etag, body, sensor_type, counters):
+                    items[processor.item_key(item)] = item
+            except Exception as e:
+                counters['errors'] += 1
+                processor.logger.error(f"❌ [BACKFILL] Skipping {key}: {str(e)}")
+        chunks = processor.iter_chunks(items.values(), processor.BATCH_WRITE_SIZE)
+        for written, failed in write_pool.map(lambda chunk_items: write_chunk(processor, chunk_items), chunks):
+            counters['written'] += written
+            counters['failed'] += failed
+
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as fetch_pool, \
+            ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as write_pool:
+        pending = []
+        for entry in list_slice_objects(s3, bucket, sensor_type, start_ms, end_ms):
+            pending.append(entry)
+            if len(pending) >= KEY_BATCH_SIZE:
+                flush(pending)
+                pending = []
+        if pending:
+            flush(pending)
+    # Derived writes deferred under throttling are owed by this process, not by a redelivery
+    processor.settle_owed_writes()
+
+    counters['elapsed_seconds'] = round(time.perf_counter() - started, 3)
+    return counters
+
+class Checkpoint:
+    """Completed slices of a run, persisted atomically after every slice"""
+
+    def __init__(self, path, parameters):
+        self.path = path
+        self.state = {'parameters': parameters, 'completed': {}}
+        if path and os.path.exists(path):
+            with open(path) as handle:
+                previous = json.load(handle)
+            if previous.get('parameters') != parameters:
+                raise ValueError(f"Checkpoint {path} belongs to a run with different parameters: {previous.get('parameters')}")
+            self.state = previous
+
+    @property
+    def completed(self):
+        return self.state['completed']
+
+    def record(self, counters):
+        self.completed[counters['slice']] = counters
+        if self.path:
+            temporary = f"{self.path}.tmp"
+            with open(temporary, 'w') as handle:
+                json.dump(self.state, handle)
+            os.replace(temporary, self.path)
+
+class Progress:
+    """Periodic one-line progress and throughput report"""
+
+    def __init__(self, total, interval):
+        self.total = total
+        self.interval = interval
+        self.started = time.perf_counter()
+        self.last_report = 0.0
+        self.done = 0
+        self.totals = {'objects': 0, 'written': 0, 'failed': 0, 'errors': 0, 'rejected': 0, 'bytes': 0}
+
+    def add(self, counters):
+        self.done += 1
+        for name in self.totals:
+            self.totals[name] += counters.get(name, 0)
+        now = time.perf_counter()
+        if now - self.last_report >= self.interval or self.done == self.total:
+            self.last_report = now
+            print(self.line(), flush=True)
+
+    def line(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        remaining = (self.total - self.done) * elapsed / self.done if self.done else 0.0
+        return (
+            f"[backfill] {self.done}/{self.total} slices  {self.totals['objects']} objects  "
+            f"{self.totals['written']} written  {self.totals['failed'] + self.totals['errors']} failed  {self.totals['rejected']} rejected  "
+            f"{self.totals['objects'] / elapsed:.0f} objects/s  {self.totals['written'] / elapsed:.0f} items/s  "
+            f"{self.totals['bytes'] / elapsed / 1e6:.1f} MB/s  ETA {remaining:.0f}s"
+        )
+
+def run(bucket, table_name, start, end, sensor_types=SENSOR_TYPES, slice_hours=24, workers=os.cpu_count() or 1,
+        rate=0, rollups=False, checkpoint_path=None, progress_interval=10.0):
+    """Backfill [start, end). Returns (checkpoint, progress)."""
+    parameters = {
+        'bucket': bucket, 'table': table_name, 'start': start.isoformat(), 'end': end.isoformat(),
+        'sensor_types': list(sensor_types), 'slice_hours': slice_hours,
+    }
+    checkpoint = Checkpoint(checkpoint_path, parameters)
+    all_jobs = slices(start, end, sensor_types, slice_hours)
+    jobs = [job for job in all_jobs if job[0] not in checkpoint.completed]
+    progress = Progress(len(jobs), progress_interval)
+    if len(jobs) < len(all_jobs):
+        print(f"[backfill] Resuming: {len(checkpoint.completed)} slices already done, {len(jobs)} to go", flush=True)
+
+    if workers <= 1:
+        init_worker(table_name, rollups, rate)
+        for job in jobs:
+            counters = backfill_slice(bucket, *job)
+            checkpoint.record(counters)
+            progress.add(counters)
+        return checkpoint, progress
+
+    # Each worker gets an equal share of the write rate so the total stays within it
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(table_name, rollups, rate / workers if rate else 0)) as executor:
+        futures = {executor.submit(backfill_slice, bucket, *job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                counters = future.result()
+            except Exception as e:
+                # Failed slices stay out of the checkpoint and are retried by the next run
+                print(f"❌ [backfill] Slice {futures[future][0]} failed: {str(e)}", file=sys.stderr, flush=True)
+                progress.add({'errors': 1})
+                continue
+            checkpoint.record(counters)
+            progress.add(counters)
+    return checkpoint, progress
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the raw S3 sensor archive into DynamoDB")
+    parser.add_argument('--bucket', default=os.environ.get('RAW_BUCKET_NAME'), required=os.environ.get('RAW_BUCKET_NAME') is None)
+    parser.add_argument('--table', default=os.environ.get('DYNAMODB_TABLE_NAME', 'ecomonitor_processed_data'))
+    parser.add_argument('--start', required=True, help='first hour or day, e.g. 2024-01-01')
+    parser.add_argument('--end', required=True, help='end (exclusive)')
+    parser.add_argument('--sensor-types', default=','.join(SENSOR_TYPES))
+    parser.add_argument('--slice-hours', type=int, default=24, help='hours of one sensor type per work unit')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--rate', type=float, default=0, help='total item writes per second (0 = unlimited)')
+    parser.add_argument('--rollups', action='store_true', help='also fold readings into rollups (only for never-ingested ranges)')
+    parser.add_argument('--checkpoint', default='backfill_checkpoint.json', help='resume file ("" disables)')
+    parser.add_argument('--progress-interval', type=float, default=10.0, help='seconds between progress lines')
+    args = parser.parse_args(argv)
+
+    _, progress = run(
+        args.bucket,
+        args.table,
+        datetime.datetime.fromisoformat(args.start),
+        datetime.datetime.fromisoformat(args.end),
+        [sensor_type.strip() for sensor_type in args.sensor_types.split(',') if sensor_type.strip()],
+        args.slice_hours,
+        args.workers,
+        args.rate,
+        args.rollups,
+        args.checkpoint or None,
+        args.progress_interval
+    )
+    print(progress.line())
+    return 0 if progress.totals['errors'] == 0 and progress.totals['failed'] == 0 else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
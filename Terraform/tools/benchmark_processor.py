@@ -0,0 +1,291 @@
+"""
+Local throughput/latency benchmark for the S3 → DynamoDB processor.
+
+Runs `s3_to_dynamo.lambda_handler` in-process against the in-memory stand-ins
+from tools/fakes.py (with injectable latency) across a grid of payload sizes and
+records-per-event batch sizes. For every scenario it reports readings/sec and
+p50/p95/p99 of the object claim, S3 read, JSON parse, type coercion and DynamoDB
+write stages (BatchWriteItem after a per-object claim, named in `write_path`),
+writes the results as JSON and can compare them against a previous run. Log
+output is counted rather than printed, so the log bytes per reading of a given
+--log-level are reported as well.
+
+Usage:
+    python tools/benchmark_processor.py --payload-sizes 256,4096 --batch-sizes 1,25,100 \
+        --s3-latency-ms 5 --ddb-latency-ms 8 --output bench_results.json --compare baseline.json
+"""
+import argparse
+import datetime
+import functools
+import json
+import logging
+import math
+import os
+import platform
+import sys
+import time
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.dirname(TOOLS_DIR)
+sys.path[:0] = [
+    TOOLS_DIR,
+    os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python'),
+    os.path.join(TERRAFORM_DIR, 'data cleaner'),
+]
+
+import fakes
+
+TABLE_NAME = 'ecomonitor_processed_data'
+BUCKET = 'ecomonitor-benchmark'
+
+# Processor functions timed as benchmark stages
+STAGES = {
+    'claim': 'claim_document',
+    's3_read': 'fetch_object',
+    'json_parse': 'parse_sensor_document',
+    'type_coercion': 'transform_sensor_data',
+    'dynamodb_write': 'write_new_readings',
+    'rollups': 'maintain_rollups',
+    'latest': 'maintain_latest',
+}
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+def summarize_samples(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50), 4),
+        'p95_ms': round(percentile(samples, 95), 4),
+        'p99_ms': round(percentile(samples, 99), 4),
+        'max_ms': round(max(samples), 4) if samples else 0.0,
+    }
+
+def load_processor():
+    os.environ.setdefault('DYNAMODB_TABLE_NAME', TABLE_NAME)
+    import s3_to_dynamo
+    return s3_to_dynamo
+
+def install_fakes(processor, args):
+    """Point the processor at fresh in-memory services"""
+    s3 = fakes.FakeS3Client(fakes.LatencyModel(args.s3_latency_ms, args.jitter_ms))
+    dynamodb = fakes.FakeDynamoResource(fakes.LatencyModel(args.ddb_latency_ms, args.jitter_ms), args.unprocessed_rate,
+                                        write_capacity=args.write_capacity)
+    sns = fakes.FakeSNSClient()
+    cloudwatch = fakes.FakeCloudWatchClient(fakes.LatencyModel(args.cw_latency_ms, 0))
+    processor.s3_client = s3
+    processor.dynamodb = dynamodb
+    processor.sns_client = sns
+    processor.metrics._client = cloudwatch
+    processor.TABLE_NAME = TABLE_NAME
+    # Scenarios reuse object keys, so the idempotency cache must not carry over
+    processor.recent_keys.invalidate()
+    # ...and every scenario starts with a fresh write scheduler for its own fake table
+    processor.capacity._schedulers.clear()
+    return s3, dynamodb, cloudwatch
+
+def instrument(processor, timings):
+    """Wrap the stage functions so every call records its duration; returns an undo callable"""
+    originals = {}
+    for stage, attribute in STAGES.items():
+        original = getattr(processor, attribute)
+        originals[attribute] = original
+
+        def timed(*args, _original=original, _samples=timings[stage], **kwargs):
+            started = time.perf_counter()
+            try:
+                return _original(*args, **kwargs)
+            finally:
+                _samples.append((time.perf_counter() - started) * 1000)
+
+        setattr(processor, attribute, functools.wraps(original)(timed))
+
+    def restore():
+        for attribute, original in originals.items():
+            setattr(processor, attribute, original)
+    return restore
+
+class LogVolume(logging.Handler):
+    """Counts the lines and bytes the handler would have written to CloudWatch Logs"""
+
+    def __init__(self):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        self.lines = 0
+        self.bytes = 0
+
+    def emit(self, record):
+        self.lines += 1
+        self.bytes += len(self.format(record).encode('utf-8')) + 1
+
+def make_document(sequence, payload_size):
+    """A temperature reading padded with extra attributes up to roughly `payload_size` bytes"""
+    document = {
+        'device_id': f"bench_sensor_{sequence % 500:04d}",
+        'temperature': round(18.0 + (sequence % 170) / 10.0, 1),
+        'unit': 'Celsius',
+        'category': 'Optimal',
+        'health_status': 'Good',
+        'timestamp': str(1700000000000 + sequence),
+        'reading_time': '2024-01-01T00:00:00',
+        'location': 'EcoMonitor_Zone_A',
+    }
+    base = len(json.dumps(document))
+    extra = 0
+    while base < payload_size:
+        chunk = min(256, payload_size - base)
+        document[f"attr_{extra:03d}"] = 'x' * max(1, chunk - 16)
+        base = len(json.dumps(document))
+        extra += 1
+    return json.dumps(document).encode('utf-8')
+
+def run_scenario(processor, args, payload_size, batch_size, log_volume):
+    s3, dynamodb, cloudwatch = install_fakes(processor, args)
+    timings = {stage: [] for stage in STAGES}
+    restore = instrument(processor, timings)
+    invocation_ms = []
+    sequence = 0
+    try:
+        for iteration in range(args.warmup + args.iterations):
+            records = []
+            for _ in range(batch_size):
+                key = f"sensors/temperature/{sequence:012d}.json"
+                s3.objects[(BUCKET, key)] = make_document(sequence, payload_size)
+                records.append({'s3': {'bucket': {'name': BUCKET}, 'object': {'key': key}}})
+                sequence += 1
+            context = fakes.FakeContext(aws_request_id=f"bench-{iteration}")
+
+            started = time.perf_counter()
+            response = processor.lambda_handler({'Records': records}, context)
+            elapsed = (time.perf_counter() - started) * 1000
+
+            if response['statusCode'] != 200:
+                raise RuntimeError(f"Benchmark invocation failed: {response['body'][:500]}")
+            if iteration < args.warmup:
+                for samples in timings.values():
+                    samples.clear()
+                log_volume.reset()
+                continue
+            invocation_ms.append(elapsed)
+    finally:
+        restore()
+
+    total_seconds = sum(invocation_ms) / 1000.0
+    readings = batch_size * args.iterations
+    return {
+        'payload_size': payload_size,
+        'batch_size': batch_size,
+        'iterations': args.iterations,
+        'readings': readings,
+        'readings_per_sec': round(readings / total_seconds, 2) if total_seconds else 0.0,
+        'write_path': processor.write_path(),
+        'invocation': summarize_samples(invocation_ms),
+        'stages': {stage: summarize_samples(samples) for stage, samples in timings.items()},
+        'dynamodb_batch_calls': dynamodb.batch_calls,
+        'dynamodb_write_calls': dynamodb.write_calls,
+        'dynamodb_throttles': dynamodb.throttles,
+        'cloudwatch_calls': len(cloudwatch.calls),
+        'log_lines': log_volume.lines,
+        'log_bytes_per_reading': round(log_volume.bytes / readings, 1) if readings else 0.0,
+    }
+
+def compare(current, baseline, threshold, min_delta_ms):
+    """Scenarios whose throughput dropped or whose stage p95 grew by more than `threshold`"""
+    previous = {(s['payload_size'], s['batch_size']): s for s in baseline.get('scenarios', [])}
+    regressions = []
+    for scenario in current['scenarios']:
+        before = previous.get((scenario['payload_size'], scenario['batch_size']))
+        if not before:
+            continue
+        label = f"payload={scenario['payload_size']}B batch={scenario['batch_size']}"
+        if before['readings_per_sec'] and scenario['readings_per_sec'] < before['readings_per_sec'] * (1 - threshold):
+            regressions.append(f"{label}: readings/sec {before['readings_per_sec']} → {scenario['readings_per_sec']}")
+        for stage, stats in scenario['stages'].items():
+            old = before.get('stages', {}).get(stage)
+            if old and stats['p95_ms'] > old['p95_ms'] * (1 + threshold) and stats['p95_ms'] - old['p95_ms'] >= min_delta_ms:
+                regressions.append(f"{label}: {stage} p95 {old['p95_ms']}ms → {stats['p95_ms']}ms")
+    return regressions
+
+def parse_sizes(value):
+    return [int(part) for part in value.split(',') if part.strip()]
+
+def parse_capacity(value):
+    """'table=20,DateIndex=10' → {'table': 20.0, 'DateIndex': 10.0}"""
+    return {name.strip(): float(units) for name, units in (part.split('=') for part in value.split(',') if part.strip())}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--payload-sizes', type=parse_sizes, default=[256, 2048, 16384], help='comma-separated payload sizes in bytes')
+    parser.add_argument('--batch-sizes', type=parse_sizes, default=[1, 25, 100], help='comma-separated records per S3 event')
+    parser.add_argument('--iterations', type=int, default=20, help='measured invocations per scenario')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured invocations per scenario')
+    parser.add_argument('--s3-latency-ms', type=float, default=0.0)
+    parser.add_argument('--ddb-latency-ms', type=float, default=0.0)
+    parser.add_argument('--cw-latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--unprocessed-rate', type=float, default=0.0, help='fraction of batch writes returned as UnprocessedItems')
+    parser.add_argument('--write-capacity', type=parse_capacity, help="provision the fake table, e.g. 'table=20,DateIndex=10'")
+    parser.add_argument('--log-level', default='INFO', help='processor log level; output is counted, not printed')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help='previous results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.15, help='allowed relative regression before failing')
+    parser.add_argument('--min-delta-ms', type=float, default=0.25, help='ignore stage p95 increases smaller than this')
+    args = parser.parse_args(argv)
+
+    # Log lines are formatted (so their cost is measured) but only counted, never printed
+    processor = load_processor()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    log_volume = LogVolume()
+    root.addHandler(log_volume)
+    root.setLevel(args.log_level.upper())
+
+    results = {
+        'generated_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'settings': {
+            'iterations': args.iterations,
+            'warmup': args.warmup,
+            's3_latency_ms': args.s3_latency_ms,
+            'ddb_latency_ms': args.ddb_latency_ms,
+            'cw_latency_ms': args.cw_latency_ms,
+            'jitter_ms': args.jitter_ms,
+            'unprocessed_rate': args.unprocessed_rate,
+            'log_level': args.log_level.upper(),
+        },
+        'scenarios': [],
+    }
+
+    for payload_size in args.payload_sizes:
+        for batch_size in args.batch_sizes:
+            scenario = run_scenario(processor, args, payload_size, batch_size, log_volume)
+            results['scenarios'].append(scenario)
+            stages = '  '.join(f"{stage}={stats['p50_ms']:.3f}/{stats['p95_ms']:.3f}/{stats['p99_ms']:.3f}" for stage, stats in scenario['stages'].items())
+            print(f"payload={payload_size:>6}B batch={batch_size:>4}  {scenario['readings_per_sec']:>10.1f} readings/s  {scenario['log_bytes_per_reading']:>7.1f} log B/reading  "
+                  f"{scenario['write_path']} writes  p50/p95/p99 ms: {stages}")
+
+    with open(args.output, 'w') as output_file:
+        json.dump(results, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold, args.min_delta_ms)
+        if regressions:
+            print("Regressions detected:")
+            for regression in regressions:
+                print(f"  - {regression}")
+            return 1
+        print("No regressions against baseline")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
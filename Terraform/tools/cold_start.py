@@ -0,0 +1,145 @@
+"""
+Cold-import timing for every Lambda handler module.
+
+Each handler is imported in a fresh interpreter (`python -X importtime`), which
+is what a Lambda cold start pays before the first invocation. The harness
+reports the median/min import time per handler over several runs plus the
+slowest modules each one pulls in, writes the results as JSON and can compare
+them against a previous run to guard cold-start improvements.
+
+Usage (from Terraform/):
+    python tools/cold_start.py --runs 10 --output cold_start.json --compare cold_start_baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.dirname(TOOLS_DIR)
+LAYER_DIR = os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python')
+
+# Handler module → directory it is packaged from
+HANDLERS = {
+    's3_to_dynamo': 'data cleaner',
+    'python': 'data cleaner',
+    'Temprature': 'IoT devices',
+    'Humidity': 'IoT devices',
+    'AQI': 'IoT devices',
+    'Co2': 'IoT devices',
+    'Fleet': 'IoT devices',
+}
+
+# Environment the handlers read at import time, with harmless local values
+HANDLER_ENV = {
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'DYNAMODB_TABLE_NAME': 'ecomonitor_processed_data',
+    'IOT_ENDPOINT': 'localhost',
+    'METRICS_MODE': 'emf',
+}
+
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+# __import__ (unlike importlib.import_module) goes through the timed C import path
+PROBE = (
+    "import time\n"
+    "started = time.perf_counter()\n"
+    "__import__({module!r})\n"
+    "print((time.perf_counter() - started) * 1000)\n"
+)
+
+def measure_once(module, directory, extra_path):
+    """Import `module` in a fresh interpreter. Returns (import_ms, [(cumulative_us, name), ...])."""
+    env = dict(os.environ, **HANDLER_ENV)
+    env['PYTHONPATH'] = os.pathsep.join([os.path.join(TERRAFORM_DIR, directory), LAYER_DIR] + extra_path)
+    env.pop('INIT_PROFILE', None)
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE.format(module=module)],
+        env=env, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr[-2000:]}")
+
+    # The probe's own imports come first; only what the handler import pulled in counts
+    modules = []
+    for line in completed.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            modules.append((int(match.group(2)), match.group(4), len(match.group(3))))
+    handler_position = next((i for i, entry in enumerate(modules) if entry[1] == module), len(modules) - 1)
+    start = handler_position
+    while start > 0 and modules[start - 1][2] > modules[handler_position][2]:
+        start -= 1
+    pulled_in = [(cumulative, name) for cumulative, name, _ in modules[start:handler_position]]
+    return float(completed.stdout.strip().splitlines()[-1]), pulled_in
+
+def measure(module, directory, runs, extra_path, top=8):
+    samples, heaviest = [], {}
+    for _ in range(runs):
+        elapsed_ms, pulled_in = measure_once(module, directory, extra_path)
+        samples.append(elapsed_ms)
+        for cumulative_us, name in pulled_in:
+            heaviest[name] = min(heaviest.get(name, cumulative_us), cumulative_us)
+    slowest = sorted(heaviest.items(), key=lambda entry: entry[1], reverse=True)[:top]
+    return {
+        'handler': module,
+        'runs': runs,
+        'median_ms': round(statistics.median(samples), 2),
+        'min_ms': round(min(samples), 2),
+        'max_ms': round(max(samples), 2),
+        'slowest_imports_ms': {name: round(us / 1000.0, 2) for name, us in slowest},
+        'imports_boto3': 'boto3' in heaviest,
+    }
+
+def compare(current, baseline, threshold, min_delta_ms):
+    """Handlers whose median import time grew by more than `threshold` (and `min_delta_ms`)"""
+    previous = {entry['handler']: entry for entry in baseline.get('handlers', [])}
+    regressions = []
+    for entry in current['handlers']:
+        before = previous.get(entry['handler'])
+        if before and entry['median_ms'] > before['median_ms'] * (1 + threshold) \
+                and entry['median_ms'] - before['median_ms'] >= min_delta_ms:
+            regressions.append(f"{entry['handler']}: median import {before['median_ms']}ms → {entry['median_ms']}ms")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-import time of the Lambda handler modules")
+    parser.add_argument('--handlers', default=','.join(HANDLERS), help='comma-separated handler modules')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per handler')
+    parser.add_argument('--pythonpath', default='', help='extra import paths (e.g. a local boto3 install)')
+    parser.add_argument('--output', default='cold_start.json')
+    parser.add_argument('--compare', help='previous results file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative regression before failing')
+    parser.add_argument('--min-delta-ms', type=float, default=5.0, help='ignore increases smaller than this')
+    args = parser.parse_args(argv)
+
+    extra_path = [path for path in args.pythonpath.split(os.pathsep) if path]
+    results = {
+        'generated_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'python': platform.python_version(),
+        'handlers': [],
+    }
+    for module in [name.strip() for name in args.handlers.split(',') if name.strip()]:
+        entry = measure(module, HANDLERS[module], args.runs, extra_path)
+        results['handlers'].append(entry)
+        slowest = ', '.join(f"{name}={ms}" for name, ms in list(entry['slowest_imports_ms'].items())[:3])
+        print(f"{module:>14}  median {entry['median_ms']:8.2f} ms  min {entry['min_ms']:8.2f} ms  boto3={'yes' if entry['imports_boto3'] else 'no'}  slowest: {slowest}")
+
+    with open(args.output, 'w') as handle:
+        json.dump(results, handle, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.threshold, args.min_delta_ms)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
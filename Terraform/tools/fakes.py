@@ -0,0 +1,615 @@
+"""
+In-memory stand-ins for the AWS services used by the EcoMonitor Lambdas.
+
+They implement just enough of the boto3 client/resource surface for the
+processor and simulators to run in-process, and every call can be slowed down
+with an injected latency so that local benchmarks see realistic I/O waits.
+"""
+import hashlib
+import io
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from decimal import Decimal
+
+class LatencyModel:
+    """Fixed latency plus optional uniform jitter, in milliseconds"""
+
+    def __init__(self, mean_ms=0.0, jitter_ms=0.0, rng=None):
+        self.mean_ms = mean_ms
+        self.jitter_ms = jitter_ms
+        self._rng = rng or random.Random(0)
+
+    def delay(self):
+        if self.mean_ms <= 0 and self.jitter_ms <= 0:
+            return 0.0
+        delay_ms = self.mean_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, delay_ms) / 1000.0
+
+    def wait(self):
+        delay = self.delay()
+        if delay:
+            time.sleep(delay)
+
+NO_LATENCY = LatencyModel()
+
+class FakeClientError(Exception):
+    """Mimics botocore ClientError closely enough for `e.response['Error']['Code']` checks"""
+
+    def __init__(self, code, message=''):
+        self.response = {'Error': {'Code': code, 'Message': message}}
+        super().__init__(f"An error occurred ({code}): {message}")
+
+class _Exceptions:
+    class NoSuchKey(FakeClientError):
+        def __init__(self, message='The specified key does not exist.'):
+            super().__init__('NoSuchKey', message)
+
+    class ValidationException(FakeClientError):
+        def __init__(self, message='One or more parameter values were invalid'):
+            super().__init__('ValidationException', message)
+
+    class ConditionalCheckFailedException(FakeClientError):
+        def __init__(self, message='The conditional request failed'):
+            super().__init__('ConditionalCheckFailedException', message)
+
+    class ProvisionedThroughputExceededException(FakeClientError):
+        def __init__(self, message='The level of configured provisioned throughput for the table was exceeded.'):
+            super().__init__('ProvisionedThroughputExceededException', message)
+
+class FakeS3Client:
+    """Bucket/key → bytes store with get/put/list/delete"""
+    exceptions = _Exceptions
+
+    def __init__(self, latency=NO_LATENCY):
+        self.latency = latency
+        self.objects = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.latency.wait()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif not isinstance(Body, bytes):
+            Body = Body.read()
+        with self._lock:
+            self.calls += 1
+            self.objects[(Bucket, Key)] = Body
+        return {'ETag': f'"{hash(Body) & 0xffffffff:08x}"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            self.calls += 1
+            body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise self.exceptions.NoSuchKey()
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            self.calls += 1
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def delete_objects(self, Bucket, Delete, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            self.calls += 1
+            for entry in Delete['Objects']:
+                self.objects.pop((Bucket, entry['Key']), None)
+        return {'Deleted': [] if Delete.get('Quiet') else [{'Key': entry['Key']} for entry in Delete['Objects']]}
+
+    def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000, StartAfter=None, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            self.calls += 1
+            keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        start_after = ContinuationToken or StartAfter
+        if start_after:
+            keys = [key for key in keys if key > start_after]
+        page = keys[:MaxKeys]
+        response = {
+            'KeyCount': len(page),
+            'Contents': [
+                {'Key': key, 'Size': len(self.objects[(Bucket, key)]), 'ETag': f'"{hashlib.md5(self.objects[(Bucket, key)]).hexdigest()}"'}
+                for key in page
+            ],
+            'IsTruncated': len(keys) > MaxKeys
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+class FakeTable:
+    """
+    Hash/range keyed item store behind a FakeDynamoResource. `indexes` maps a
+    GSI name to its (hash, range) attributes for Query(IndexName=...).
+    """
+
+    def __init__(self, resource, name, hash_key='device_id', range_key='timestamp', indexes=None):
+        self.resource = resource
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        self.indexes = indexes if indexes is not None else {'DateIndex': ('reading_date', 'timestamp')}
+        self.items = {}
+        self.read_calls = 0
+
+    @property
+    def meta(self):
+        return self.resource.meta
+
+    def key_of(self, item):
+        return item[self.hash_key], item.get(self.range_key)
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None, **kwargs):
+        self.resource.latency.wait()
+        self.resource.validate(Item)
+        expression = _Expression(ExpressionAttributeNames, ExpressionAttributeValues, typed=False)
+        with self.resource.lock:
+            self.resource.write_calls += 1
+            if ConditionExpression and not expression.condition(self.items.get(self.key_of(Item), {}), ConditionExpression):
+                raise _Exceptions.ConditionalCheckFailedException()
+            consumed = self.resource.consume(self, Item)
+            if consumed is None:
+                raise _Exceptions.ProvisionedThroughputExceededException()
+            self.items[self.key_of(Item)] = dict(Item)
+        return {'ConsumedCapacity': consumed} if kwargs.get('ReturnConsumedCapacity') else {}
+
+    def delete_item(self, Key, **kwargs):
+        self.resource.latency.wait()
+        with self.resource.lock:
+            self.resource.write_calls += 1
+            self.items.pop(self.key_of(Key), None)
+        return {}
+
+    def query(self, KeyConditionExpression, ExpressionAttributeValues=None, ExpressionAttributeNames=None,
+              IndexName=None, ScanIndexForward=True, Limit=None, ExclusiveStartKey=None, **kwargs):
+        """Key-condition Query over the table or a GSI (string expressions only)"""
+        self.resource.latency.wait()
+        hash_key, range_key = self.indexes[IndexName] if IndexName else (self.hash_key, self.range_key)
+        expression = _Expression(ExpressionAttributeNames, ExpressionAttributeValues, typed=False)
+        with self.resource.lock:
+            self.read_calls += 1
+            matches = [dict(item) for item in self.items.values()
+                       if hash_key in item and expression.condition(item, KeyConditionExpression)]
+        matches.sort(key=lambda item: (str(item.get(range_key, '')), self.key_of(item)), reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            position = next(index for index, item in enumerate(matches)
+                            if all(item.get(name) == value for name, value in ExclusiveStartKey.items()))
+            matches = matches[position + 1:]
+        response = {'Items': matches[:Limit] if Limit else matches}
+        response['Count'] = len(response['Items'])
+        if Limit and len(matches) > Limit:
+            last = response['Items'][-1]
+            names = {self.hash_key, self.range_key, hash_key, range_key}
+            response['LastEvaluatedKey'] = {name: last[name] for name in names if name in last}
+        return response
+
+    def get_item(self, Key, **kwargs):
+        self.resource.latency.wait()
+        with self.resource.lock:
+            item = self.items.get((Key[self.hash_key], Key.get(self.range_key)))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression=None, ExpressionAttributeNames=None,
+                    ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        expression = _Expression(ExpressionAttributeNames, ExpressionAttributeValues, typed=False)
+        updated, targets, consumed = self._update(Key, UpdateExpression, ConditionExpression, expression)
+        response = {'ConsumedCapacity': consumed} if kwargs.get('ReturnConsumedCapacity') else {}
+        if ReturnValues == 'ALL_NEW':
+            response['Attributes'] = updated
+        elif ReturnValues == 'UPDATED_NEW':
+            response['Attributes'] = {name: updated[name] for name in targets if name in updated}
+        return response
+
+    def _update(self, key, update_expression, condition_expression, expression):
+        self.resource.latency.wait()
+        with self.resource.lock:
+            self.resource.write_calls += 1
+            stored = self.items.get(self.key_of(key))
+            current = dict(stored) if stored is not None else {}
+            if not expression.condition(current, condition_expression):
+                raise _Exceptions.ConditionalCheckFailedException()
+            updated = expression.update(dict(current) or dict(key), update_expression)
+            self.resource.validate(updated)
+            consumed = self.resource.consume(self, updated)
+            if consumed is None:
+                raise _Exceptions.ProvisionedThroughputExceededException()
+            self.items[self.key_of(key)] = updated
+        return dict(updated), expression.targets, consumed
+
+    def scan(self, Segment=0, TotalSegments=1, Limit=None, ExclusiveStartKey=None, **kwargs):
+        """Parallel-scan aware Scan: items are assigned to segments by a hash of their key"""
+        self.resource.latency.wait()
+        with self.resource.lock:
+            self.read_calls += 1
+            keys = sorted(key for key in self.items if zlib.crc32(repr(key).encode('utf-8')) % TotalSegments == Segment)
+            if ExclusiveStartKey:
+                start = self.key_of(ExclusiveStartKey)
+                keys = [key for key in keys if key > start]
+            page = keys[:Limit] if Limit else keys
+            response = {'Items': [dict(self.items[key]) for key in page], 'Count': len(page)}
+        if Limit and len(keys) > Limit:
+            response['LastEvaluatedKey'] = {self.hash_key: page[-1][0], self.range_key: page[-1][1]}
+        return response
+
+class _Meta:
+    def __init__(self, client):
+        self.client = client
+
+def deserialize(value):
+    """Low-level attribute value ({'S': ...}, {'N': ...}, ...) → Python value"""
+    (kind, data), = value.items()
+    if kind == 'S' or kind == 'B':
+        return data
+    if kind == 'N':
+        return Decimal(data)
+    if kind == 'BOOL':
+        return data
+    if kind == 'NULL':
+        return None
+    if kind == 'M':
+        return {name: deserialize(entry) for name, entry in data.items()}
+    if kind == 'L':
+        return [deserialize(entry) for entry in data]
+    if kind == 'SS' or kind == 'BS':
+        return set(data)
+    if kind == 'NS':
+        return {Decimal(entry) for entry in data}
+    raise _Exceptions.ValidationException(f"Unsupported attribute type {kind}")
+
+def serialize(value):
+    """Python value → low-level attribute value"""
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, (bytes, bytearray)):
+        return {'B': bytes(value)}
+    if isinstance(value, (int, Decimal)):
+        return {'N': str(value)}
+    if isinstance(value, dict):
+        return {'M': {name: serialize(entry) for name, entry in value.items()}}
+    if isinstance(value, list):
+        return {'L': [serialize(entry) for entry in value]}
+    if isinstance(value, set):
+        if all(isinstance(entry, str) for entry in value):
+            return {'SS': sorted(value)}
+        return {'NS': sorted(str(entry) for entry in value)}
+    raise _Exceptions.ValidationException(f"Unsupported Python type {type(value).__name__}")
+
+def _split_top_level(text, separator=','):
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == separator and depth == 0:
+            parts.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(char)
+    if ''.join(current).strip():
+        parts.append(''.join(current).strip())
+    return parts
+
+class _Expression:
+    """
+    Evaluator for the subset of DynamoDB expression syntax the Lambdas use:
+    SET (with if_not_exists, list_append and +/-), ADD, REMOVE, and conditions made of
+    comparisons, attribute_exists/attribute_not_exists and begins_with joined
+    by AND/OR.
+    """
+
+    def __init__(self, names, values, typed=True):
+        self.names = names or {}
+        values = values or {}
+        self.values = {name: deserialize(value) for name, value in values.items()} if typed else dict(values)
+        self.targets = set()
+
+    def name(self, token):
+        return self.names.get(token.strip(), token.strip())
+
+    def operand(self, item, token):
+        token = token.strip()
+        match = re.fullmatch(r'if_not_exists\((.+),(.+)\)', token)
+        if match:
+            name = self.name(match.group(1))
+            return item[name] if name in item else self.operand(item, match.group(2))
+        match = re.fullmatch(r'list_append\((.+)\)', token)
+        if match:
+            left, right = _split_top_level(match.group(1))
+            return list(self.operand(item, left)) + list(self.operand(item, right))
+        for operator in ('+', '-'):
+            parts = _split_top_level(token, operator)
+            if len(parts) == 2:
+                left, right = self.operand(item, parts[0]), self.operand(item, parts[1])
+                return left + right if operator == '+' else left - right
+        if token.startswith(':'):
+            return self.values[token]
+        return item.get(self.name(token))
+
+    def update(self, item, expression):
+        clauses = re.split(r'\b(SET|ADD|REMOVE|DELETE)\b', expression)
+        for keyword, body in zip(clauses[1::2], clauses[2::2]):
+            for action in _split_top_level(body):
+                if keyword == 'SET':
+                    target, value = action.split('=', 1)
+                    self.targets.add(self.name(target))
+                    item[self.name(target)] = self.operand(item, value)
+                elif keyword == 'ADD':
+                    target, value = action.split(None, 1)
+                    name, value = self.name(target), self.operand(item, value)
+                    self.targets.add(name)
+                    if isinstance(value, set):
+                        item[name] = set(item.get(name, set())) | value
+                    else:
+                        item[name] = item.get(name, Decimal(0)) + value
+                elif keyword == 'REMOVE':
+                    item.pop(self.name(action), None)
+                else:
+                    target, value = action.split(None, 1)
+                    item[self.name(target)] = set(item.get(self.name(target), set())) - self.operand(item, value)
+        return item
+
+    def condition(self, item, expression):
+        if not expression:
+            return True
+        expression = re.sub(r'(\S+)\s+BETWEEN\s+(\S+)\s+AND\s+(\S+)', r'between(\1,\2,\3)', expression)
+        for disjunct in re.split(r'\s+OR\s+', expression.strip()):
+            disjunct = disjunct.strip()
+            while disjunct.startswith('(') and disjunct.endswith(')'):
+                disjunct = disjunct[1:-1].strip()
+            if all(self._term(item, term) for term in re.split(r'\s+AND\s+', disjunct)):
+                return True
+        return False
+
+    def _term(self, item, term):
+        term = term.strip()
+        while term.startswith('(') and term.endswith(')'):
+            term = term[1:-1].strip()
+        match = re.fullmatch(r'(attribute_exists|attribute_not_exists)\((.+)\)', term)
+        if match:
+            exists = self.name(match.group(2)) in item
+            return exists if match.group(1) == 'attribute_exists' else not exists
+        match = re.fullmatch(r'between\((.+),(.+),(.+)\)', term)
+        if match:
+            value, low, high = (self.operand(item, group) for group in match.groups())
+            return value is not None and low <= value <= high
+        match = re.fullmatch(r'begins_with\((.+),(.+)\)', term)
+        if match:
+            value = self.operand(item, match.group(1))
+            return isinstance(value, str) and value.startswith(self.operand(item, match.group(2)))
+        match = re.fullmatch(r'(.+?)\s*(<>|<=|>=|=|<|>)\s*(.+)', term)
+        if not match:
+            raise _Exceptions.ValidationException(f"Unsupported condition: {term}")
+        left, operator, right = self.operand(item, match.group(1)), match.group(2), self.operand(item, match.group(3))
+        if operator == '=':
+            return left == right
+        if operator == '<>':
+            return left != right
+        if left is None or right is None:
+            return False
+        return {'<': left < right, '<=': left <= right, '>': left > right, '>=': left >= right}[operator]
+
+class FakeDynamoClient:
+    """Low-level DynamoDB client view of a FakeDynamoResource (resource.meta.client)"""
+    exceptions = _Exceptions
+
+    def __init__(self, resource):
+        self.resource = resource
+
+    def update_item(self, TableName, Key, UpdateExpression, ConditionExpression=None,
+                    ExpressionAttributeNames=None, ExpressionAttributeValues=None, ReturnValues='NONE', **kwargs):
+        table = self.resource.Table(TableName)
+        key = {name: deserialize(value) for name, value in Key.items()}
+        expression = _Expression(ExpressionAttributeNames, ExpressionAttributeValues)
+        updated, targets, consumed = table._update(key, UpdateExpression, ConditionExpression, expression)
+        response = {'ConsumedCapacity': consumed} if kwargs.get('ReturnConsumedCapacity') else {}
+        if ReturnValues == 'ALL_NEW':
+            response['Attributes'] = {name: serialize(value) for name, value in updated.items()}
+        elif ReturnValues == 'UPDATED_NEW':
+            response['Attributes'] = {name: serialize(updated[name]) for name in targets if name in updated}
+        return response
+
+    def describe_table(self, TableName):
+        table = self.resource.Table(TableName)
+        capacity = self.resource.write_capacity
+        description = {'TableName': TableName}
+        if capacity is None:
+            description['BillingModeSummary'] = {'BillingMode': 'PAY_PER_REQUEST'}
+            return {'Table': description}
+        description['ProvisionedThroughput'] = {'WriteCapacityUnits': capacity.get('table', 0)}
+        description['GlobalSecondaryIndexes'] = [
+            {
+                'IndexName': name,
+                'KeySchema': [{'AttributeName': hash_key, 'KeyType': 'HASH'}, {'AttributeName': range_key, 'KeyType': 'RANGE'}],
+                'ProvisionedThroughput': {'WriteCapacityUnits': capacity.get(name, 0)},
+            }
+            for name, (hash_key, range_key) in table.indexes.items()
+        ]
+        return {'Table': description}
+
+class FakeDynamoResource:
+    """
+    DynamoDB resource stand-in.
+
+    `unprocessed_rate` returns that fraction of each BatchWriteItem request as
+    UnprocessedItems, which exercises the processor's retry path.
+
+    `write_capacity` ({'table': WCU, '<index>': WCU}) makes the tables
+    provisioned: writes beyond the per-second capacity of the table or an index
+    are throttled (ProvisionedThroughputExceededException, or UnprocessedItems
+    in a batch) and `throttles` counts them. Without it the tables are on-demand.
+    """
+
+    def __init__(self, latency=NO_LATENCY, unprocessed_rate=0.0, rng=None, write_capacity=None, clock=time.monotonic):
+        self.latency = latency
+        self.unprocessed_rate = unprocessed_rate
+        self.write_capacity = write_capacity
+        self.throttles = 0
+        self.consumed_units = 0.0
+        self._clock = clock
+        self._available = dict(write_capacity or {})
+        self._refilled = clock()
+        self.tables = {}
+        self.lock = threading.Lock()
+        self.write_calls = 0
+        self.batch_calls = 0
+        self.meta = _Meta(FakeDynamoClient(self))
+        self._rng = rng or random.Random(0)
+
+    def Table(self, name):
+        with self.lock:
+            table = self.tables.get(name)
+            if table is None:
+                table = self.tables[name] = FakeTable(self, name)
+        return table
+
+    def consume(self, table, item):
+        """
+        Charge one write of `item` (1 WCU per started KB, on the table and every
+        index whose key it carries). Returns its ConsumedCapacity, or None when
+        throttled. Called with the lock held.
+        """
+        units = float(math.ceil(len(repr(item).encode('utf-8')) / 1024.0))
+        pools = {'table': units}
+        pools.update({name: units for name, (hash_key, _) in table.indexes.items() if hash_key in item})
+        if self.write_capacity is not None:
+            now = self._clock()
+            elapsed, self._refilled = now - self._refilled, now
+            for pool, capacity in self.write_capacity.items():
+                self._available[pool] = min(capacity, self._available[pool] + elapsed * capacity)
+            if any(self._available.get(pool, math.inf) < cost for pool, cost in pools.items()):
+                self.throttles += 1
+                return None
+            for pool, cost in pools.items():
+                if pool in self._available:
+                    self._available[pool] -= cost
+        self.consumed_units += sum(pools.values())
+        consumed = {'TableName': table.name, 'CapacityUnits': sum(pools.values()), 'Table': {'CapacityUnits': units}}
+        indexes = {name: {'CapacityUnits': cost} for name, cost in pools.items() if name != 'table'}
+        if indexes:
+            consumed['GlobalSecondaryIndexes'] = indexes
+        return consumed
+
+    def validate(self, item):
+        for key in ('device_id', 'timestamp'):
+            if key in item and not isinstance(item[key], str):
+                raise _Exceptions.ValidationException(f"Type mismatch for key {key}")
+            if key in item and item[key] == '':
+                raise _Exceptions.ValidationException(f"Empty string for key {key}")
+        for key, value in item.items():
+            if isinstance(value, float):
+                raise _Exceptions.ValidationException(f"Float types are not supported. Use Decimal types instead ({key})")
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.latency.wait()
+        unprocessed, consumed = {}, []
+        with self.lock:
+            self.batch_calls += 1
+        for table_name, requests in RequestItems.items():
+            if len(requests) > 25:
+                raise _Exceptions.ValidationException('Too many items requested for the BatchWriteItem call')
+            table = self.Table(table_name)
+            seen = set()
+            for request in requests:
+                item = request['PutRequest']['Item']
+                key = table.key_of(item)
+                if key in seen:
+                    raise _Exceptions.ValidationException('Provided list of item keys contains duplicates')
+                seen.add(key)
+                self.validate(item)
+            for request in requests:
+                if self.unprocessed_rate and self._rng.random() < self.unprocessed_rate:
+                    unprocessed.setdefault(table_name, []).append(request)
+                    continue
+                item = request['PutRequest']['Item']
+                with self.lock:
+                    entry = self.consume(table, item)
+                    if entry is None:
+                        unprocessed.setdefault(table_name, []).append(request)
+                        continue
+                    table.items[table.key_of(item)] = dict(item)
+                consumed.append(entry)
+        if unprocessed and not consumed and self.write_capacity is not None:
+            raise _Exceptions.ProvisionedThroughputExceededException()
+        response = {'UnprocessedItems': unprocessed}
+        if kwargs.get('ReturnConsumedCapacity'):
+            response['ConsumedCapacity'] = self._merge_consumed(consumed)
+        return response
+
+    @staticmethod
+    def _merge_consumed(entries):
+        merged = {}
+        for entry in entries:
+            total = merged.setdefault(entry['TableName'], {'TableName': entry['TableName'], 'CapacityUnits': 0.0, 'Table': {'CapacityUnits': 0.0}})
+            total['CapacityUnits'] += entry['CapacityUnits']
+            total['Table']['CapacityUnits'] += entry['Table']['CapacityUnits']
+            for name, index in entry.get('GlobalSecondaryIndexes', {}).items():
+                indexes = total.setdefault('GlobalSecondaryIndexes', {})
+                indexes.setdefault(name, {'CapacityUnits': 0.0})['CapacityUnits'] += index['CapacityUnits']
+        return list(merged.values())
+
+class FakeSNSClient:
+    """Records published notifications"""
+
+    def __init__(self, latency=NO_LATENCY):
+        self.latency = latency
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.latency.wait()
+        self.messages.append({'TopicArn': TopicArn, 'Subject': Subject, 'Message': Message})
+        return {'MessageId': str(len(self.messages))}
+
+class FakeCloudWatchClient:
+    """Records PutMetricData calls"""
+
+    def __init__(self, latency=NO_LATENCY):
+        self.latency = latency
+        self.calls = []
+
+    def put_metric_data(self, Namespace, MetricData, **kwargs):
+        self.latency.wait()
+        self.calls.append((Namespace, list(MetricData)))
+        return {}
+
+    @property
+    def datum_count(self):
+        return sum(len(data) for _, data in self.calls)
+
+class FakeIotDataClient:
+    """Records IoT publishes as (topic, payload) pairs"""
+
+    def __init__(self, latency=NO_LATENCY):
+        self.latency = latency
+        self.messages = []
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=0, **kwargs):
+        self.latency.wait()
+        with self._lock:
+            self.messages.append((topic, payload))
+        return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+
+class FakeContext:
+    """Minimal Lambda context object"""
+
+    def __init__(self, aws_request_id='local-request', function_name='local', remaining_ms=900000):
+        self.aws_request_id = aws_request_id
+        self.function_name = function_name
+        self._deadline = time.monotonic() + remaining_ms / 1000.0
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
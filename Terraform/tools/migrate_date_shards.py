@@ -0,0 +1,91 @@
+"""
+Rewrite pre-sharding `reading_date` values ('YYYY-MM-DD') to the sharded
+'YYYY-MM-DD#<shard>' form used by the DateIndex (see ecomonitor.sharding).
+
+The table is read with a parallel Scan (one worker per segment) and every
+legacy item is updated in place with a conditional UpdateItem, so an item that
+the processor rewrote in the meantime is left alone and re-running the tool is
+safe. Writes go through a token bucket to stay inside provisioned WCU. Once a
+run reports no remaining legacy items, readers can stop querying the bare date
+with DATE_INDEX_LEGACY_READS=false.
+
+Usage (from Terraform/):
+    python tools/migrate_date_shards.py --table ecomonitor_processed_data --segments 4 --rate 15 [--dry-run]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.dirname(TOOLS_DIR)
+sys.path[:0] = [os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python')]
+
+from ecomonitor.ratelimit import TokenBucket
+from ecomonitor.sharding import DATE_INDEX_SHARDS, is_sharded, sharded_date
+
+def migrate_segment(table, segment, total_segments, bucket, shards, dry_run=False, page_size=500):
+    """Scan one segment and shard its legacy reading_date values. Returns counters."""
+    counters = {'scanned': 0, 'migrated': 0, 'skipped': 0}
+    conditional_failure = table.meta.client.exceptions.ConditionalCheckFailedException
+    kwargs = {'Segment': segment, 'TotalSegments': total_segments, 'Limit': page_size}
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get('Items', []):
+            counters['scanned'] += 1
+            reading_date = item.get('reading_date')
+            if reading_date is None or is_sharded(reading_date):
+                continue
+            if dry_run:
+                counters['migrated'] += 1
+                continue
+            bucket.acquire()
+            try:
+                table.update_item(
+                    Key={'device_id': item['device_id'], 'timestamp': item['timestamp']},
+                    UpdateExpression='SET reading_date = :sharded',
+                    ConditionExpression='reading_date = :legacy',
+                    ExpressionAttributeValues={
+                        ':sharded': sharded_date(reading_date, item['device_id'], shards),
+                        ':legacy': reading_date,
+                    }
+                )
+                counters['migrated'] += 1
+            except conditional_failure:
+                counters['skipped'] += 1
+        if 'LastEvaluatedKey' not in response:
+            return counters
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def migrate(table, segments=4, rate=0, shards=DATE_INDEX_SHARDS, dry_run=False):
+    """Migrate the whole table with `segments` parallel scanners sharing one write budget"""
+    bucket = TokenBucket(rate)
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        outcomes = list(executor.map(
+            lambda segment: migrate_segment(table, segment, segments, bucket, shards, dry_run),
+            range(segments)
+        ))
+    return {name: sum(outcome[name] for outcome in outcomes) for name in ('scanned', 'migrated', 'skipped')}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shard legacy DateIndex keys in the processed-data table")
+    parser.add_argument('--table', default=os.environ.get('DYNAMODB_TABLE_NAME', 'ecomonitor_processed_data'))
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--rate', type=float, default=15, help='max UpdateItem calls per second (0 = unlimited)')
+    parser.add_argument('--shards', type=int, default=DATE_INDEX_SHARDS)
+    parser.add_argument('--dry-run', action='store_true', help='count legacy items without updating them')
+    args = parser.parse_args(argv)
+
+    from ecomonitor.runtime import get_resource
+
+    started = time.perf_counter()
+    table = get_resource('dynamodb').Table(args.table)
+    counters = migrate(table, args.segments, args.rate, args.shards, args.dry_run)
+    verb = 'would migrate' if args.dry_run else 'migrated'
+    print(f"Scanned {counters['scanned']} items, {verb} {counters['migrated']}, "
+          f"{counters['skipped']} changed concurrently, in {time.perf_counter() - started:.1f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+Rewrite reading items to time-ordered sort keys (see ecomonitor.sortkeys).
+
+Older readings are keyed by whatever they arrived with: the IoT rule's bare
+epoch millis, a simulator's request id or the processor's fallback digest, and
+carry the date they were ingested as `reading_date`. This tool gives each of
+them the key the processor now derives, '<epoch ms>#<suffix>' from the reading's
+own time, and the DateIndex date of that time.
+
+A sort key cannot be updated in place, so every legacy item is copied to its
+new key with a conditional PutItem (an item that already exists there, from an
+interrupted run or a redelivery, is kept) and the old item is then deleted.
+Readers may see both copies in between, never neither. `#latest` items get their
+`reading_timestamp` pointer rewritten the same way; rollups, packed items and
+the other `#` partitions are left alone.
+
+The table is read with a parallel Scan (one worker per segment), writes go
+through a token bucket to stay inside provisioned WCU, and every segment's
+position is saved to a checkpoint file after each page, so re-running the same
+command resumes where the previous run stopped. Items that failed are counted
+and skipped; a run with --checkpoint "" rescans the table and retries them
+(migrated items are recognised by their key and left alone).
+
+Usage (from Terraform/):
+    python tools/migrate_sort_keys.py --table ecomonitor_processed_data --segments 4 --rate 8 --checkpoint sort_keys.json [--dry-run]
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.dirname(TOOLS_DIR)
+sys.path[:0] = [os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python')]
+
+from ecomonitor import sortkeys
+from ecomonitor.queries import epoch_ms, is_latest_partition
+from ecomonitor.ratelimit import TokenBucket
+from ecomonitor.rollups import reading_datetime
+from ecomonitor.sharding import DATE_INDEX_SHARDS, base_date, sharded_date
+
+COUNTERS = ('scanned', 'migrated', 'existing', 'latest', 'untimed', 'failed')
+
+def observed_time(item):
+    """When a legacy reading was taken: its own time, else the IoT rule's receive time, else its ingest date"""
+    observed = reading_datetime(item)
+    if observed is None and item.get('received_at') is not None:
+        received = sortkeys.key_epoch_ms(item['received_at'])
+        if received is not None:
+            observed = datetime.datetime.utcfromtimestamp(received / 1000.0)
+    if observed is None and item.get('reading_date'):
+        try:
+            observed = datetime.datetime.fromisoformat(base_date(item['reading_date']))
+        except ValueError:
+            return None
+    if observed is None or not sortkeys.in_range(epoch_ms(observed)):
+        return None
+    return observed
+
+def migrated_item(item, shards=DATE_INDEX_SHARDS):
+    """The item under its time-ordered key, or None when its time cannot be told"""
+    observed = observed_time(item)
+    if observed is None:
+        return None
+    migrated = dict(item)
+    migrated['timestamp'] = sortkeys.sort_key(epoch_ms(observed), str(item['timestamp']))
+    migrated['reading_date'] = sharded_date(observed.strftime('%Y-%m-%d'), item['device_id'], shards)
+    return migrated
+
+def is_legacy_reading(item):
+    device_id = str(item.get('device_id', ''))
+    return sortkeys.KEY_SEPARATOR not in device_id and not sortkeys.is_sort_key(item.get('timestamp'))
+
+def is_legacy_latest(item):
+    return (is_latest_partition(item.get('device_id', '')) and item.get('reading_timestamp') is not None
+            and not sortkeys.is_sort_key(item['reading_timestamp']))
+
+def migrate_reading(table, item, bucket, shards, counters, conditional_failure):
+    migrated = migrated_item(item, shards)
+    if migrated is None:
+        counters['untimed'] += 1
+        return
+    bucket.acquire(2)
+    try:
+        table.put_item(Item=migrated, ConditionExpression='attribute_not_exists(device_id)')
+        counters['migrated'] += 1
+    except conditional_failure:
+        counters['existing'] += 1
+    table.delete_item(Key={'device_id': item['device_id'], 'timestamp': item['timestamp']})
+
+def migrate_latest(table, item, bucket, counters, conditional_failure):
+    observed_at = item.get('observed_at')
+    if observed_at is None or not sortkeys.in_range(int(observed_at)):
+        counters['untimed'] += 1
+        return
+    bucket.acquire()
+    try:
+        table.update_item(
+            Key={'device_id': item['device_id'], 'timestamp': item['timestamp']},
+            UpdateExpression='SET reading_timestamp = :migrated',
+            ConditionExpression='reading_timestamp = :legacy',
+            ExpressionAttributeValues={
+                ':migrated': sortkeys.sort_key(int(observed_at), str(item['reading_timestamp'])),
+                ':legacy': item['reading_timestamp'],
+            }
+        )
+        counters['latest'] += 1
+    except conditional_failure:
+        # The processor pointed the device at a newer reading meanwhile
+        counters['existing'] += 1
+
+class Checkpoint:
+    """Scan position and counters of every segment, persisted atomically after every page"""
+
+    def __init__(self, path, parameters):
+        self.path = path
+        self.state = {'parameters': parameters, 'segments': {}}
+        self._lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path) as handle:
+                previous = json.load(handle)
+            if previous.get('parameters') != parameters:
+                raise ValueError(f"Checkpoint {path} belongs to a run with different parameters: {previous.get('parameters')}")
+            self.state = previous
+
+    def segment(self, segment):
+        return self.state['segments'].get(str(segment), {'last_key': None, 'done': False, 'counters': dict.fromkeys(COUNTERS, 0)})
+
+    def record(self, segment, state):
+        with self._lock:
+            self.state['segments'][str(segment)] = state
+            if self.path:
+                temporary = f"{self.path}.tmp"
+                with open(temporary, 'w') as handle:
+                    json.dump(self.state, handle, default=str)
+                os.replace(temporary, self.path)
+
+def migrate_segment(table, segment, total_segments, bucket, checkpoint, shards, dry_run=False, page_size=500):
+    """Scan one segment from its checkpointed position and migrate its legacy items. Returns counters."""
+    state = checkpoint.segment(segment)
+    counters = state['counters']
+    if state['done']:
+        return counters
+    conditional_failure = table.meta.client.exceptions.ConditionalCheckFailedException
+    kwargs = {'Segment': segment, 'TotalSegments': total_segments, 'Limit': page_size}
+    if state['last_key']:
+        kwargs['ExclusiveStartKey'] = state['last_key']
+    while True:
+        response = table.scan(**kwargs)
+        for item in response.get('Items', []):
+            counters['scanned'] += 1
+            legacy_reading, legacy_latest = is_legacy_reading(item), is_legacy_latest(item)
+            if not legacy_reading and not legacy_latest:
+                continue
+            if dry_run:
+                counters['latest' if legacy_latest else 'migrated'] += 1
+                continue
+            try:
+                if legacy_reading:
+                    migrate_reading(table, item, bucket, shards, counters, conditional_failure)
+                else:
+                    migrate_latest(table, item, bucket, counters, conditional_failure)
+            except Exception as e:
+                counters['failed'] += 1
+                print(f"❌ [migrate] {item.get('device_id')} {item.get('timestamp')}: {str(e)}", file=sys.stderr, flush=True)
+        state = {'last_key': response.get('LastEvaluatedKey'), 'done': 'LastEvaluatedKey' not in response, 'counters': counters}
+        if not dry_run:
+            checkpoint.record(segment, state)
+        if state['done']:
+            return counters
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def migrate(table, segments=4, rate=0, shards=DATE_INDEX_SHARDS, dry_run=False, checkpoint_path=None):
+    """Migrate the whole table with `segments` parallel scanners sharing one write budget"""
+    checkpoint = Checkpoint(None if dry_run else checkpoint_path, {'table': table.name, 'segments': segments, 'shards': shards})
+    finished = sum(1 for segment in range(segments) if checkpoint.segment(segment)['done'])
+    if finished:
+        print(f"[migrate] Resuming: {finished} of {segments} segments already done", flush=True)
+    bucket = TokenBucket(rate)
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        outcomes = list(executor.map(
+            lambda segment: migrate_segment(table, segment, segments, bucket, checkpoint, shards, dry_run),
+            range(segments)
+        ))
+    return {name: sum(outcome[name] for outcome in outcomes) for name in COUNTERS}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rewrite reading items to time-ordered sort keys")
+    parser.add_argument('--table', default=os.environ.get('DYNAMODB_TABLE_NAME', 'ecomonitor_processed_data'))
+    parser.add_argument('--segments', type=int, default=4, help='parallel scan segments')
+    parser.add_argument('--rate', type=float, default=8, help='max write calls per second (0 = unlimited); a reading takes two')
+    parser.add_argument('--shards', type=int, default=DATE_INDEX_SHARDS)
+    parser.add_argument('--checkpoint', default='sort_keys_checkpoint.json', help='resume file ("" disables)')
+    parser.add_argument('--dry-run', action='store_true', help='count legacy items without rewriting them')
+    args = parser.parse_args(argv)
+
+    from ecomonitor.runtime import get_resource
+
+    started = time.perf_counter()
+    table = get_resource('dynamodb').Table(args.table)
+    counters = migrate(table, args.segments, args.rate, args.shards, args.dry_run, args.checkpoint or None)
+    verb = 'would migrate' if args.dry_run else 'migrated'
+    print(f"Scanned {counters['scanned']} items, {verb} {counters['migrated']} readings and {counters['latest']} latest pointers, "
+          f"{counters['existing']} already in place, {counters['untimed']} without a time, {counters['failed']} failed, "
+          f"in {time.perf_counter() - started:.1f}s")
+    return 1 if counters['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
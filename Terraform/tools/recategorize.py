@@ -0,0 +1,194 @@
+"""
+Re-apply the classification bands to the compacted reading archive.
+
+After a threshold change (a new band table in ecomonitor.classification, or a
+JSON file passed with --bands), every compacted file under
+compacted/<type>/dt=YYYY-MM-DD/ is downloaded, its value column is classified
+in one vectorized pass (NumPy searchsorted when installed) and the category
+columns are rewritten in place. Files are processed in parallel with a process
+pool; files whose categories did not change are not written back.
+
+Usage (from Terraform/):
+    python tools/recategorize.py --bucket ecomonitor-raw-b01006432 --start 2024-05-01 --end 2024-06-01 --bands bands.json --workers 8 [--dry-run]
+"""
+import argparse
+import datetime
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+TERRAFORM_DIR = os.path.dirname(TOOLS_DIR)
+sys.path[:0] = [os.path.join(TERRAFORM_DIR, 'layers', 'common', 'python')]
+
+from ecomonitor import classification, columnar
+from ecomonitor.profiles import PROFILES
+from ecomonitor.runtime import get_client
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+
+ARCHIVE_PREFIX = os.environ.get('COMPACTION_OUTPUT_PREFIX', 'compacted/')
+SENSOR_TYPES = ['temperature', 'humidity', 'aqi', 'co2']
+
+def partition_date(key):
+    """The dt=YYYY-MM-DD partition of an archive key, or None"""
+    for part in key.split('/'):
+        if part.startswith('dt='):
+            return part[3:]
+    return None
+
+def list_archive_keys(s3, bucket, sensor_type, start=None, end=None):
+    """Compacted data files of one sensor type whose dt partition is in [start, end)"""
+    prefix = f"{ARCHIVE_PREFIX}{sensor_type}/"
+    kwargs = {'Bucket': bucket, 'Prefix': prefix}
+    if start:
+        kwargs['StartAfter'] = f"{prefix}dt={start}"
+    keys = []
+    while True:
+        response = s3.list_objects_v2(**kwargs)
+        for entry in response.get('Contents', []):
+            key = entry['Key']
+            day = partition_date(key)
+            if day is None or '/part-' not in key:
+                continue
+            if end and day >= end:
+                return keys
+            keys.append(key)
+        if not response.get('IsTruncated'):
+            return keys
+        kwargs.pop('StartAfter', None)
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+def recategorize_ecol(body, table, value_field):
+    """Returns (new body, rows, changed rows)"""
+    columns = columnar.decode_columns(body)
+    rows = len(next(iter(columns.values()))) if columns else 0
+    if value_field not in columns:
+        return body, rows, 0
+    changed = [False] * rows
+    for name, labels in table.classify_array(columns[value_field]).items():
+        previous = columns.get(name, [None] * rows)
+        for position, (old, new) in enumerate(zip(previous, labels)):
+            if old != new:
+                changed[position] = True
+        columns[name] = labels
+    return columnar.encode_columns(columns, rows), rows, sum(changed)
+
+def recategorize_parquet(body, table, value_field):
+    """Returns (new body, rows, changed rows)"""
+    data = parquet.read_table(io.BytesIO(body))
+    if value_field not in data.column_names:
+        return body, data.num_rows, 0
+    values = data.column(value_field).to_numpy(zero_copy_only=False)
+    changed = [False] * data.num_rows
+    for name, labels in table.classify_array(values).items():
+        column = pyarrow.array(labels, type=pyarrow.string())
+        if name in data.column_names:
+            for position, (old, new) in enumerate(zip(data.column(name).to_pylist(), labels)):
+                if old != new:
+                    changed[position] = True
+            data = data.set_column(data.column_names.index(name), name, column)
+        else:
+            changed = [changed[position] or label is not None for position, label in enumerate(labels)]
+            data = data.append_column(name, column)
+    buffer = io.BytesIO()
+    parquet.write_table(data, buffer, compression='zstd')
+    return buffer.getvalue(), data.num_rows, sum(changed)
+
+def recategorize_file(bucket, key, sensor_type, dry_run=False, s3=None):
+    """Re-classify one archive file. Returns a summary dict."""
+    started = time.perf_counter()
+    s3 = s3 or get_client('s3')
+    table = classification.get_bands(sensor_type)
+    value_field = PROFILES[sensor_type].value_field
+    body = s3.get_object(Bucket=bucket, Key=key)['Body'].read()
+
+    if key.endswith('.parquet'):
+        if pyarrow is None:
+            raise ValueError("Parquet archives require pyarrow")
+        new_body, rows, changed = recategorize_parquet(body, table, value_field)
+    elif key.endswith(columnar.FILE_EXTENSION):
+        new_body, rows, changed = recategorize_ecol(body, table, value_field)
+    else:
+        return {'key': key, 'skipped': True}
+
+    if changed and not dry_run:
+        s3.put_object(Bucket=bucket, Key=key, Body=new_body)
+    return {
+        'key': key,
+        'rows': rows,
+        'changed_rows': changed,
+        'written': bool(changed) and not dry_run,
+        'elapsed_seconds': round(time.perf_counter() - started, 3),
+    }
+
+def load_bands(path):
+    """Process pool initializer: every worker classifies with the same tables"""
+    if path:
+        classification.load_band_tables(path)
+
+def run(bucket, sensor_types=SENSOR_TYPES, start=None, end=None, bands=None, workers=os.cpu_count() or 1, dry_run=False):
+    load_bands(bands)
+    s3 = get_client('s3')
+    # Listing is I/O bound, so the sensor type prefixes are listed concurrently
+    with ThreadPoolExecutor(max_workers=max(1, len(sensor_types))) as executor:
+        listings = executor.map(lambda sensor_type: list_archive_keys(s3, bucket, sensor_type, start, end), sensor_types)
+        jobs = [(bucket, key, sensor_type, dry_run) for sensor_type, keys in zip(sensor_types, listings) for key in keys]
+
+    summaries = []
+    if workers <= 1:
+        for job in jobs:
+            summaries.append(recategorize_file(*job, s3=s3))
+        return summaries
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_bands, initargs=(bands,)) as executor:
+        futures = {executor.submit(recategorize_file, *job): job for job in jobs}
+        for future in as_completed(futures):
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                key = futures[future][1]
+                print(f"❌ {key}: {str(e)}", file=sys.stderr)
+                summaries.append({'key': key, 'error': str(e)})
+    return summaries
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-apply classification bands to the compacted reading archive")
+    parser.add_argument('--bucket', default=os.environ.get('RAW_BUCKET_NAME'), required=os.environ.get('RAW_BUCKET_NAME') is None)
+    parser.add_argument('--sensor-types', default=','.join(SENSOR_TYPES))
+    parser.add_argument('--start', help='first dt partition, e.g. 2024-05-01')
+    parser.add_argument('--end', help='end dt partition (exclusive)')
+    parser.add_argument('--bands', help='JSON file of {sensor_type: [bands...]} replacing the default tables')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--dry-run', action='store_true', help='count changed rows without rewriting files')
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    summaries = run(
+        args.bucket,
+        [sensor_type.strip() for sensor_type in args.sensor_types.split(',') if sensor_type.strip()],
+        args.start,
+        args.end,
+        args.bands,
+        args.workers,
+        args.dry_run
+    )
+    elapsed = time.perf_counter() - started
+    done = [summary for summary in summaries if 'rows' in summary]
+    failed = [summary for summary in summaries if 'error' in summary]
+    rows = sum(summary['rows'] for summary in done)
+    print(
+        f"{'Checked' if args.dry_run else 'Recategorized'} {rows} readings in {len(done)} files in {elapsed:.1f}s "
+        f"({rows / elapsed if elapsed else 0:.0f} rows/s): {sum(summary['changed_rows'] for summary in done)} changed, "
+        f"{sum(1 for summary in done if summary['written'])} files rewritten, {len(failed)} failed"
+    )
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
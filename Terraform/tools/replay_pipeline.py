@@ -0,0 +1,719 @@
+"""
+Deterministic in-process replay of the IoT → S3 → processor pipeline.
+
+Device messages (synthetic or recorded) go through an emulation of every stage
+between the simulators and DynamoDB:
+
+- IoT topic rules, read from `IoT Core.tf`: topic filter matching (+ and #),
+  the SELECT projections (`*`, `timestamp() as received_at`, ...) and the S3
+  action's key template (${timestamp()}, ${newuuid()}, ${topic()}). A rule key
+  that Terraform itself would interpolate (an unescaped ${...}) is evaluated
+  once, like `terraform apply` would, and reported;
+- S3 notifications, read from `s3.tf`: prefix/suffix filters of the
+  processor's lambda_function blocks; every put of a matching key is one event;
+- the processor: `s3_to_dynamo.lambda_handler` runs for real, one record per
+  invocation as S3 delivers them, against the in-memory stand-ins of
+  tools/fakes.py, behind a modelled pool of `--concurrency` Lambda workers with
+  the async retries of a failed invocation (1 and 2 minutes later).
+
+Time is simulated: IoT and notification delays are drawn from seeded latency
+models, an invocation lasts as long as its handler took (times
+--duration-scale, or a fixed --handler-ms) plus whatever it slept on the
+simulated clock, and nothing waits in real time. The same seed and traffic
+always give the same objects, events and items (and, with --handler-ms, the
+same latencies). A replay runs as fast as the processor transforms readings
+in-process, roughly 1,000 readings/s with the default derived state, so an
+hour of 10,000 devices reporting every 5 minutes takes about two minutes and a
+whole day under an hour. --time-warp compresses the traffic's publish times,
+e.g. 24 to push a day's messages through in one simulated hour.
+
+The report covers what the pipeline would do with that traffic: readings lost
+to S3 key overwrites, end-to-end latency (publish → processor done) and
+queueing, invocations, peak concurrency, and the table's write units per
+second, so fleet sizes and pipeline changes can be checked before they reach
+AWS.
+
+Usage:
+    python tools/replay_pipeline.py --devices 10000 --interval 300 --duration 86400 --format envelope
+    python tools/replay_pipeline.py --devices 500 --duration 3600 --format json --record traffic.ndjson
+    python tools/replay_pipeline.py --traffic traffic.ndjson --time-warp 12 --write-capacity table=20,DateIndex=10
+"""
+import argparse
+import base64
+import collections
+import datetime
+import hashlib
+import heapq
+import json
+import logging
+import math
+import os
+import random
+import re
+import sys
+import time
+import urllib.parse
+import uuid
+
+import benchmark_processor
+from benchmark_processor import TERRAFORM_DIR, parse_capacity
+
+import fakes
+from ecomonitor import envelope
+from ecomonitor.profiles import PROFILES
+
+BUCKET = 'ecomonitor-replay'
+PROCESSOR_FUNCTION = 's3_to_dynamo_function'
+RULES_FILE = os.path.join(TERRAFORM_DIR, 'IoT Core.tf')
+NOTIFICATIONS_FILE = os.path.join(TERRAFORM_DIR, 's3.tf')
+DEFAULT_START = '2024-05-01T00:00:00'
+LOCATIONS = ['EcoMonitor_Zone_A', 'EcoMonitor_Zone_B', 'EcoMonitor_Zone_C', 'EcoMonitor_Zone_D']
+# Lambda retries a failed asynchronous invocation twice, about 1 and 2 minutes later
+ASYNC_RETRY_DELAYS_MS = (60000, 120000)
+
+Message = collections.namedtuple('Message', 'published_ms topic payload readings')
+
+def iso(epoch_ms):
+    return datetime.datetime.utcfromtimestamp(epoch_ms / 1000.0).isoformat(timespec='milliseconds')
+
+def weighted_summary(samples):
+    """p50/p95/p99/max of [(value, weight)]"""
+    if not samples:
+        return {'count': 0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    ordered = sorted(samples)
+    total = sum(weight for _, weight in ordered)
+
+    def at(pct):
+        threshold = math.ceil(pct / 100.0 * total)
+        running = 0
+        for value, weight in ordered:
+            running += weight
+            if running >= threshold:
+                return value
+        return ordered[-1][0]
+
+    return {
+        'count': total,
+        'p50_ms': round(at(50), 1),
+        'p95_ms': round(at(95), 1),
+        'p99_ms': round(at(99), 1),
+        'max_ms': round(ordered[-1][0], 1),
+    }
+
+# --- Terraform ---------------------------------------------------------------
+
+def resource_blocks(text, resource_type):
+    """(name, body) of every `resource "<type>" "<name>" { ... }` block"""
+    blocks = []
+    for match in re.finditer(rf'resource\s+"{resource_type}"\s+"([\w-]+)"\s*{{', text):
+        depth, position = 1, match.end()
+        while depth and position < len(text):
+            depth += {'{': 1, '}': -1}.get(text[position], 0)
+            position += 1
+        blocks.append((match.group(1), text[match.end():position - 1]))
+    return blocks
+
+def nested_blocks(body, block_type):
+    """Bodies of the `<block_type> { ... }` blocks directly inside a resource body (no nesting below them)"""
+    return re.findall(rf'^\s*{block_type}\s*{{(.*?)^\s*}}', body, re.M | re.S)
+
+def attribute(body, name):
+    match = re.search(rf'^\s*{name}\s*=\s*"((?:[^"\\]|\\.)*)"', body, re.M)
+    if match:
+        return match.group(1)
+    match = re.search(rf'^\s*{name}\s*=\s*([\w.\[\]-]+)', body, re.M)
+    return match.group(1) if match else None
+
+class KeyTemplate:
+    """
+    S3 action key of a topic rule. `$${...}` is passed on to IoT as a substitution
+    template; an unescaped `${...}` is a Terraform interpolation, fixed once at apply time.
+    """
+    PART = re.compile(r'(\$?)\$\{([^}]*)\}')
+
+    def __init__(self, text, applied_at_ms):
+        self.text = text
+        self.parts = []
+        self.terraform_interpolations = []
+        position = 0
+        for match in self.PART.finditer(text):
+            self.parts.append(('literal', text[position:match.start()]))
+            expression = match.group(2).strip()
+            if match.group(1):
+                self.parts.append(('iot', expression))
+            else:
+                self.terraform_interpolations.append(expression)
+                self.parts.append(('literal', self._terraform_value(expression, applied_at_ms)))
+            position = match.end()
+        self.parts.append(('literal', text[position:]))
+
+    @staticmethod
+    def _terraform_value(expression, applied_at_ms):
+        if expression == 'timestamp()':
+            return datetime.datetime.utcfromtimestamp(applied_at_ms / 1000.0).strftime('%Y-%m-%dT%H:%M:%SZ')
+        return f"<{expression}>"
+
+    def render(self, context):
+        return ''.join(value if kind == 'literal' else str(context.function(value)) for kind, value in self.parts)
+
+class RuleContext:
+    """Values of the IoT SQL functions for one message"""
+
+    def __init__(self, topic, now_ms, rng):
+        self.topic = topic
+        self.now_ms = now_ms
+        self._rng = rng
+
+    def function(self, expression):
+        name, _, argument = expression.partition('(')
+        argument = argument.rstrip(')').strip()
+        if name == 'timestamp':
+            return self.now_ms
+        if name == 'newuuid':
+            return str(uuid.UUID(int=self._rng.getrandbits(128), version=4))
+        if name == 'topic':
+            return self.topic if not argument else self.topic.split('/')[int(argument) - 1]
+        raise ValueError(f"Unsupported IoT SQL function: {expression}")
+
+def topic_matches(topic_filter, topic):
+    """MQTT topic filter match (+ = one level, trailing # = any remaining levels)"""
+    filters, levels = topic_filter.split('/'), topic.split('/')
+    for position, part in enumerate(filters):
+        if part == '#':
+            return True
+        if position >= len(levels) or (part != '+' and part != levels[position]):
+            return False
+    return len(filters) == len(levels)
+
+class TopicRule:
+    """An aws_iot_topic_rule with an S3 action: SELECT projections, topic filter and key template"""
+    SQL = re.compile(r"^\s*SELECT\s+(.*?)\s+FROM\s+'([^']+)'\s*$", re.I | re.S)
+    PROJECTION = re.compile(r'^(\w+)\(([^)]*)\)\s+as\s+(\w+)$', re.I)
+
+    def __init__(self, name, sql, key, applied_at_ms):
+        match = self.SQL.match(sql)
+        if not match:
+            raise ValueError(f"Unsupported SQL in topic rule {name}: {sql}")
+        self.name = name
+        self.topic_filter = match.group(2)
+        self.select_all = False
+        self.projections = []
+        for projection in (part.strip() for part in match.group(1).split(',')):
+            if projection == '*':
+                self.select_all = True
+                continue
+            function = self.PROJECTION.match(projection)
+            if not function:
+                raise ValueError(f"Unsupported projection in topic rule {name}: {projection}")
+            self.projections.append((f"{function.group(1)}({function.group(2)})", function.group(3)))
+        self.key = KeyTemplate(key, applied_at_ms)
+
+    def matches(self, topic):
+        return topic_matches(self.topic_filter, topic)
+
+    def apply(self, payload, context):
+        """Object body the S3 action writes for a message payload"""
+        if not self.projections:
+            return payload  # SELECT * keeps the payload as published, binary included
+        document = json.loads(payload) if self.select_all else {}
+        for function, alias in self.projections:
+            document[alias] = context.function(function)
+        return json.dumps(document).encode('utf-8')
+
+def load_topic_rules(path, applied_at_ms):
+    with open(path) as rules_file:
+        text = rules_file.read()
+    rules = []
+    for name, body in resource_blocks(text, 'aws_iot_topic_rule'):
+        if attribute(body, 'enabled') == 'false':
+            continue
+        for action in nested_blocks(body, 's3'):
+            rules.append(TopicRule(attribute(body, 'name') or name, attribute(body, 'sql'), attribute(action, 'key'), applied_at_ms))
+    return rules
+
+def load_notification_filters(path, function=PROCESSOR_FUNCTION):
+    """(prefix, suffix) of every S3 notification that invokes the processor"""
+    with open(path) as notifications_file:
+        text = notifications_file.read()
+    filters = []
+    for _, body in resource_blocks(text, 'aws_s3_bucket_notification'):
+        for target in nested_blocks(body, 'lambda_function'):
+            if function in (attribute(target, 'lambda_function_arn') or ''):
+                filters.append((attribute(target, 'filter_prefix') or '', attribute(target, 'filter_suffix') or ''))
+    return filters
+
+# --- Traffic -----------------------------------------------------------------
+
+def synthetic_devices(count):
+    sensor_types = sorted(PROFILES)
+    return [
+        {
+            'device_id': f"replay_{sensor_types[n % len(sensor_types)]}_{n:05d}",
+            'sensor_type': sensor_types[n % len(sensor_types)],
+            'location': LOCATIONS[n // len(sensor_types) % len(LOCATIONS)],
+        }
+        for n in range(count)
+    ]
+
+def catalog_devices(path):
+    """Devices of a fleet catalog (see `IoT devices/Fleet.py`)"""
+    sys.path.insert(0, os.path.join(TERRAFORM_DIR, 'IoT devices'))
+    import Fleet
+    with open(path) as catalog_file:
+        return Fleet.expand_catalog(json.load(catalog_file))
+
+def synthetic_traffic(devices, start_ms, duration_ms, interval_ms, payload_format, envelope_size, rng):
+    """
+    Messages of `devices` reporting every `interval_ms`. 'json' devices publish on
+    their own, at a fixed random phase within the interval, like the single-device
+    simulators; the envelope formats publish each round at once, like Fleet.
+    """
+    end_ms = start_ms + duration_ms
+    if payload_format == 'json':
+        phases = sorted((rng.randrange(interval_ms), position) for position in range(len(devices)))
+        for round_start in range(start_ms, end_ms, interval_ms):
+            for phase, position in phases:
+                published_ms = round_start + phase
+                if published_ms >= end_ms:
+                    break
+                device = devices[position]
+                profile = PROFILES[device['sensor_type']]
+                payload = profile.build_payload(device['device_id'], profile.sample(device.get('distribution'), rng),
+                                                str(published_ms), iso(published_ms), device.get('location'))
+                yield Message(published_ms, profile.topic, json.dumps(payload).encode('utf-8'), 1)
+        return
+
+    encoding = 'json' if payload_format == 'envelope-json' else 'binary'
+    for number, round_start in enumerate(range(start_ms, end_ms, interval_ms)):
+        entries = []
+        for device in devices:
+            profile = PROFILES[device['sensor_type']]
+            entries.append((device['device_id'], profile.sensor_type, profile.sample(device.get('distribution'), rng),
+                            round_start, device.get('location'), profile.unit))
+        for payload, group in envelope.pack(entries, f"replay-{number}", envelope_size, encoding):
+            yield Message(round_start, envelope.ENVELOPE_TOPIC, payload, len(group))
+
+def recorded_traffic(path):
+    """
+    Messages of an NDJSON traffic file, one per line:
+    {"published_ms": ..., "topic": ..., "payload": <text or JSON> | "payload_b64": ..., "readings": n}
+    """
+    messages = []
+    with open(path) as traffic_file:
+        for line in traffic_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if 'payload_b64' in entry:
+                payload = base64.b64decode(entry['payload_b64'])
+            elif isinstance(entry['payload'], str):
+                payload = entry['payload'].encode('utf-8')
+            else:
+                payload = json.dumps(entry['payload']).encode('utf-8')
+            messages.append(Message(int(entry['published_ms']), entry['topic'], payload, int(entry.get('readings', 1))))
+    messages.sort(key=lambda message: message.published_ms)
+    return messages
+
+def record_traffic(messages, path):
+    """Pass messages through while writing them to an NDJSON traffic file"""
+    with open(path, 'w') as traffic_file:
+        for message in messages:
+            entry = {'published_ms': message.published_ms, 'topic': message.topic, 'readings': message.readings}
+            try:
+                entry['payload'] = message.payload.decode('utf-8')
+            except UnicodeDecodeError:
+                entry['payload_b64'] = base64.b64encode(message.payload).decode('ascii')
+            traffic_file.write(json.dumps(entry) + '\n')
+            yield message
+
+def time_warped(messages, factor):
+    """Publish times compressed by `factor` around the first message"""
+    origin = None
+    for message in messages:
+        if origin is None:
+            origin = message.published_ms
+        yield message._replace(published_ms=origin + int((message.published_ms - origin) / factor))
+
+# --- Simulation --------------------------------------------------------------
+
+class SimulatedClock:
+    """
+    Clock of the invocation being run: its simulated start plus the handler's
+    elapsed real time (times `scale`, or a fixed `handler_ms`) plus what it slept on this clock.
+    """
+
+    def __init__(self, start_ms, scale=1.0, handler_ms=None):
+        self.scale = scale
+        self.handler_ms = handler_ms
+        self._base_ms = start_ms
+        self._started = time.perf_counter()
+        self.slept_ms = 0.0
+        self._latest = 0.0
+
+    def begin(self, at_ms):
+        self._base_ms = at_ms
+        self._started = time.perf_counter()
+        self.slept_ms = 0.0
+
+    def elapsed_ms(self):
+        if self.handler_ms is not None:
+            return self.handler_ms + self.slept_ms
+        return (time.perf_counter() - self._started) * 1000.0 * self.scale + self.slept_ms
+
+    def now_ms(self):
+        return self._base_ms + self.elapsed_ms()
+
+    def monotonic(self):
+        return self.now_ms() / 1000.0
+
+    def sleep(self, seconds):
+        self.slept_ms += max(0.0, seconds) * 1000.0
+
+    def capacity_clock(self):
+        """Never goes backwards: overlapping invocations run one after another here, in start order"""
+        self._latest = max(self._latest, self.monotonic())
+        return self._latest
+
+class ObjectVersion:
+    """One put of a key: the readings it carries and when they were published"""
+    __slots__ = ('readings', 'published_ms', 'delivered')
+
+    def __init__(self, readings, published_ms):
+        self.readings = readings
+        self.published_ms = published_ms
+        self.delivered = False
+
+class Replay:
+    """Discrete-event emulation of the pipeline around the real processor"""
+
+    def __init__(self, processor, rules, filters, args):
+        self.processor = processor
+        self.rules = rules
+        self.filters = filters
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.iot_latency = fakes.LatencyModel(args.iot_latency_ms, args.iot_latency_ms / 2, random.Random(args.seed + 1))
+        self.notify_latency = fakes.LatencyModel(args.notify_latency_ms, args.notify_latency_ms / 2, random.Random(args.seed + 2))
+        self.clock = SimulatedClock(0, args.duration_scale, args.handler_ms)
+
+        self.events = []  # (time ms, sequence, kind, data)
+        self.sequence = 0
+        self.versions = {}  # key → current ObjectVersion
+        self.pending = collections.Counter()  # key → undelivered notifications
+        self.queue = collections.deque()  # (notified ms, key, attempt)
+        self.busy = 0
+        self.warm = 0
+        self.written_keys = []
+
+        self.stats = collections.Counter()
+        self.rule_stats = {rule.name: collections.Counter() for rule in rules}
+        self.status_codes = collections.Counter()
+        self.latency = []  # (publish → processed ms, readings)
+        self.queue_wait = []
+        self.handler_ms = []
+        self.units_per_minute = collections.Counter()
+        self.first_ms = self.last_ms = None
+
+    def push(self, at_ms, kind, data):
+        self.sequence += 1
+        heapq.heappush(self.events, (at_ms, self.sequence, kind, data))
+
+    def notified(self, key):
+        return any(key.startswith(prefix) and key.endswith(suffix) for prefix, suffix in self.filters)
+
+    def publish(self, message):
+        self.stats['messages'] += 1
+        self.stats['readings_published'] += message.readings
+        self.stats['payload_bytes'] += len(message.payload)
+        self.first_ms = message.published_ms if self.first_ms is None else self.first_ms
+        self.last_ms = message.published_ms
+        for rule in self.rules:
+            if rule.matches(message.topic):
+                self.push(message.published_ms + self.iot_latency.delay() * 1000.0, 'rule', (rule, message))
+
+    def run_rule(self, now_ms, rule, message):
+        stats = self.rule_stats[rule.name]
+        context = RuleContext(message.topic, int(now_ms), self.rng)
+        try:
+            body = rule.apply(message.payload, context)
+            key = rule.key.render(context)
+        except ValueError:
+            stats['errors'] += 1
+            return
+        stats['puts'] += 1
+        notify = self.notified(key)
+        # An overwrite is a put over an object the processor has not read yet (its readings
+        # are lost), or over any earlier object for keys that notify nothing
+        if notify:
+            previous = self.versions.get(key)
+            if previous is not None and not previous.delivered:
+                stats['overwrites'] += 1
+                self.stats['readings_overwritten'] += previous.readings
+        elif (BUCKET, key) in self.processor.s3_client.objects:
+            stats['overwrites'] += 1
+        self.processor.s3_client.objects[(BUCKET, key)] = body
+        if not notify:
+            return
+        self.versions[key] = ObjectVersion(message.readings, message.published_ms)
+        self.pending[key] += 1
+        self.stats['notifications'] += 1
+        self.push(now_ms + self.notify_latency.delay() * 1000.0, 'notify', (key, 0))
+
+    def dispatch(self, now_ms):
+        while self.queue and self.busy < self.args.concurrency:
+            notified_ms, key, attempt = self.queue.popleft()
+            self.busy += 1
+            self.stats['peak_concurrency'] = max(self.stats['peak_concurrency'], self.busy)
+            start_ms = now_ms
+            if self.warm:
+                self.warm -= 1
+            else:
+                self.stats['cold_starts'] += 1
+                start_ms += self.args.cold_start_ms
+            self.queue_wait.append((now_ms - notified_ms, 1))
+            self.invoke(start_ms, key, attempt)
+
+    def invoke(self, start_ms, key, attempt):
+        body = self.processor.s3_client.objects.get((BUCKET, key), b'')
+        version = self.versions.get(key)
+        self.stats['invocations'] += 1
+        record = {
+            'eventSource': 'aws:s3',
+            'eventTime': iso(start_ms) + 'Z',
+            's3': {
+                'bucket': {'name': BUCKET},
+                'object': {'key': urllib.parse.quote_plus(key, safe='/'), 'size': len(body), 'eTag': hashlib.md5(body).hexdigest(),
+                           'sequencer': f"{self.stats['notifications']:016X}"},
+            },
+        }
+        units_before = self.processor.dynamodb.consumed_units
+        self.clock.begin(start_ms)
+        try:
+            response = self.processor.lambda_handler({'Records': [record]}, fakes.FakeContext(aws_request_id=f"replay-{self.stats['invocations']}"))
+            status_code = response['statusCode']
+        except Exception:
+            status_code = None
+        duration_ms = self.clock.elapsed_ms()
+        finish_ms = start_ms + duration_ms
+        self.handler_ms.append((duration_ms, 1))
+        self.stats['billed_ms'] += math.ceil(duration_ms)
+        self.units_per_minute[int(start_ms // 60000)] += self.processor.dynamodb.consumed_units - units_before
+        self.processor.metrics._client.calls.clear()
+
+        if status_code is None:
+            self.stats['failed_invocations'] += 1
+            if attempt < len(ASYNC_RETRY_DELAYS_MS):
+                self.stats['retries'] += 1
+                self.push(finish_ms + ASYNC_RETRY_DELAYS_MS[attempt], 'notify', (key, attempt + 1))
+                self.push(finish_ms, 'finish', None)
+                return
+        else:
+            self.status_codes[status_code] += 1
+        if status_code in (200, 207) and version is not None and not version.delivered:
+            version.delivered = True
+            self.stats['readings_delivered'] += version.readings
+            self.latency.append((finish_ms - version.published_ms, version.readings))
+        self.pending[key] -= 1
+        if not self.pending[key]:
+            del self.pending[key]
+            if not self.args.keep_data:
+                self.processor.s3_client.objects.pop((BUCKET, key), None)
+                self.versions.pop(key, None)
+        self.push(finish_ms, 'finish', None)
+
+    def discard_written(self):
+        """Drop the reading items the invocation wrote (derived partitions stay), bounding memory on long replays"""
+        table = self.processor.dynamodb.Table(self.processor.TABLE_NAME)
+        for item in self.written_keys:
+            table.items.pop(item, None)
+        self.written_keys.clear()
+
+    def run(self, messages):
+        messages = iter(messages)
+        upcoming = next(messages, None)
+        while upcoming is not None or self.events:
+            if upcoming is not None and (not self.events or upcoming.published_ms <= self.events[0][0]):
+                self.publish(upcoming)
+                upcoming = next(messages, None)
+                continue
+            now_ms, _, kind, data = heapq.heappop(self.events)
+            if kind == 'rule':
+                self.run_rule(now_ms, *data)
+            elif kind == 'notify':
+                key, attempt = data
+                self.queue.append((now_ms, key, attempt))
+                self.stats['peak_queue'] = max(self.stats['peak_queue'], len(self.queue))
+            else:  # finish
+                self.busy -= 1
+                self.warm += 1
+                self.stats['finished_ms'] = max(self.stats['finished_ms'], now_ms)
+            if not self.args.keep_data:
+                self.discard_written()
+            self.dispatch(now_ms)
+
+    def report(self, wall_seconds):
+        stats = self.stats
+        simulated_seconds = max(0.0, (stats['finished_ms'] - (self.first_ms or 0)) / 1000.0) if self.first_ms is not None else 0.0
+        traffic_seconds = max(1.0, ((self.last_ms or 0) - (self.first_ms or 0)) / 1000.0)
+        peak_units = max(self.units_per_minute.values(), default=0.0) / 60.0
+        return {
+            'traffic': {
+                'messages': stats['messages'],
+                'readings': stats['readings_published'],
+                'payload_bytes': stats['payload_bytes'],
+                'bytes_per_reading': round(stats['payload_bytes'] / max(1, stats['readings_published']), 1),
+                'span_seconds': round(traffic_seconds, 1),
+            },
+            'rules': {name: dict(counters) for name, counters in self.rule_stats.items() if counters},
+            'readings': {
+                'published': stats['readings_published'],
+                'delivered': stats['readings_delivered'],
+                'written': stats['readings_written'],
+                'overwritten_in_s3': stats['readings_overwritten'],
+                'undelivered': stats['readings_published'] - stats['readings_delivered'],
+            },
+            'latency': weighted_summary(self.latency),
+            'lambda': {
+                'notifications': stats['notifications'],
+                'invocations': stats['invocations'],
+                'failed_invocations': stats['failed_invocations'],
+                'retries': stats['retries'],
+                'status_codes': {str(code): count for code, count in sorted(self.status_codes.items())},
+                'cold_starts': stats['cold_starts'],
+                'peak_concurrency': stats['peak_concurrency'],
+                'peak_queue': stats['peak_queue'],
+                'queue_wait': weighted_summary(self.queue_wait),
+                'duration': weighted_summary(self.handler_ms),
+                'billed_seconds': round(stats['billed_ms'] / 1000.0, 1),
+            },
+            'dynamodb': {
+                'consumed_write_units': round(self.processor.dynamodb.consumed_units, 1),
+                'average_wcu': round(self.processor.dynamodb.consumed_units / max(1.0, simulated_seconds), 2),
+                'peak_minute_wcu': round(peak_units, 2),
+                'throttles': self.processor.dynamodb.throttles,
+            },
+            'throughput': {
+                'simulated_seconds': round(simulated_seconds, 1),
+                'readings_per_simulated_second': round(stats['readings_delivered'] / max(1.0, simulated_seconds), 2),
+                'wall_seconds': round(wall_seconds, 1),
+                'readings_per_wall_second': round(stats['readings_delivered'] / max(wall_seconds, 1e-9), 1),
+                'speedup': round(simulated_seconds / max(wall_seconds, 1e-9), 1),
+            },
+        }
+
+def install_pipeline(processor, replay, args):
+    """Point the processor at fresh in-memory services on the simulated clock"""
+    clock = replay.clock
+    processor.s3_client = fakes.FakeS3Client()
+    processor.dynamodb = fakes.FakeDynamoResource(write_capacity=args.write_capacity, clock=clock.capacity_clock)
+    processor.sns_client = fakes.FakeSNSClient()
+    processor.metrics._client = fakes.FakeCloudWatchClient()
+    processor.TABLE_NAME = benchmark_processor.TABLE_NAME
+    processor.recent_keys.invalidate()
+    processor.capacity._schedulers.clear()
+    if args.write_capacity:
+        capacities, index_keys = processor.capacity.provisioned_write_capacity(processor.dynamodb.meta.client, processor.TABLE_NAME)
+        processor.capacity._schedulers[processor.TABLE_NAME] = processor.capacity.WriteScheduler(
+            capacities, index_keys, clock=clock.capacity_clock, sleep=clock.sleep)
+
+    # Count what the processor actually stored, and remember it for discard_written()
+    record_written = processor.record_written
+
+    def counted(items):
+        replay.stats['readings_written'] += len(items)
+        replay.written_keys.extend(processor.item_key(item) for item in items)
+        return record_written(items)
+
+    processor.record_written = counted
+
+def print_report(report):
+    traffic, readings, latency, lam, ddb, throughput = (report[name] for name in
+                                                        ('traffic', 'readings', 'latency', 'lambda', 'dynamodb', 'throughput'))
+    print(f"traffic     {traffic['messages']} messages, {traffic['readings']} readings over {traffic['span_seconds']}s "
+          f"({traffic['bytes_per_reading']} B/reading)")
+    for name, counters in report['rules'].items():
+        print(f"rule        {name}: {counters.get('puts', 0)} puts, {counters.get('overwrites', 0)} overwrites, {counters.get('errors', 0)} errors")
+    print(f"readings    delivered {readings['delivered']}/{readings['published']}, written {readings['written']}, "
+          f"lost to S3 overwrites {readings['overwritten_in_s3']}")
+    print(f"latency     publish → processed p50/p95/p99/max ms: {latency['p50_ms']}/{latency['p95_ms']}/{latency['p99_ms']}/{latency['max_ms']}")
+    print(f"lambda      {lam['invocations']} invocations ({lam['failed_invocations']} failed, {lam['retries']} retried), "
+          f"status {lam['status_codes']}, peak concurrency {lam['peak_concurrency']}, peak queue {lam['peak_queue']}, "
+          f"queue wait p95 {lam['queue_wait']['p95_ms']} ms, duration p95 {lam['duration']['p95_ms']} ms, "
+          f"{lam['billed_seconds']} billed s")
+    print(f"dynamodb    {ddb['consumed_write_units']} WCU consumed, average {ddb['average_wcu']} WCU/s, "
+          f"peak minute {ddb['peak_minute_wcu']} WCU/s, {ddb['throttles']} throttles")
+    print(f"throughput  {throughput['readings_per_simulated_second']} readings/simulated s, "
+          f"{throughput['readings_per_wall_second']} readings/wall s, {throughput['speedup']}x real time")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    source = parser.add_argument_group('traffic')
+    source.add_argument('--traffic', help='recorded NDJSON traffic file to replay instead of synthetic traffic')
+    source.add_argument('--record', help='also write the replayed traffic to this NDJSON file')
+    source.add_argument('--devices', type=int, default=100, help='synthetic fleet size (sensor types round-robin)')
+    source.add_argument('--catalog', help='fleet catalog to take the synthetic devices from instead')
+    source.add_argument('--interval', type=float, default=300, help='seconds between readings of a device')
+    source.add_argument('--duration', type=float, default=3600, help='simulated seconds of synthetic traffic')
+    source.add_argument('--format', choices=('json', 'envelope', 'envelope-json'), default='json',
+                        help="'json' = one message per reading, else Fleet-style envelopes")
+    source.add_argument('--envelope-size', type=int, default=500, help='readings per envelope')
+    source.add_argument('--start', default=DEFAULT_START, help='simulated start time (UTC, ISO 8601)')
+    source.add_argument('--time-warp', type=float, default=1.0, help='compress publish times by this factor')
+    source.add_argument('--seed', type=int, default=0)
+    model = parser.add_argument_group('pipeline model')
+    model.add_argument('--iot-latency-ms', type=float, default=20.0, help='publish → rule action delay (±50%%)')
+    model.add_argument('--notify-latency-ms', type=float, default=100.0, help='S3 put → Lambda event delay (±50%%)')
+    model.add_argument('--concurrency', type=int, default=1000, help='Lambda concurrency available to the processor')
+    model.add_argument('--cold-start-ms', type=float, default=0.0, help='added to every invocation on a new worker')
+    model.add_argument('--duration-scale', type=float, default=1.0, help='handler time multiplier (Lambda CPU vs this machine)')
+    model.add_argument('--handler-ms', type=float, help='fixed invocation duration instead of the measured one (reproducible latencies)')
+    model.add_argument('--write-capacity', type=parse_capacity, help="provision the table, e.g. 'table=20,DateIndex=10'")
+    model.add_argument('--keep-data', action='store_true', help='keep processed objects and reading items in memory')
+    parser.add_argument('--log-level', default='WARNING', help='processor log level; output is counted, not printed')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    args = parser.parse_args(argv)
+
+    start_ms = int(datetime.datetime.fromisoformat(args.start).replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
+    rules = load_topic_rules(RULES_FILE, start_ms)
+    filters = load_notification_filters(NOTIFICATIONS_FILE)
+    for rule in rules:
+        for expression in rule.key.terraform_interpolations:
+            print(f"warning: rule {rule.name} key {rule.key.text!r}: ${{{expression}}} is interpolated by Terraform at apply "
+                  f"time, not per message (escape it as $${{{expression}}})")
+
+    processor = benchmark_processor.load_processor()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    log_volume = benchmark_processor.LogVolume()
+    root.addHandler(log_volume)
+    root.setLevel(args.log_level.upper())
+
+    replay = Replay(processor, rules, filters, args)
+    install_pipeline(processor, replay, args)
+
+    if args.traffic:
+        messages = recorded_traffic(args.traffic)
+    else:
+        devices = catalog_devices(args.catalog)[:args.devices] if args.catalog else synthetic_devices(args.devices)
+        messages = synthetic_traffic(devices, start_ms, int(args.duration * 1000), int(args.interval * 1000),
+                                     args.format, args.envelope_size, random.Random(args.seed))
+    if args.record:
+        messages = record_traffic(messages, args.record)
+    if args.time_warp != 1.0:
+        messages = time_warped(messages, args.time_warp)
+
+    started = time.perf_counter()
+    replay.run(messages)
+    report = replay.report(time.perf_counter() - started)
+    report['settings'] = {name: value for name, value in vars(args).items() if name not in ('output',)}
+    report['log_lines'] = log_volume.lines
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2, default=str)
+        print(f"Report written to {args.output}")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())